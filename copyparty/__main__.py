@@ -730,6 +730,7 @@ def add_network(ap):
         ap2.add_argument("--freebind", action="store_true", help="allow listening on IPs which do not yet exist, for example if the network interfaces haven't finished going up. Only makes sense for IPs other than '0.0.0.0', '127.0.0.1', '::', and '::1'. May require running as root (unless net.ipv6.ip_nonlocal_bind)")
     ap2.add_argument("--s-thead", metavar="SEC", type=int, default=120, help="socket timeout (read request header)")
     ap2.add_argument("--s-tbody", metavar="SEC", type=float, default=186, help="socket timeout (read/write request/response bodies). Use 60 on fast servers (default is extremely safe). Disable with 0 if reverse-proxied for a 2%% speed boost")
+    ap2.add_argument("--park", metavar="SEC", type=float, default=-1, help="when a keepalive connection has been idle for SEC seconds after a request, stop holding a thread for it; instead wait for its next request in a shared poller (epoll/kqueue) and hand it back to the threadpool when it arrives, so the number of threads follows the number of active requests rather than open connections; [\033[32m-1\033[0m]=disable, 0.2=good value (always disabled on windows and python2)")
     ap2.add_argument("--s-wr-sz", metavar="B", type=int, default=256*1024, help="socket write size in bytes")
     ap2.add_argument("--s-wr-slp", metavar="SEC", type=float, default=0, help="debug: socket write delay in seconds")
     ap2.add_argument("--rsp-slp", metavar="SEC", type=float, default=0, help="debug: response delay in seconds")
@@ -918,7 +919,10 @@ def add_thumbnail(ap):
     ap2.add_argument("--th-no-webp", action="store_true", help="disable webp output")
     ap2.add_argument("--th-ff-jpg", action="store_true", help="force jpg output for video thumbs")
     ap2.add_argument("--th-ff-swr", action="store_true", help="use swresample instead of soxr for audio thumbs")
+    ap2.add_argument("--th-pre", action="store_true", help="create thumbnails of new files in the background as soon as up2k has indexed them (after an upload, or when found by a rescan), so nobody has to wait for them when opening the folder; this only happens while no thumbnails are being made for clients, one file at a time (volflag=thpre)")
+    ap2.add_argument("--th-pre-load", metavar="LOAD", type=float, default=float(CORES), help="pause the background thumbnailing (--th-pre) while the 1-minute system load average is above LOAD")
     ap2.add_argument("--th-poke", metavar="SEC", type=int, default=300, help="activity labeling cooldown -- avoids doing keepalive pokes (updating the mtime) on thumbnail folders more often than SEC seconds")
+    ap2.add_argument("--th-pack", action="store_true", help="store thumbnails in a few large segment files per volume (histpath/thp/) with a sqlite index, instead of one file each in histpath/th/; saves inodes, makes backups faster, and --th-clean only has to deal with expired thumbnails instead of walking through all of them. Thumbnails which were made before enabling this are not reused; they get made again")
     ap2.add_argument("--th-clean", metavar="SEC", type=int, default=43200, help="cleanup interval; 0=disabled")
     ap2.add_argument("--th-maxage", metavar="SEC", type=int, default=604800, help="max folder age -- folders which haven't been poked for longer than --th-poke seconds will get deleted every --th-clean seconds")
     ap2.add_argument("--th-covers", metavar="N,N", type=u, default="folder.png,folder.jpg,cover.png,cover.jpg", help="folder thumbnails to stat/look for; case-insensitive if -e2d")
@@ -954,11 +958,18 @@ def add_db_general(ap, hcores):
     ap2.add_argument("--no-forget", action="store_true", help="never forget indexed files, even when deleted from disk -- makes it impossible to ever upload the same file twice (volflag=noforget)")
     ap2.add_argument("--dbd", metavar="PROFILE", default="wal", help="database durability profile; sets the tradeoff between robustness and speed, see --help-dbd (volflag=dbd)")
     ap2.add_argument("--xlink", action="store_true", help="on upload: check all volumes for dupes, not just the target volume (volflag=xlink)")
+    ap2.add_argument("--idx-crc", action="store_true", help="also store the crc32 of each file in the database, calculated while hashing; \033[33m?zip=crc\033[0m downloads can then read each file once instead of twice, and announce a Content-Length with --zip-clen (volflag=idxcrc)")
     ap2.add_argument("--hash-mt", metavar="CORES", type=int, default=hcores, help="num cpu cores to use for file hashing; set 0 or 1 for single-core hashing")
+    ap2.add_argument("--hash-mp", metavar="PROCS", type=int, default=0, help="use a pool of PROCS processes for file hashing instead of \033[33m--hash-mt\033[0m threads; faster reindexing of large volumes by escaping the GIL, 0=off")
+    ap2.add_argument("--scan-mt", metavar="THREADS", type=int, default=0, help="num threads to read folder listings ahead with during volume scans; helps a lot on network filesystems (nfs, cifs), 0=off")
+    ap2.add_argument("--ls-cache", metavar="NUM", type=int, default=0, help="keep the stat results of large folders in memory (up to NUM files/folders in total), so repeated listings of the same folder are served without hitting the disk; a cached listing is dropped when the folder's mtime or up2k dhash changes, or when up2k uploads/moves/deletes something in it; [\033[32m0\033[0m]=disable, 65536=good starting point")
+    ap2.add_argument("--ls-cache-ttl", metavar="SEC", type=float, default=30, help="max age of a cached folder listing (see --ls-cache); this is the upper bound for how long a change which was not noticed by up2k (for example a file modified in-place outside of copyparty, in a volume without e2ds) can remain invisible")
+    ap2.add_argument("--inotify", action="store_true", help="linux-only: watch volumes for changes made outside of copyparty (rsync, samba, ...) and reindex just the modified folders within seconds, instead of periodic full rescans; needs -e2ds to set up the watches, and fs.inotify.max_user_watches large enough to cover all folders, otherwise falls back to \033[33m--re-maxage\033[0m (volflag=inotify)")
     ap2.add_argument("--re-maxage", metavar="SEC", type=int, default=0, help="disk rescan volume interval, 0=off (volflag=scan)")
     ap2.add_argument("--db-act", metavar="SEC", type=float, default=10, help="defer any scheduled volume reindexing until SEC seconds after last db write (uploads, renames, ...)")
     ap2.add_argument("--srch-time", metavar="SEC", type=int, default=45, help="search deadline -- terminate searches running for more than SEC seconds")
     ap2.add_argument("--srch-hits", metavar="N", type=int, default=7999, help="max search results to allow clients to fetch; 125 results will be shown initially")
+    ap2.add_argument("--srch-fts", action="store_true", help="maintain a full-text trigram index (sqlite fts5) of filenames, making substring searches by name much faster on large volumes; costs some extra disk space")
     ap2.add_argument("--dotsrch", action="store_true", help="show dotfiles in search results (volflags: dotsrch | nodotsrch)")
 
 
@@ -996,6 +1007,8 @@ def add_ui(ap, retry):
     ap2.add_argument("--ih", action="store_true", help="if a folder contains index.html, show that instead of the directory listing by default (can be changed in the client settings UI)")
     ap2.add_argument("--textfiles", metavar="CSV", type=u, default="txt,nfo,diz,cue,readme", help="file extensions to present as plaintext")
     ap2.add_argument("--txt-max", metavar="KiB", type=int, default=64, help="max size of embedded textfiles on ?doc= (anything bigger will be lazy-loaded by JS)")
+    ap2.add_argument("--zip-pf", metavar="NUM", type=int, default=16, help="when downloading folders as zip/tar, read up to NUM files ahead of the one being sent (small files into memory, larger ones as a readahead hint), so many small files on slow disks / network filesystems don't stall the download; [\033[32m0\033[0m]=disable")
+    ap2.add_argument("--zip-clen", metavar="NUM", type=int, default=0, help="announce the size (Content-Length) of tar downloads, and of \033[33m?zip=crc\033[0m downloads where every crc is indexed (--idx-crc), if the download has at most NUM files; the client can then show a progress bar, but the whole file listing has to be read before the download can start, which is slow on large folders / network filesystems; [\033[32m0\033[0m]=never")
     ap2.add_argument("--doctitle", metavar="TXT", type=u, default="copyparty", help="title / service-name to show in html documents")
     ap2.add_argument("--pb-url", metavar="URL", type=u, default="https://github.com/9001/copyparty", help="powered-by link; disable with -np")
     ap2.add_argument("--ver", action="store_true", help="show version on the control panel (incompatible by -np)")
@@ -1010,6 +1023,7 @@ def add_debug(ap):
     ap2.add_argument("--vc", action="store_true", help="verbose config file parser (explain config)")
     ap2.add_argument("--cgen", action="store_true", help="generate config file from current config (best-effort; probably buggy)")
     ap2.add_argument("--no-sendfile", action="store_true", help="disable sendfile; instead using a traditional file read loop")
+    ap2.add_argument("--no-cpr-cache", action="store_true", help="don't keep the web-ui resources (/.cpr/) in memory; reread them from disk for each request, for example while editing the web-ui")
     ap2.add_argument("--no-scandir", action="store_true", help="disable scandir; instead using listdir + stat on each file")
     ap2.add_argument("--no-fastboot", action="store_true", help="wait for up2k indexing before starting the httpd")
     ap2.add_argument("--no-htp", action="store_true", help="disable httpserver threadpool, create threads as-needed instead")
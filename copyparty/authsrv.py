@@ -491,11 +491,13 @@ class VFS(object):
         scandir: bool,
         permsets: list[list[bool]],
         lstat: bool = False,
+        fs: bool = True,
     ) -> tuple[str, list[tuple[str, os.stat_result]], dict[str, "VFS"]]:
-        """return user-readable [fsdir,real,virt] items at vpath"""
+        """return user-readable [fsdir,real,virt] items at vpath;
+        fs=False skips the real items (when the caller has them cached)"""
         virt_vis = {}  # nodes readable by user
         abspath = self.canonical(rem)
-        real = list(statdir(self.log, scandir, lstat, abspath))
+        real = list(statdir(self.log, scandir, lstat, abspath)) if fs else []
         real.sort()
         if not rem:
             # no vfs nodes in the list of real inodes
@@ -1597,10 +1599,18 @@ class AuthSrv(object):
         except Pebkac:
             self.warn_anonwrite = True
 
+        # changes along with the config; for validators (etags)
+        zl = [
+            x for x in sorted(vars(self.args).items()) if not hasattr(x[1], "__dict__")
+        ]
+        zs = repr([zl, [(k, v.flags) for k, v in sorted(vfs.all_vols.items())]])
+        zb = hashlib.sha1(zs.encode("utf-8", "replace")).digest()
+
         with self.mutex:
             self.vfs = vfs
             self.acct = acct
             self.iacct = {v: k for k, v in acct.items()}
+            self.cfg_sig = base64.urlsafe_b64encode(zb[:9]).decode("ascii")
 
             self.re_pwd = None
             pwds = [re.escape(x) for x in self.iacct.keys()]
@@ -117,7 +117,7 @@ class BrokerMp(object):
             for p in self.procs:
                 p.q_pend.put((0, dest, [args[0], len(self.procs)]))
 
-        elif dest == "set_netdevs":
+        elif dest in ("set_netdevs", "lsc_drop"):
             for p in self.procs:
                 p.q_pend.put((0, dest, list(args)))
 
@@ -92,6 +92,7 @@ class MpWorker(BrokerCli):
             elif dest == "reload":
                 self.logw("mpw.asrv reloading")
                 self.asrv.reload()
+                self.httpsrv.reload()
                 self.logw("mpw.asrv reloaded")
 
             elif dest == "listen":
@@ -100,6 +101,9 @@ class MpWorker(BrokerCli):
             elif dest == "set_netdevs":
                 self.httpsrv.set_netdevs(args[0])
 
+            elif dest == "lsc_drop":
+                self.httpsrv.lsc_drop(args[0])
+
             elif dest == "retq":
                 # response from previous ipc call
                 with self.retpend_mutex:
@@ -33,14 +33,13 @@ class BrokerThr(BrokerCli):
         # instantiate all services here (TODO: inheritance?)
         self.iphash = HMaccas(os.path.join(self.args.E.cfg, "iphash"), 8)
         self.httpsrv = HttpSrv(self, None)
-        self.reload = self.noop
 
     def shutdown(self) -> None:
         # self.log("broker", "shutting down")
         self.httpsrv.shutdown()
 
-    def noop(self) -> None:
-        pass
+    def reload(self) -> None:
+        self.httpsrv.reload()
 
     def ask(self, dest: str, *args: Any) -> ExceptionalQueue:
 
@@ -65,6 +64,10 @@ class BrokerThr(BrokerCli):
             self.httpsrv.set_netdevs(args[0])
             return
 
+        if dest == "lsc_drop":
+            self.httpsrv.lsc_drop(args[0])
+            return
+
         # new ipc invoking managed service in hub
         obj = self.hub
         for node in dest.split("."):
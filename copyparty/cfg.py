@@ -15,6 +15,8 @@ def vf_bmap() -> dict[str, str]:
         "no_forget": "noforget",
         "dav_auth": "davauth",
         "dav_rt": "davrt",
+        "idx_crc": "idxcrc",
+        "th_pre": "thpre",
     }
     for k in (
         "dotsrch",
@@ -26,6 +28,7 @@ def vf_bmap() -> dict[str, str]:
         "e2vp",
         "grid",
         "hardlink",
+        "inotify",
         "magic",
         "no_sb_md",
         "no_sb_lg",
@@ -103,6 +106,7 @@ flagcats = {
         "d2d": "disables all database stuff, overrides -e2*",
         "hist=/tmp/cdb": "puts thumbnails and indexes at that location",
         "scan=60": "scan for new files every 60sec, same as --re-maxage",
+        "inotify": "watch for changes and reindex only modified folders (linux)",
         "nohash=\\.iso$": "skips hashing file contents if path matches *.iso",
         "noidx=\\.iso$": "fully ignores the contents at paths matching *.iso",
         "noforget": "don't forget files when deleted from disk",
@@ -110,6 +114,7 @@ flagcats = {
         "xlink": "cross-volume dupe detection / linking",
         "xdev": "do not descend into other filesystems",
         "xvol": "do not follow symlinks leaving the volume root",
+        "idxcrc": "keep crc32 of files in the db; faster ?zip=crc",
         "dotsrch": "show dotfiles in search results",
         "nodotsrch": "hide dotfiles in search results (default)",
     },
@@ -122,6 +127,7 @@ flagcats = {
         "dvthumb": "disables video thumbnails",
         "dathumb": "disables audio thumbnails (spectrograms)",
         "dithumb": "disables image thumbnails",
+        "thpre": "create thumbnails of new files in the background, right after they are indexed/uploaded",
     },
     "event hooks\n(better explained in --help-hooks)": {
         "xbu=CMD": "execute CMD before a file upload starts",
@@ -7,6 +7,7 @@ import calendar
 import copy
 import errno
 import gzip
+import hashlib
 import itertools
 import json
 import os
@@ -17,6 +18,7 @@ import string
 import threading  # typechk
 import time
 import uuid
+import zlib
 from datetime import datetime
 from email.utils import formatdate, parsedate
 from operator import itemgetter
@@ -28,12 +30,19 @@ try:
 except:
     pass
 
+try:
+    import brotli
+
+    HAVE_BROTLI = True
+except:
+    HAVE_BROTLI = False
+
 from .__init__ import ANYWIN, PY2, TYPE_CHECKING, EnvParams, unicode
 from .__version__ import S_VERSION
 from .authsrv import VFS  # typechk
 from .bos import bos
 from .star import StreamTar
-from .sutil import StreamArc  # typechk
+from .sutil import Prefetch, StreamArc
 from .szip import StreamZip
 from .util import (
     HTTPCODE,
@@ -64,14 +73,17 @@ from .util import (
     read_header,
     read_socket,
     read_socket_chunked,
+    read_socket_into,
     read_socket_unbounded,
     relchk,
     ren_open,
     runhook,
+    s3dec,
     s3enc,
     sanitize_fn,
     sendfile_kern,
     sendfile_py,
+    spack,
     undot,
     unescape_cookie,
     unquote,
@@ -87,6 +99,8 @@ if True:  # pylint: disable=using-constant-test
     from typing import Any, Generator, Match, Optional, Pattern, Type, Union
 
 if TYPE_CHECKING:
+    import sqlite3
+
     from .httpconn import HttpConn
 
 _ = (argparse, threading)
@@ -609,6 +623,32 @@ class HttpCli(object):
 
         return body
 
+    def compress_reply(self, body: bytes) -> bytes:
+        """
+        brotli/gzip a large generated response (listings) if the client
+        accepts that; sets Content-Encoding accordingly
+        """
+        self.out_headers["Vary"] += ", Accept-Encoding"
+        if len(body) < 4096:
+            return body
+
+        supported = []
+        for zs in self.headers.get("accept-encoding", "").lower().split(","):
+            zl = zs.replace(" ", "").split(";")
+            if "q=0" not in zl and "q=0.0" not in zl:
+                supported.append(zl[0])
+
+        if HAVE_BROTLI and "br" in supported:
+            self.out_headers["Content-Encoding"] = "br"
+            return brotli.compress(body, quality=4)
+
+        if "gzip" in supported:
+            self.out_headers["Content-Encoding"] = "gzip"
+            zo = zlib.compressobj(4, zlib.DEFLATED, 31)
+            return zo.compress(body) + zo.flush()
+
+        return body
+
     def loud_reply(self, body: str, *args: Any, **kwargs: Any) -> None:
         if not kwargs.get("mime"):
             kwargs["mime"] = "text/plain; charset=utf-8"
@@ -755,6 +795,10 @@ class HttpCli(object):
                 self.reply(b"", 301, headers=h)
                 return True
 
+            res = self.conn.hsrv.res.get(self.vpath[5:])
+            if res and "range" not in self.headers:
+                return self.tx_res(res)
+
             static_path = os.path.join(self.E.mod, "web/", self.vpath[5:])
             return self.tx_file(static_path)
 
@@ -1339,20 +1383,25 @@ class HttpCli(object):
 
         return enc or "utf-8"
 
-    def get_body_reader(self) -> tuple[Generator[bytes, None, None], int]:
+    def get_body_reader(
+        self, reuse: bool = False
+    ) -> tuple[Generator[Union[bytes, memoryview], None, None], int]:
+        """reuse: yield views of one buffer; only for consumers like hashcopy"""
         if "chunked" in self.headers.get("transfer-encoding", "").lower():
-            return read_socket_chunked(self.sr), -1
+            return read_socket_chunked(self.sr, None, reuse), -1
 
         remains = int(self.headers.get("content-length", -1))
         if remains == -1:
             self.keepalive = False
             return read_socket_unbounded(self.sr), remains
+        elif reuse:
+            return read_socket_into(self.sr, remains), remains
         else:
             return read_socket(self.sr, remains), remains
 
     def dump_to_file(self, is_put: bool) -> tuple[int, str, str, int, str, str]:
         # post_sz, sha_hex, sha_b64, remains, path, url
-        reader, remains = self.get_body_reader()
+        reader, remains = self.get_body_reader(True)
         vfs, rem = self.asrv.vfs.get(self.vpath, self.uname, False, True)
         rnd, _, lifetime, xbu, xau = self.upload_flags(vfs)
         lim = vfs.get_dbv(rem)[0].lim
@@ -1720,7 +1769,11 @@ class HttpCli(object):
         # self.reply(b"cloudflare", 503)
         # return True
 
-        if "srch" in self.uparam or "srch" in body:
+        # before the srch check; body is a list of names here
+        if "ths" in self.uparam:
+            return self.tx_ths(body)
+
+        if "srch" in self.uparam or (isinstance(body, dict) and "srch" in body):
             return self.handle_search(body)
 
         if "delete" in self.uparam:
@@ -1775,7 +1828,7 @@ class HttpCli(object):
 
     def handle_search(self, body: dict[str, Any]) -> bool:
         idx = self.conn.get_u2idx()
-        if not idx or not hasattr(idx, "p_end"):
+        if not idx:
             raise Pebkac(500, "sqlite3 is not available on the server; cannot search")
 
         vols = []
@@ -1864,7 +1917,7 @@ class HttpCli(object):
 
             self.log("writing {} #{} @{} len {}".format(path, chash, cstart, remains))
 
-            reader = read_socket(self.sr, remains)
+            reader = read_socket_into(self.sr, remains)
 
             f = None
             fpool = not self.args.no_fpool and sprs
@@ -1912,6 +1965,8 @@ class HttpCli(object):
                 if not fpool:
                     f.close()
                 else:
+                    # confirmed chunks are journaled; must not sit in our buffer
+                    f.flush()
                     with self.mutex:
                         self.u2fh.put(path, f)
             except:
@@ -2488,6 +2543,132 @@ class HttpCli(object):
 
         return file_lastmod, True
 
+    def _parse_ranges(self, hrange: str, file_sz: int) -> list[tuple[int, int]]:
+        """
+        returns [(lower, upper), ...] where upper is exclusive;
+        empty list if the range header should be ignored;
+        raises if none of the ranges are satisfiable
+        """
+        unit, zs = hrange.split("=", 1)
+        if unit.strip().lower() != "bytes":
+            raise Exception()
+
+        ret: list[tuple[int, int]] = []
+        nbytes = 0
+        for zs2 in zs.split(","):
+            a, b = [x.strip() for x in zs2.split("-")]
+            if not a:
+                # suffix; the last b bytes
+                lower = max(0, file_sz - int(b))
+                upper = file_sz
+            else:
+                lower = int(a)
+                upper = min(int(b) + 1, file_sz) if b else file_sz
+                if b and int(b) < lower:
+                    # invalid (not just unsatisfiable); ignore the header
+                    return []
+
+            if lower < 0:
+                raise Exception()
+
+            if lower >= upper:
+                continue  # unsatisfiable; skip unless they all are
+
+            if ret and lower < ret[-1][0]:
+                # out of order; not worth the effort
+                return []
+
+            nbytes += upper - lower
+            ret.append((lower, upper))
+
+        if not ret:
+            raise Exception()
+
+        if len(ret) > 64 or nbytes > file_sz:
+            # would be cheaper to just send the file,
+            # or someone trying to amplify (0-,0-,0-,...)
+            return []
+
+        # merge overlapping and adjacent ranges
+        merged = [ret[0]]
+        for lower, upper in ret[1:]:
+            plower, pupper = merged[-1]
+            if lower <= pupper:
+                merged[-1] = (plower, max(pupper, upper))
+            else:
+                merged.append((lower, upper))
+
+        return merged
+
+    def _sel_edition(self, editions: dict[str, Any]) -> tuple[str, bool]:
+        """
+        which edition of a static file to send (plain, .gz, .br) and whether
+        a .gz must be decompressed for the client; empty if none will do
+        """
+        supported_editions = [
+            x.strip()
+            for x in self.headers.get("accept-encoding", "").lower().split(",")
+        ]
+        if ".br" in editions and "br" in supported_editions:
+            self.out_headers["Content-Encoding"] = "br"
+            return ".br", False
+
+        if ".gz" in editions:
+            if "gzip" in supported_editions and (
+                not re.match(r"MSIE [4-6]\.", self.ua) or " SV1" in self.ua
+            ):
+                self.out_headers["Content-Encoding"] = "gzip"
+                return ".gz", False
+
+            if "plain" not in editions:
+                return ".gz", True
+
+        return ("plain" if "plain" in editions else ""), False
+
+    def _file_hdrs(
+        self, file_ts: int, compressed: bool, mpath: str, etag: str = ""
+    ) -> tuple[bool, str]:
+        """
+        last-modified, etag and caching headers of a file to send;
+        returns whether it needs sending (else 304) and its mimetype
+        """
+        file_lastmod, do_send = self._chk_lastmod(file_ts)
+        self.out_headers["Last-Modified"] = file_lastmod
+        if etag:
+            cli_etag = self.headers.get("if-none-match")
+            if cli_etag:
+                do_send = etag not in cli_etag and cli_etag.strip() != "*"
+
+            self.out_headers["ETag"] = etag
+
+        if compressed:
+            self.out_headers["Cache-Control"] = "max-age=604869"
+        else:
+            self.permit_caching()
+
+        if "txt" in self.uparam:
+            mime = "text/plain; charset={}".format(self.uparam["txt"] or "utf-8")
+        elif "mime" in self.uparam:
+            mime = str(self.uparam.get("mime"))
+        else:
+            mime = guess_mime(mpath)
+
+        return do_send, mime
+
+    def _sendfile(
+        self, f: typing.BinaryIO, lower: int, upper: int, kern: bool = True
+    ) -> int:
+        """sends bytes lower..upper of f; returns how many were not sent"""
+        if kern and not self.tls and not self.args.no_sendfile:
+            kern = hasattr(os, "sendfile")
+        else:
+            kern = False
+
+        sendfun = sendfile_kern if kern else sendfile_py
+        return sendfun(
+            self.log, lower, upper, f, self.s, self.args.s_wr_sz, self.args.s_wr_slp
+        )
+
     def tx_file(self, req_path: str) -> bool:
         status = 200
         logmsg = "{:4} {} ".format("", self.req)
@@ -2524,83 +2705,38 @@ class HttpCli(object):
         if not editions:
             return self.tx_404()
 
-        #
-        # if-modified
-
-        file_lastmod, do_send = self._chk_lastmod(file_ts)
-        self.out_headers["Last-Modified"] = file_lastmod
-        if not do_send:
-            status = 304
-
         #
         # Accept-Encoding and UA decides which edition to send
 
-        decompress = False
-        supported_editions = [
-            x.strip()
-            for x in self.headers.get("accept-encoding", "").lower().split(",")
-        ]
-        if ".br" in editions and "br" in supported_editions:
-            is_compressed = True
-            selected_edition = ".br"
-            fs_path, file_sz = editions[".br"]
-            self.out_headers["Content-Encoding"] = "br"
-        elif ".gz" in editions:
-            is_compressed = True
-            selected_edition = ".gz"
-            fs_path, file_sz = editions[".gz"]
-            if "gzip" not in supported_editions:
-                decompress = True
-            else:
-                if re.match(r"MSIE [4-6]\.", self.ua) and " SV1" not in self.ua:
-                    decompress = True
-
-            if not decompress:
-                self.out_headers["Content-Encoding"] = "gzip"
-        else:
-            is_compressed = False
-            selected_edition = "plain"
-
-        try:
-            fs_path, file_sz = editions[selected_edition]
-            logmsg += "{} ".format(selected_edition.lstrip("."))
-        except:
+        selected_edition, decompress = self._sel_edition(editions)
+        if not selected_edition:
             # client is old and we only have .br
             # (could make brotli a dep to fix this but it's not worth)
             raise Pebkac(404)
 
+        fs_path, file_sz = editions[selected_edition]
+        logmsg += "{} ".format(selected_edition.lstrip("."))
+        is_compressed = selected_edition != "plain"
+
+        #
+        # if-modified
+
+        do_send, mime = self._file_hdrs(file_ts, is_compressed, req_path)
+        if not do_send:
+            status = 304
+
         #
         # partial
 
         lower = 0
         upper = file_sz
+        ranges: list[tuple[int, int]] = []
         hrange = self.headers.get("range")
 
         # let's not support 206 with compression
-        # and multirange / multipart is also not-impl (mostly because calculating contentlength is a pain)
-        if do_send and not is_compressed and hrange and file_sz and "," not in hrange:
+        if do_send and not is_compressed and hrange and file_sz:
             try:
-                if not hrange.lower().startswith("bytes"):
-                    raise Exception()
-
-                a, b = hrange.split("=", 1)[1].split("-")
-
-                if a.strip():
-                    lower = int(a.strip())
-                else:
-                    lower = 0
-
-                if b.strip():
-                    upper = int(b.strip()) + 1
-                else:
-                    upper = file_sz
-
-                if upper > file_sz:
-                    upper = file_sz
-
-                if lower < 0 or lower >= upper:
-                    raise Exception()
-
+                ranges = self._parse_ranges(hrange, file_sz)
             except:
                 err = "invalid range ({}), size={}".format(hrange, file_sz)
                 self.loud_reply(
@@ -2610,14 +2746,18 @@ class HttpCli(object):
                 )
                 return True
 
-            status = 206
-            self.out_headers["Content-Range"] = "bytes {}-{}/{}".format(
-                lower, upper - 1, file_sz
-            )
+            if len(ranges) == 1:
+                lower, upper = ranges[0]
+                status = 206
+                self.out_headers["Content-Range"] = "bytes {}-{}/{}".format(
+                    lower, upper - 1, file_sz
+                )
 
-            logtail += " [\033[36m{}-{}\033[0m]".format(lower, upper)
+                logtail += " [\033[36m{}-{}\033[0m]".format(lower, upper)
+            elif ranges:
+                status = 206
+                logtail += " [\033[36m{} ranges\033[0m]".format(len(ranges))
 
-        use_sendfile = False
         if decompress:
             open_func: Any = gzip.open
             open_args: list[Any] = [fsenc(fs_path), "rb"]
@@ -2627,28 +2767,27 @@ class HttpCli(object):
             open_func = open
             # 512 kB is optimal for huge files, use 64k
             open_args = [fsenc(fs_path), "rb", 64 * 1024]
-            use_sendfile = (
-                not self.tls  #
-                and not self.args.no_sendfile
-                and hasattr(os, "sendfile")
-            )
 
         #
         # send reply
 
-        if is_compressed:
-            self.out_headers["Cache-Control"] = "max-age=604869"
-        else:
-            self.permit_caching()
+        self.out_headers["Accept-Ranges"] = "bytes"
 
-        if "txt" in self.uparam:
-            mime = "text/plain; charset={}".format(self.uparam["txt"] or "utf-8")
-        elif "mime" in self.uparam:
-            mime = str(self.uparam.get("mime"))
-        else:
-            mime = guess_mime(req_path)
+        # multipart/byteranges; (part-header, lower, upper)
+        parts: list[tuple[bytes, int, int]] = []
+        if len(ranges) > 1:
+            zs = uuid.uuid4().hex
+            pfx = "\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes "
+            pfx = pfx.format(zs, mime)
+            for zi1, zi2 in ranges:
+                zs2 = "{}{}-{}/{}\r\n\r\n".format(pfx, zi1, zi2 - 1, file_sz)
+                parts.append((zs2.encode("utf-8"), zi1, zi2))
+
+            ptail = "\r\n--{}--\r\n".format(zs).encode("utf-8")
+            lower = 0
+            upper = sum([len(x[0]) + x[2] - x[1] for x in parts]) + len(ptail)
+            mime = "multipart/byteranges; boundary=" + zs
 
-        self.out_headers["Accept-Ranges"] = "bytes"
         self.send_headers(length=upper - lower, status=status, mime=mime)
 
         logmsg += unicode(status) + logtail
@@ -2661,10 +2800,20 @@ class HttpCli(object):
 
         ret = True
         with open_func(*open_args) as f:
-            sendfun = sendfile_kern if use_sendfile else sendfile_py
-            remains = sendfun(
-                self.log, lower, upper, f, self.s, self.args.s_wr_sz, self.args.s_wr_slp
-            )
+            if not parts:
+                remains = self._sendfile(f, lower, upper, not decompress)
+            else:
+                remains = upper
+                for zb, zi1, zi2 in parts + [(ptail, 0, 0)]:
+                    try:
+                        self.s.sendall(zb)
+                    except:
+                        break
+
+                    zi = self._sendfile(f, zi1, zi2, not decompress)
+                    remains -= len(zb) + (zi2 - zi1) - zi
+                    if zi:
+                        break
 
         if remains > 0:
             logmsg += " \033[31m" + unicode(upper - remains) + "\033[0m"
@@ -2676,6 +2825,62 @@ class HttpCli(object):
 
         return ret
 
+    def tx_pack(self, thp: tuple[str, int, int, str], file_ts: int) -> bool:
+        """tx_file for thumbnails inside a --th-pack segment"""
+        ap, ofs, sz, tpath = thp
+        do_send, mime = self._file_hdrs(file_ts, False, tpath)
+        status = 200 if do_send else 304
+        self.send_headers(length=sz, status=status, mime=mime)
+
+        logmsg = "{:4} {} {}".format("", self.req, status)
+        if self.mode == "HEAD" or not do_send:
+            if self.do_log:
+                self.log(logmsg)
+
+            return True
+
+        with open(fsenc(ap), "rb", 64 * 1024) as f:
+            remains = self._sendfile(f, ofs, ofs + sz)
+
+        if remains > 0:
+            logmsg += " \033[31m" + unicode(sz - remains) + "\033[0m"
+            self.keepalive = False
+
+        if self.do_log:
+            self.log("{},  {}".format(logmsg, self._spd(sz - remains)))
+
+        return True
+
+    def tx_res(self, res: tuple[int, dict[str, tuple[bytes, str]]]) -> bool:
+        """tx_file for the web-ui resources which HttpSrv keeps in memory"""
+        file_ts, editions = res
+        selected_edition, decompress = self._sel_edition(editions)
+        if not selected_edition or decompress:
+            # only compressed editions and the client can't take them
+            static_path = os.path.join(self.E.mod, "web/", self.vpath[5:])
+            return self.tx_file(static_path)
+
+        buf, etag = editions[selected_edition]
+        is_compressed = selected_edition != "plain"
+        do_send, mime = self._file_hdrs(file_ts, is_compressed, self.vpath, etag)
+        status = 200 if do_send else 304
+        self.send_headers(length=len(buf), status=status, mime=mime)
+
+        logmsg = "{:4} {} {} {}".format(
+            "", self.req, selected_edition.lstrip("."), status
+        )
+        if self.mode != "HEAD" and do_send:
+            try:
+                self.s.sendall(buf)
+            except:
+                logmsg += " \033[31m" + unicode(len(buf)) + "\033[0m"
+                self.keepalive = False
+
+        if self.do_log:
+            self.log(logmsg)
+
+        return True
+
     def tx_zip(
         self,
         fmt: str,
@@ -2724,29 +2929,177 @@ class HttpCli(object):
         cdis = "attachment; filename=\"{}.{}\"; filename*=UTF-8''{}.{}"
         cdis = cdis.format(afn, fmt, ufn, fmt)
         self.log(cdis)
-        self.send_headers(None, mime=mime, headers={"Content-Disposition": cdis})
 
         fgen = vn.zipgen(
             vpath, rem, set(items), self.uname, dots, False, not self.args.no_scandir
         )
         # for f in fgen: print(repr({k: f[k] for k in ["vp", "ap"]}))
+        clen = None
+        crc_miss: list[dict[str, Any]] = []
+        if "crc" in uarg and packer == StreamZip:
+            zg = self._zip_crcs(vn, fgen, crc_miss)
+            if zg:
+                fgen = zg
+                if self.args.zip_clen:
+                    fgen, clen = self._arc_len(packer, fgen, "utf" in uarg)
+        elif packer == StreamTar and self.args.zip_clen:
+            fgen, clen = self._arc_len(packer, fgen, False)
+
+        hdrs = {"Content-Disposition": cdis}
+        self.send_headers(clen, mime=mime, headers=hdrs)
+
+        if self.args.zip_pf:
+            fgen = Prefetch(self.log, fgen, self.args.zip_pf).gen()
+
         bgen = packer(self.log, fgen, utf8="utf" in uarg, pre_crc="crc" in uarg)
         bsent = 0
         for buf in bgen.gen():
             if not buf:
                 break
 
+            zi = buf[1] if isinstance(buf, tuple) else len(buf)
+            if clen is not None and bsent + zi > clen:
+                # some file changed or failed after the size was announced;
+                # end the download early so the client knows it is broken
+                logmsg += " \033[31marchive size changed\033[0m"
+                break
+
             try:
-                self.s.sendall(buf)
-                bsent += len(buf)
+                if isinstance(buf, tuple):
+                    # file contents which the packer didn't need to see
+                    ap, sz = buf
+                    with open(fsenc(ap), "rb", 512 * 1024) as f:
+                        zi = self._sendfile(f, 0, sz)
+                    bsent += sz - zi
+                    if zi:
+                        raise Exception()
+                else:
+                    self.s.sendall(buf)
+                    bsent += len(buf)
             except:
                 logmsg += " \033[31m" + unicode(bsent) + "\033[0m"
                 break
 
+        # crcs which had to be calculated; remember them for next time
+        zd: dict[str, list[tuple[str, int]]] = {}
+        for f in crc_miss:
+            if "crc" in f:
+                ptop, wark = f["crcw"]
+                zd.setdefault(ptop, []).append((wark, f["crc"]))
+
+        for ptop, zl in zd.items():
+            self.conn.hsrv.broker.say("up2k.add_crcs", ptop, zl)
+
         spd = self._spd(bsent)
         self.log("{},  {}".format(logmsg, spd))
         return True
 
+    def _zip_crcs(
+        self,
+        vn: VFS,
+        fgen: Generator[dict[str, Any], None, None],
+        miss: list[dict[str, Any]],
+    ) -> Optional[Generator[dict[str, Any], None, None]]:
+        """
+        attaches crc32s from the up2k db (volflag idxcrc) to the files
+        so StreamZip can skip reading them twice, and collects files
+        without a crc into miss; None if there is no crc index
+        """
+        ptops = [
+            x.realpath
+            for x in self.asrv.vfs.all_vols.values()
+            if "idxcrc" in x.flags
+            and "e2d" in x.flags
+            and (x == vn or x.vpath.startswith(vn.vpath + "/") or not vn.vpath)
+        ]
+        idx = self.conn.get_u2idx()
+        if not ptops or not idx:
+            return None
+
+        # deepest volume first
+        ptops.sort(key=len, reverse=True)
+
+        def gen() -> Generator[dict[str, Any], None, None]:
+            # one query per folder; zipgen yields a folder at a time
+            q = "select up.fn, up.sz, up.mt, up.w, cr.c from up left join cr on cr.w = substr(up.w,1,16) where up.rd=?"
+            crd: Optional[tuple[str, str]] = None
+            rows: dict[str, tuple[int, int, str, Optional[int]]] = {}
+            for f in fgen:
+                st = f.get("st")
+                if "err" in f or not st or stat.S_ISDIR(st.st_mode):
+                    yield f
+                    continue
+
+                if not st.st_size:
+                    f["crc"] = 0
+                    yield f
+                    continue
+
+                ap = f["ap"]
+                for ptop in ptops:
+                    if not ap.startswith(ptop + os.sep):
+                        continue
+
+                    rd, fn = vsplit(ap[len(ptop) + 1 :].replace(os.sep, "/"))
+                    if crd != (ptop, rd):
+                        crd = (ptop, rd)
+                        cur = idx.get_cur(ptop)
+                        try:
+                            # no mojibake support
+                            zl = cur.execute(q, (rd,)).fetchall() if cur else []
+                            rows = {x[0]: x[1:] for x in zl}
+                        except:
+                            rows = {}
+
+                    # must match the file as it is now
+                    row = rows.get(fn)
+                    if not row or row[:2] != (st.st_size, int(st.st_mtime)):
+                        break
+
+                    if row[3] is not None:
+                        f["crc"] = row[3]
+                    else:
+                        f["crcw"] = (ptop, row[2])
+                        miss.append(f)
+                    break
+
+                yield f
+
+        return gen()
+
+    def _arc_len(
+        self,
+        packer: Type[StreamArc],
+        fgen: Generator[dict[str, Any], None, None],
+        utf8: bool,
+    ) -> tuple[Generator[dict[str, Any], None, None], Optional[int]]:
+        """
+        size of the archive, if it can be known without reading any files
+        (tar, or zip with all crcs from _zip_crcs) and it has few enough
+        entries (--zip-clen); does a dry run of the packer on a lookahead
+        """
+        nmax = self.args.zip_clen
+        fl = list(itertools.islice(fgen, nmax + 1))
+        ok = len(fl) <= nmax
+        for f in fl if ok else []:
+            if "err" in f:
+                ok = False
+            elif packer == StreamZip and "crc" not in f:
+                ok = stat.S_ISDIR(f["st"].st_mode)
+
+            if not ok:
+                break
+
+        clen = None
+        if ok:
+            clen = 0
+            arc = packer(self.log, (f for f in fl), utf8=utf8, pre_crc=True)
+            for buf in arc.gen():
+                if buf:
+                    clen += buf[1] if isinstance(buf, tuple) else len(buf)
+
+        return (f for f in itertools.chain(fl, fgen)), clen
+
     def tx_ico(self, ext: str, exact: bool = False) -> bool:
         self.permit_caching()
         if ext.endswith("/"):
@@ -3107,7 +3460,7 @@ class HttpCli(object):
             raise Pebkac(403, "the unpost feature is disabled in server config")
 
         idx = self.conn.get_u2idx()
-        if not idx or not hasattr(idx, "p_end"):
+        if not idx:
             raise Pebkac(500, "sqlite3 is not available on the server; cannot unpost")
 
         filt = self.uparam.get("filter")
@@ -3225,7 +3578,63 @@ class HttpCli(object):
         self.loud_reply(x.get(), status=201)
         return True
 
-    def tx_ls(self, ls: dict[str, Any]) -> bool:
+    def tx_ths(self, names: list[str]) -> bool:
+        """
+        thumbnails for a list of files in this folder, in one response;
+        each is a 12-byte header (index in names, length, type) and the
+        image itself; files without a finished thumbnail are skipped,
+        the client can fall back to ?th for those (which also makes them)
+        """
+        if not isinstance(names, list):
+            raise Pebkac(400, "expected a list of filenames")
+
+        th_fmt = self.uparam.get("ths") or "w"
+        if th_fmt not in ("w", "j"):
+            raise Pebkac(400, "bad thumbnail format")
+
+        vn, rem = self.asrv.vfs.get(self.vpath, self.uname, True, False)
+        dbv, vrem = vn.get_dbv(rem)
+
+        _, vfs_ls, _ = vn.ls(rem, self.uname, not self.args.no_scandir, [[True, False]])
+        ents = dict(vfs_ls)
+        if not self.args.ed or "dots" not in self.uparam:
+            ents = {k: v for k, v in ents.items() if not k.startswith(".")}
+        kinds = {"jpg": 0, "webp": 1, "png": 2}
+        ret: list[bytes] = []
+        nbytes = 0
+        for n, fn in enumerate(names[:4096]):
+            st = ents.get(fn) if self.thumbcli else None
+            if not st or not stat.S_ISREG(st.st_mode):
+                continue
+
+            thp = self.thumbcli.get(
+                dbv, vjoin(vrem, fn), int(st.st_mtime), th_fmt, gen=False
+            )
+            if not thp:
+                continue
+
+            ap, ofs, sz, tpath = thp if isinstance(thp, tuple) else (thp, 0, -1, thp)
+            kind = kinds.get(tpath.rsplit(".", 1)[-1])
+            if kind is None:
+                continue
+
+            try:
+                with open(fsenc(ap), "rb") as f:
+                    f.seek(ofs)
+                    buf = f.read(sz)
+            except:
+                continue
+
+            ret.append(spack(b">III", n, len(buf), kind))
+            ret.append(buf)
+            nbytes += len(buf)
+            if nbytes > 32 * 1024 * 1024:
+                break
+
+        self.reply(b"".join(ret), mime="application/octet-stream")
+        return True
+
+    def tx_ls(self, ls: dict[str, Any], etag: str = "") -> bool:
         dirs = ls["dirs"]
         files = ls["files"]
         arg = self.uparam["ls"]
@@ -3288,9 +3697,64 @@ class HttpCli(object):
             mime = "application/json"
 
         ret += "\n\033[0m" if arg == "v" else "\n"
-        self.reply(ret.encode("utf-8", "replace"), mime=mime)
+        body = self.compress_reply(ret.encode("utf-8", "replace"))
+        if etag:
+            zs = self.out_headers.get("Content-Encoding", "")
+            zs = {"br": ".br", "gzip": ".gz"}.get(zs, "")
+            self.out_headers["ETag"] = '"{}{}"'.format(etag, zs)
+            self.out_headers.update(NO_CACHE)
+
+        self.reply(body, mime=mime)
         return True
 
+    def _dhash(self, icur: Optional["sqlite3.Cursor"], rd: str) -> str:
+        """up2k dhash of a folder (changes when a rescan finds changed files)"""
+        if icur and not self.args.no_dhash:
+            try:
+                zr = icur.execute("select h from dh where d=?", (rd,)).fetchone()
+                return zr[0] if zr else ""
+            except:
+                pass
+
+        return ""
+
+    def _ls_etag(
+        self,
+        st: os.stat_result,
+        dhash: str,
+        ents: list[tuple[str, os.stat_result, os.stat_result]],
+    ) -> str:
+        """
+        validator for ?ls of a folder; the folder mtime (new/removed/renamed
+        files), its up2k dhash (changed files, as of the last scan), the size
+        and mtime of each entry if the listing is in --ls-cache (so the etag
+        changes no later than the cached listing does), and everything about
+        the request and config which affects the output
+        """
+        zl = [(x[0], x[1].st_size, x[1].st_mtime) for x in ents]
+        zs = repr(
+            [
+                self.asrv.cfg_sig,
+                st.st_mtime,
+                st.st_ino,
+                dhash,
+                zl,
+                self.vpath,
+                self.uname,
+                [
+                    self.can_read,
+                    self.can_write,
+                    self.can_move,
+                    self.can_delete,
+                    self.can_get,
+                    self.can_upget,
+                ],
+                sorted(self.uparam.items()),
+            ]
+        )
+        zb = hashlib.sha1(zs.encode("utf-8", "replace")).digest()
+        return base64.urlsafe_b64encode(zb[:15]).decode("ascii")
+
     def tx_browser(self) -> bool:
         vpath = ""
         vpnodes = [["", "/"]]
@@ -3330,7 +3794,7 @@ class HttpCli(object):
         icur = None
         if is_dir and (e2t or e2d):
             idx = self.conn.get_u2idx()
-            if idx and hasattr(idx, "p_end"):
+            if idx:
                 icur = idx.get_cur(dbv.realpath)
 
         if self.can_read:
@@ -3365,7 +3829,12 @@ class HttpCli(object):
 
                 thp = None
                 if self.thumbcli:
-                    thp = self.thumbcli.get(dbv, vrem, int(st.st_mtime), th_fmt)
+                    thp = self.thumbcli.get(
+                        dbv, vrem, int(st.st_mtime), th_fmt, self.ip, self.s
+                    )
+
+                if isinstance(thp, tuple):
+                    return self.tx_pack(thp, int(st.st_mtime))
 
                 if thp:
                     return self.tx_file(thp)
@@ -3395,6 +3864,31 @@ class HttpCli(object):
         elif is_dir and not self.can_read and not self.can_write:
             return self.tx_404(True)
 
+        ls_etag = ""
+        lstat = "lt" in self.uparam
+        dhash = self._dhash(icur, vrem.strip("/")) if is_dir else ""
+
+        # stat results and backups of the real files; cached per folder,
+        # valid until the folder (or its dhash) changes or up2k touches it
+        lsc_key = (vn.canonical(rem), lstat)
+        lsc_chk = (self.asrv.cfg_sig, st.st_mtime, st.st_ino, dhash)
+        lsc_gen = 0
+        lsc = None
+        if is_dir and self.args.ls_cache:
+            lsc_gen = self.conn.hsrv.lsc_gen
+            lsc = self.conn.hsrv.lsc_get(lsc_key, lsc_chk)
+
+        if is_dir and "ls" in self.uparam:
+            ls_etag = self._ls_etag(st, dhash, lsc[0] if lsc else [])
+            for zs in self.headers.get("if-none-match", "").split(","):
+                zs = zs.strip()
+                if zs.strip('"').split(".")[0] == ls_etag:
+                    self.out_headers["ETag"] = zs
+                    self.out_headers.update(NO_CACHE)
+                    self.out_headers["Vary"] += ", Accept-Encoding"
+                    self.send_headers(None, 304)
+                    return True
+
         srv_info = []
 
         try:
@@ -3522,7 +4016,7 @@ class HttpCli(object):
 
         if not self.can_read:
             if is_ls:
-                return self.tx_ls(ls_ret)
+                return self.tx_ls(ls_ret, ls_etag)
 
             if not stat.S_ISDIR(st.st_mode):
                 return self.tx_404(True)
@@ -3544,28 +4038,50 @@ class HttpCli(object):
             self.uname,
             not self.args.no_scandir,
             [[True, False], [False, True]],
-            lstat="lt" in self.uparam,
+            lstat=lstat,
+            fs=not lsc,
         )
-        stats = {k: v for k, v in vfs_ls}
-        ls_names = [x[0] for x in vfs_ls]
-        ls_names.extend(list(vfs_virt.keys()))
-
-        # check for old versions of files,
-        # [num-backups, most-recent, hist-path]
-        hist: dict[str, tuple[int, float, str]] = {}
-        histdir = os.path.join(fsroot, ".hist")
-        ptn = re.compile(r"(.*)\.([0-9]+\.[0-9]{3})(\.[^\.]+)$")
-        try:
-            for hfn in bos.listdir(histdir):
-                m = ptn.match(hfn)
-                if not m:
+        if lsc:
+            ents, hist = lsc
+        else:
+            ents: list[tuple[str, os.stat_result, os.stat_result]] = []
+            for fn, linf in vfs_ls:
+                fspath = fsroot + "/" + fn
+                try:
+                    inf = bos.stat(fspath) if stat.S_ISLNK(linf.st_mode) else linf
+                except:
+                    self.log("broken symlink: {}".format(repr(fspath)))
                     continue
 
-                fn = m.group(1) + m.group(3)
-                n, ts, _ = hist.get(fn, (0, 0, ""))
-                hist[fn] = (n + 1, max(ts, float(m.group(2))), hfn)
-        except:
-            pass
+                ents.append((fn, linf, inf))
+
+            # check for old versions of files,
+            # [num-backups, most-recent, hist-path]
+            hist: dict[str, tuple[int, float, str]] = {}
+            histdir = os.path.join(fsroot, ".hist")
+            ptn = re.compile(r"(.*)\.([0-9]+\.[0-9]{3})(\.[^\.]+)$")
+            try:
+                for hfn in bos.listdir(histdir):
+                    m = ptn.match(hfn)
+                    if not m:
+                        continue
+
+                    fn = m.group(1) + m.group(3)
+                    n, ts, _ = hist.get(fn, (0, 0, ""))
+                    hist[fn] = (n + 1, max(ts, float(m.group(2))), hfn)
+            except:
+                pass
+
+            if self.args.ls_cache and len(ents) >= 64:
+                zt = (ents, hist)
+                self.conn.hsrv.lsc_put(lsc_key, lsc_chk, lsc_gen, len(ents), zt)
+                if ls_etag:
+                    # the next request will find these in the cache
+                    ls_etag = self._ls_etag(st, dhash, ents)
+
+        stats = {x[0]: x[1:] for x in ents}
+        ls_names = [x[0] for x in ents]
+        ls_names.extend(list(vfs_virt.keys()))
 
         # show dotfiles if permitted and requested
         if not self.args.ed or "dots" not in self.uparam:
@@ -3584,15 +4100,15 @@ class HttpCli(object):
 
             if fn in vfs_virt:
                 fspath = vfs_virt[fn].realpath
+                try:
+                    linf = bos.lstat(fspath)
+                    inf = bos.stat(fspath) if stat.S_ISLNK(linf.st_mode) else linf
+                except:
+                    self.log("broken symlink: {}".format(repr(fspath)))
+                    continue
             else:
                 fspath = fsroot + "/" + fn
-
-            try:
-                linf = stats.get(fn) or bos.lstat(fspath)
-                inf = bos.stat(fspath) if stat.S_ISLNK(linf.st_mode) else linf
-            except:
-                self.log("broken symlink: {}".format(repr(fspath)))
-                continue
+                linf, inf = stats[fn]
 
             is_dir = stat.S_ISDIR(inf.st_mode)
             if is_dir:
@@ -3651,7 +4167,6 @@ class HttpCli(object):
                 dirs.append(item)
             else:
                 files.append(item)
-                item["rd"] = rem
 
         if (
             self.cookies.get("idxh") == "y"
@@ -3668,33 +4183,38 @@ class HttpCli(object):
                     return self.tx_file(ap)  # is no-cache
 
         tagset: set[str] = set()
-        for fe in files:
-            fn = fe["name"]
-            rd = fe["rd"]
-            del fe["rd"]
-            if not icur:
-                continue
-
+        if icur and files:
+            rd = rem
             if vn != dbv:
                 _, rd = vn.get_dbv(rd)
 
-            q = "select mt.k, mt.v from up inner join mt on mt.w = substr(up.w,1,16) where up.rd = ? and up.fn = ? and +mt.k != 'x'"
+            # one query for the whole folder, then match on filename
+            q = "select up.fn, mt.k, mt.v from up inner join mt on mt.w = substr(up.w,1,16) where up.rd = ? and +mt.k != 'x'"
             try:
-                r = icur.execute(q, (rd, fn))
+                r = icur.execute(q, (rd,)).fetchall()
             except Exception as ex:
-                if "database is locked" in str(ex):
-                    break
+                r = []
+                if "database is locked" not in str(ex):
+                    try:
+                        args = s3enc(idx.mem_cur, rd, "")
+                        r = icur.execute(q, args[:1]).fetchall()
+                    except:
+                        t = "tag read error, {}\n{}"
+                        self.log(t.format(rd, min_ex()))
+
+            rtags: dict[str, dict[str, Any]] = {}
+            for fn, k, v in r:
+                if fn.startswith("//"):
+                    fn = s3dec("", fn)[1]
 
                 try:
-                    args = s3enc(idx.mem_cur, rd, fn)
-                    r = icur.execute(q, args)
-                except:
-                    t = "tag read error, {}/{}\n{}"
-                    self.log(t.format(rd, fn, min_ex()))
-                    break
+                    rtags[fn][k] = v
+                except KeyError:
+                    rtags[fn] = {k: v}
 
-            fe["tags"] = {k: v for k, v in r}
-            _ = [tagset.add(k) for k in fe["tags"]]
+            for fe in files:
+                fe["tags"] = rtags.get(fe["name"]) or {}
+                tagset.update(fe["tags"])
 
         if icur:
             taglist = [k for k in vn.flags.get("mte", "").split(",") if k in tagset]
@@ -3707,7 +4227,7 @@ class HttpCli(object):
             ls_ret["dirs"] = dirs
             ls_ret["files"] = files
             ls_ret["taglist"] = taglist
-            return self.tx_ls(ls_ret)
+            return self.tx_ls(ls_ret, ls_etag)
 
         doc = self.uparam.get("doc") if self.can_read else None
         if doc:
@@ -3745,10 +4265,12 @@ class HttpCli(object):
 
         j2a["taglist"] = taglist
         j2a["txt_ext"] = self.args.textfiles.replace(",", " ")
+        zs = " ".join(sorted(self.thumbcli.thumbable)) if self.thumbcli else ""
+        j2a["th_ext"] = zs
 
         if "mth" in vn.flags:
             j2a["def_hcols"] = vn.flags["mth"].split(",")
 
         html = self.j2s(tpl, **j2a)
-        self.reply(html.encode("utf-8", "replace"))
+        self.reply(self.compress_reply(html.encode("utf-8", "replace")))
         return True
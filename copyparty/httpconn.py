@@ -67,6 +67,8 @@ class HttpConn(object):
         self.t0: float = time.time()  # mypy404
         self.freshen_pwd: float = 0.0
         self.stopping = False
+        self.parked = False  # idle; waiting in hsrv.thr_park
+        self.t_park = 0.0
         self.nreq: int = -1  # mypy404
         self.nbyte: int = 0  # mypy404
         self.u2idx: Optional[U2idx] = None
@@ -161,22 +163,7 @@ class HttpConn(object):
 
             self.log_src = self.log_src.replace("[36m", "[35m")
             try:
-                ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-                ctx.load_cert_chain(self.cert_path)
-                if self.args.ssl_ver:
-                    ctx.options &= ~self.args.ssl_flags_en
-                    ctx.options |= self.args.ssl_flags_de
-                    # print(repr(ctx.options))
-
-                if self.args.ssl_log:
-                    try:
-                        ctx.keylog_filename = self.args.ssl_log
-                    except:
-                        self.log("keylog failed; openssl or python too old")
-
-                if self.args.ciphers:
-                    ctx.set_ciphers(self.args.ciphers)
-
+                ctx = self.hsrv.get_ssl_ctx()
                 self.s = ctx.wrap_socket(self.s, server_side=True)
                 msg = [
                     "\033[1;3{:d}m{}".format(c, s)
@@ -190,6 +177,7 @@ class HttpConn(object):
                     overlap = [str(y[::-1]) for y in ciphers]
                     self.log("TLS cipher overlap:" + "\n".join(overlap))
                     for k, v in [
+                        ["session reused", self.s.session_reused],
                         ["compression", self.s.compression()],
                         ["ALPN proto", self.s.selected_alpn_protocol()],
                         ["NPN proto", self.s.selected_npn_protocol()],
@@ -211,6 +199,15 @@ class HttpConn(object):
         if not self.sr:
             self.sr = Util.Unrecv(self.s, self.log)
 
+        self.run_reqs()
+
+    def run_reqs(self) -> None:
+        """
+        handles requests until the client leaves, or until it goes
+        quiet for --park seconds; then sets self.parked and returns
+        so hsrv can wait for the next request without a thread
+        """
+        assert self.sr
         while not self.stopping:
             self.nreq += 1
             self.cli = HttpCli(self)
@@ -220,3 +217,27 @@ class HttpConn(object):
             if self.u2idx:
                 self.hsrv.put_u2idx(str(self.addr), self.u2idx)
                 self.u2idx = None
+
+            if not self.hsrv.park_sel or self.sr.buf:
+                continue
+
+            zf = getattr(self.s, "pending", None)  # tls
+            if zf and zf():
+                continue
+
+            if self.args.park > 0:
+                try:
+                    self.s.settimeout(self.args.park)
+                    buf = self.s.recv(64 * 1024)
+                    if not buf:
+                        return
+
+                    self.sr.unrecv(buf)
+                    continue
+                except socket.timeout:
+                    pass
+                except:
+                    return
+
+            self.parked = True
+            return
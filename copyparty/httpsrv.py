@@ -2,6 +2,7 @@
 from __future__ import print_function, unicode_literals
 
 import base64
+import hashlib
 import math
 import os
 import socket
@@ -13,6 +14,16 @@ import queue
 
 from .__init__ import ANYWIN, CORES, EXE, MACOS, TYPE_CHECKING, EnvParams
 
+try:
+    import ssl
+except:
+    pass
+
+try:
+    import selectors
+except:
+    selectors = None  # type: ignore
+
 try:
     MNFE = ModuleNotFoundError
 except:
@@ -60,6 +71,7 @@ from .u2idx import U2idx
 from .util import (
     E_SCK,
     FHC,
+    HAVE_SQLITE3,
     Daemon,
     Garda,
     Magician,
@@ -120,6 +132,13 @@ class HttpSrv(object):
         )
         self.t_periodic: Optional[threading.Thread] = None
 
+        # idle keepalive connections wait here (in epoll/kqueue) for their
+        # next request instead of holding on to a thread from the pool
+        self.park_sel: Optional["selectors.BaseSelector"] = None
+        self.park_q: list[HttpConn] = []  # to be registered by thr_park
+        self.park_wake: Optional[socket.socket] = None
+        self.nparked = 0
+
         self.u2fh = FHC()
         self.srvs: list[socket.socket] = []
         self.ncli = 0  # exact
@@ -131,6 +150,13 @@ class HttpSrv(object):
         self.u2idx_free: dict[str, U2idx] = {}
         self.u2idx_n = 0
 
+        # folder listings (see tx_browser), least recently used first;
+        # (abspath, lstat) -> (validator, ctime, num-entries, (entries, hist))
+        self.lsc: dict[tuple[str, bool], tuple[Any, float, int, Any]] = {}
+        self.lsc_n = 0
+        self.lsc_gen = 0  # bumped by lsc_drop
+        self.lsc_mutex = threading.Lock()
+
         env = jinja2.Environment()
         env.loader = jinja2.FileSystemLoader(os.path.join(self.E.mod, "web"))
         jn = ["splash", "svcs", "browser", "browser2", "msg", "md", "mde", "cf"]
@@ -138,6 +164,12 @@ class HttpSrv(object):
         zs = os.path.join(self.E.mod, "web", "deps", "prism.js.gz")
         self.prism = os.path.exists(zs)
 
+        # web-ui resources (/.cpr/) to serve from memory;
+        # subpath -> (lastmod, {edition: (contents, etag)})
+        self.res: dict[str, tuple[int, dict[str, tuple[bytes, str]]]] = {}
+        if not self.args.no_cpr_cache:
+            self.load_res()
+
         self.mallow = "GET HEAD POST PUT DELETE OPTIONS".split()
         if not self.args.no_dav:
             zs = "PROPFIND PROPPATCH LOCK UNLOCK MKCOL COPY MOVE"
@@ -154,9 +186,23 @@ class HttpSrv(object):
         else:
             self.cert_path = ""
 
+        # one tls context for all connections (shared session cache + tickets);
+        # replaced when the cert changes on disk or on reload
+        self.ssl_ctx: Optional["ssl.SSLContext"] = None
+        self.ssl_key: Optional[tuple[float, int]] = None
+        self.ssl_chk = 0.0
+
         if self.tp_q:
             self.start_threads(4)
 
+            if self.args.park >= 0 and selectors and not ANYWIN:
+                self.park_sel = selectors.DefaultSelector()
+                zs, self.park_wake = socket.socketpair()
+                zs.setblocking(False)
+                self.park_wake.setblocking(False)
+                self.park_sel.register(zs, selectors.EVENT_READ)
+                Daemon(self.thr_park, self.name + "-park")
+
         if nid:
             if self.args.stackmon:
                 start_stackmon(self.args.stackmon, nid)
@@ -167,6 +213,45 @@ class HttpSrv(object):
         self.th_cfg: dict[str, Any] = {}
         Daemon(self.post_init, "hsrv-init2")
 
+    def load_res(self) -> None:
+        top = os.path.join(self.E.mod, "web")
+        files: dict[str, tuple[bytes, int]] = {}
+        for dp, dns, fns in os.walk(top):
+            dns[:] = [x for x in dns if x != "__pycache__"]
+            for fn in fns:
+                ap = os.path.join(dp, fn)
+                try:
+                    with open(ap, "rb") as f:
+                        buf = f.read()
+
+                    ts = int(os.stat(ap).st_mtime)
+                except:
+                    continue
+
+                rp = os.path.relpath(ap, top).replace(os.sep, "/")
+                files[rp] = (buf, ts)
+
+        # same editions as tx_file would find on disk
+        nbytes = 0
+        for rp in files:
+            eds = {}
+            file_ts = 0
+            for ext in ["", ".gz", ".br"]:
+                zt = files.get(rp + ext)
+                if not zt:
+                    continue
+
+                buf, ts = zt
+                file_ts = max(file_ts, ts)
+                etag = hashlib.sha1(buf).hexdigest()[:20]
+                eds[ext or "plain"] = (buf, '"{}"'.format(etag))
+
+            self.res[rp] = (file_ts, eds)
+            nbytes += len(files[rp][0])
+
+        t = "cached {} web-ui files, {} KiB"
+        self.log(self.name, t.format(len(self.res), nbytes // 1024), 6)
+
     def post_init(self) -> None:
         try:
             x = self.broker.ask("thumbsrv.getcfg")
@@ -174,6 +259,71 @@ class HttpSrv(object):
         except:
             pass
 
+    def reload(self) -> None:
+        with self.mutex:
+            self.ssl_key = None
+            self.ssl_chk = 0.0
+
+    def get_ssl_ctx(self) -> "ssl.SSLContext":
+        now = time.time()
+        ctx = self.ssl_ctx
+        if ctx and now < self.ssl_chk:
+            return ctx
+
+        with self.mutex:
+            if self.ssl_ctx and now < self.ssl_chk:
+                return self.ssl_ctx
+
+            self.ssl_chk = now + 2
+            try:
+                # the cert may be missing for a moment while it is replaced
+                st = os.stat(self.cert_path)
+                key = (st.st_mtime, st.st_size)
+                if self.ssl_ctx and key == self.ssl_key:
+                    return self.ssl_ctx
+
+                ctx = self._new_ssl_ctx()
+            except Exception as ex:
+                if not self.ssl_ctx:
+                    raise
+
+                t = "cannot reload tls certificate; keeping the old one: {!r}"
+                self.log(self.name, t.format(ex), 3)
+                return self.ssl_ctx
+
+            if self.ssl_ctx:
+                self.log(self.name, "reloaded tls certificate")
+
+            self.ssl_ctx = ctx
+            self.ssl_key = key
+            return ctx
+
+    def _new_ssl_ctx(self) -> "ssl.SSLContext":
+        ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ctx.load_cert_chain(self.cert_path)
+        if self.args.ssl_ver:
+            ctx.options &= ~self.args.ssl_flags_en
+            ctx.options |= self.args.ssl_flags_de
+            # print(repr(ctx.options))
+
+        # resumption; tickets are per-context so this is why it's shared
+        ctx.options &= ~getattr(ssl, "OP_NO_TICKET", 0)
+        try:
+            ctx.set_alpn_protocols(["http/1.1"])
+        except:
+            pass  # openssl too old
+
+        if self.args.ssl_log:
+            try:
+                ctx.keylog_filename = self.args.ssl_log
+            except:
+                self.log(self.name, "keylog failed; openssl or python too old")
+
+        if self.args.ciphers:
+            ctx.set_ciphers(self.args.ciphers)
+
+        return ctx
+
     def set_netdevs(self, netdevs: dict[str, Netdev]) -> None:
         ips = set()
         for ip, _ in self.bound:
@@ -204,7 +354,8 @@ class HttpSrv(object):
             with self.mutex:
                 self.u2fh.clean()
                 if self.tp_q:
-                    self.tp_ncli = max(self.ncli, self.tp_ncli - 2)
+                    zi = self.ncli - self.nparked
+                    self.tp_ncli = max(zi, self.tp_ncli - 2)
                     if self.tp_nthr > self.tp_ncli + 8:
                         self.stop_threads(4)
 
@@ -353,11 +504,11 @@ class HttpSrv(object):
 
             if self.tp_q:
                 self.tp_time = self.tp_time or now
-                self.tp_ncli = max(self.tp_ncli, self.ncli)
-                if self.tp_nthr < self.ncli + 4:
+                self.tp_ncli = max(self.tp_ncli, self.ncli - self.nparked)
+                if self.tp_nthr < self.ncli - self.nparked + 4:
                     self.start_threads(8)
 
-                self.tp_q.put((sck, addr))
+                self.tp_q.put((sck, addr, None))
                 return
 
         if not self.args.no_htp:
@@ -381,12 +532,12 @@ class HttpSrv(object):
                 self.tp_time = 0
 
             try:
-                sck, addr = task
+                sck, addr, cli = task
                 me = threading.current_thread()
                 me.name = "httpconn-{}-{}".format(
                     addr[0].split(".", 2)[-1][-6:], addr[1]
                 )
-                self.thr_client(sck, addr)
+                self.thr_client(sck, addr, cli)
                 me.name = self.name + "-poolw"
             except Exception as ex:
                 if str(ex).startswith("client d/c "):
@@ -421,19 +572,33 @@ class HttpSrv(object):
 
         self.log(self.name, "ok bye")
 
-    def thr_client(self, sck: socket.socket, addr: tuple[str, int]) -> None:
-        """thread managing one tcp client"""
-        cli = HttpConn(sck, addr, self)
-        with self.mutex:
-            self.clients.add(cli)
+    def thr_client(
+        self, sck: socket.socket, addr: tuple[str, int], cli: Optional[HttpConn] = None
+    ) -> None:
+        """thread managing one tcp client (new, or back from the parking lot)"""
+        resumed = bool(cli)
+        if cli:
+            cli.parked = False
+        else:
+            cli = HttpConn(sck, addr, self)
+            with self.mutex:
+                self.clients.add(cli)
 
         # print("{}\n".format(len(self.clients)), end="")
         fno = sck.fileno()
+        parked = False
         try:
             if self.args.log_conn:
                 self.log("%s %s" % addr, "|%sC-crun" % ("-" * 4,), c="90")
 
-            cli.run()
+            if resumed:
+                cli.run_reqs()
+            else:
+                cli.run()
+
+            if cli.parked:
+                self.park(cli)
+                parked = True
 
         except (OSError, socket.error) as ex:
             if ex.errno not in E_SCK:
@@ -444,29 +609,112 @@ class HttpSrv(object):
                 )
 
         finally:
-            sck = cli.s
-            if self.args.log_conn:
-                self.log("%s %s" % addr, "|%sC-cdone" % ("-" * 5,), c="90")
+            if not parked:
+                self.drop_client(cli, addr)
 
-            try:
-                fno = sck.fileno()
-                shut_socket(cli.log, sck)
-            except (OSError, socket.error) as ex:
-                if not MACOS:
-                    self.log(
-                        "%s %s" % addr,
-                        "shut({}): {}".format(fno, ex),
-                        c="90",
-                    )
-                if ex.errno not in E_SCK:
-                    raise
-            finally:
-                with self.mutex:
-                    self.clients.remove(cli)
-                    self.ncli -= 1
+    def park(self, cli: HttpConn) -> None:
+        """hand an idle keepalive connection over to thr_park"""
+        assert self.park_wake
+        cli.t_park = time.time()
+        with self.mutex:
+            self.park_q.append(cli)
+            self.nparked += 1
+
+        try:
+            self.park_wake.send(b"\n")
+        except:
+            pass  # wakeup already pending
+
+    def thr_park(self) -> None:
+        """
+        waits for the next request on idle keepalive connections,
+        then gives them back to the threadpool
+        """
+        sel = self.park_sel
+        assert sel
+        t_idle = self.args.s_thead
+        t_chk = 0.0
+        while not self.stopping:
+            rdy = sel.select(5)
+            now = time.time()
+            with self.mutex:
+                zl, self.park_q = self.park_q, []
+
+            for cli in zl:
+                try:
+                    zk = sel.get_map().get(cli.s.fileno())
+                    if zk:
+                        # previous owner of this fd was closed while parked
+                        sel.unregister(zk.fileobj)
+                        self.unpark(zk.data, True)
+
+                    sel.register(cli.s, selectors.EVENT_READ, cli)
+                except:
+                    self.unpark(cli, True)  # client is already gone
+
+            for key, _ in rdy:
+                cli = key.data
+                if cli:
+                    sel.unregister(key.fileobj)
+                    self.unpark(cli, False)
+                else:
+                    try:
+                        key.fileobj.recv(4096)
+                    except:
+                        pass
+
+            if now - t_chk < 5:
+                continue
+
+            t_chk = now
+            for key in list(sel.get_map().values()):
+                cli = key.data
+                if cli and (cli.stopping or now - cli.t_park > t_idle):
+                    sel.unregister(key.fileobj)
+                    self.unpark(cli, True)
 
-                if cli.u2idx:
-                    self.put_u2idx(str(addr), cli.u2idx)
+    def unpark(self, cli: HttpConn, close: bool) -> None:
+        """wakes up a parked connection to serve its next request (or to close)"""
+        if close:
+            cli.stopping = True
+
+        with self.mutex:
+            self.nparked -= 1
+            if self.tp_q:
+                self.tp_time = self.tp_time or time.time()
+                if self.tp_nthr < self.ncli - self.nparked + 4:
+                    self.start_threads(8)
+
+                self.tp_q.put((cli.s, cli.addr, cli))
+                return
+
+        Daemon(self.thr_client, "httpconn-unpark", (cli.s, cli.addr, cli))
+
+    def drop_client(self, cli: HttpConn, addr: tuple[str, int]) -> None:
+        """closes the connection and forgets about it"""
+        sck = cli.s
+        if self.args.log_conn:
+            self.log("%s %s" % addr, "|%sC-cdone" % ("-" * 5,), c="90")
+
+        try:
+            fno = sck.fileno()
+            shut_socket(cli.log, sck)
+        except (OSError, socket.error) as ex:
+            if not MACOS:
+                self.log(
+                    "%s %s" % addr,
+                    "shut({}): {}".format(fno, ex),
+                    c="90",
+                )
+            if ex.errno not in E_SCK:
+                raise
+        finally:
+            with self.mutex:
+                self.clients.remove(cli)
+                self.ncli -= 1
+
+            if cli.u2idx:
+                self.put_u2idx(str(addr), cli.u2idx)
 
     def cachebuster(self) -> str:
         if time.time() - self.cb_ts < 1:
@@ -491,6 +739,9 @@ class HttpSrv(object):
             return self.cb_v
 
     def get_u2idx(self, ident: str) -> Optional[U2idx]:
+        if not HAVE_SQLITE3:
+            return None
+
         utab = self.u2idx_free
         for _ in range(100):  # 5/0.05 = 5sec
             with self.mutex:
@@ -517,3 +768,43 @@ class HttpSrv(object):
                 ident += "a"
 
             self.u2idx_free[ident] = u2idx
+
+    def lsc_get(self, key: tuple[str, bool], chk: Any) -> Any:
+        with self.lsc_mutex:
+            zt = self.lsc.pop(key, None)
+            if not zt:
+                return None
+
+            if zt[0] != chk or time.time() - zt[1] > self.args.ls_cache_ttl:
+                self.lsc_n -= zt[2]
+                return None
+
+            self.lsc[key] = zt
+            return zt[3]
+
+    def lsc_put(
+        self, key: tuple[str, bool], chk: Any, gen: int, n: int, val: Any
+    ) -> None:
+        with self.lsc_mutex:
+            if gen != self.lsc_gen:
+                return  # up2k changed something while we were listing
+
+            zt = self.lsc.pop(key, None)
+            if zt:
+                self.lsc_n -= zt[2]
+
+            self.lsc[key] = (chk, time.time(), n, val)
+            self.lsc_n += n
+            while self.lsc_n > self.args.ls_cache and self.lsc:
+                zk = next(iter(self.lsc))
+                self.lsc_n -= self.lsc.pop(zk)[2]
+
+    def lsc_drop(self, aps: list[str]) -> None:
+        """forget cached listings of these folders; called by up2k"""
+        with self.lsc_mutex:
+            self.lsc_gen += 1
+            for ap in aps:
+                for zk in [(ap, False), (ap, True)]:
+                    zt = self.lsc.pop(zk, None)
+                    if zt:
+                        self.lsc_n -= zt[2]
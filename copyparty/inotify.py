@@ -0,0 +1,202 @@
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import errno
+import os
+import struct
+import threading
+
+from .__init__ import ANYWIN, MACOS, TYPE_CHECKING
+from .util import Daemon, fsdec, fsenc, min_ex
+
+try:
+    import ctypes
+    import ctypes.util
+except:
+    pass
+
+if True:  # pylint: disable=using-constant-test
+    from typing import Union
+
+if TYPE_CHECKING:
+    from .util import RootLogger
+
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+
+
+class Inotify(object):
+    """
+    watches folders for changes (linux only, no dependencies);
+    collects which folders need a rescan, up2k picks them up with pop()
+    """
+
+    def __init__(self, log_func: "RootLogger", cond: threading.Condition) -> None:
+        self.log_func = log_func
+        self.cond = cond
+        self.ok = False
+        self.full = False  # ran out of watches
+        self.mutex = threading.Lock()
+        self.fd = -1
+
+        # wd -> (ptop, abspath) and back
+        self.wds: dict[int, tuple[str, str]] = {}
+        self.aps: dict[str, int] = {}
+
+        # ptop -> abspath -> recursive
+        self.dirty: dict[str, dict[str, bool]] = {}
+        self.gone: dict[str, set[str]] = {}
+        self.lost: set[str] = set()
+
+        if ANYWIN or MACOS:
+            return
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._init1 = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+            self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            self._rm_watch = libc.inotify_rm_watch
+            self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            self.fd = self._init1(IN_CLOEXEC)
+            if self.fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+        except Exception as ex:
+            self.log("unavailable; will use periodic rescans: {!r}".format(ex), 3)
+            return
+
+        self.ok = True
+        Daemon(self._reader, "inotify")
+
+    def log(self, msg: str, c: Union[int, str] = 0) -> None:
+        self.log_func("inotify", msg, c)
+
+    def watch(self, ptop: str, ap: str) -> bool:
+        if not self.ok or self.full:
+            return False
+
+        with self.mutex:
+            if ap in self.aps:
+                return True
+
+            wd = self._add_watch(self.fd, fsenc(ap), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    t = "out of watches (see fs.inotify.max_user_watches); volumes which are not fully watched will use periodic rescans"
+                    self.log(t, 3)
+                    self.full = True
+                elif err != errno.ENOENT:
+                    self.log("cannot watch [{}]: {}".format(ap, os.strerror(err)), 6)
+
+                return False
+
+            # same wd if the folder was moved here from elsewhere
+            zt = self.wds.get(wd)
+            if zt:
+                self.aps.pop(zt[1], None)
+
+            self.wds[wd] = (ptop, ap)
+            self.aps[ap] = wd
+            return True
+
+    def busy(self) -> bool:
+        return bool(self.dirty or self.gone or self.lost)
+
+    def pop(self) -> tuple[dict[str, dict[str, bool]], dict[str, set[str]], set[str]]:
+        """returns folders which changed, disappeared, and volumes to fully rescan"""
+        with self.mutex:
+            ret = (self.dirty, self.gone, self.lost)
+            self.dirty = {}
+            self.gone = {}
+            self.lost = set()
+            return ret
+
+    def _mark(self, ptop: str, ap: str, rec: bool) -> None:
+        zd = self.dirty.setdefault(ptop, {})
+        zd[ap] = rec or zd.get(ap, False)
+
+    def _reader(self) -> None:
+        hsz = struct.calcsize("iIII")
+        while True:
+            try:
+                buf = os.read(self.fd, 256 * 1024)
+            except OSError as ex:
+                if ex.errno == errno.EINTR:
+                    continue
+
+                self.log("read failed; giving up:\n" + min_ex(), 1)
+                self.ok = False
+                return
+
+            ofs = 0
+            with self.mutex:
+                while ofs + hsz <= len(buf):
+                    wd, mask, _, nlen = struct.unpack("iIII", buf[ofs : ofs + hsz])
+                    bname = buf[ofs + hsz : ofs + hsz + nlen].rstrip(b"\0")
+                    ofs += hsz + nlen
+                    self._event(wd, mask, fsdec(bname) if bname else "")
+
+            with self.cond:
+                self.cond.notify_all()
+
+    def _event(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self.log("event queue overflow; will do a full rescan", 3)
+            self.lost.update([x[0] for x in self.wds.values()])
+            return
+
+        zt = self.wds.get(wd)
+        if not zt:
+            return
+
+        ptop, ap = zt
+        if mask & IN_IGNORED:
+            del self.wds[wd]
+            if self.aps.get(ap) == wd:
+                del self.aps[ap]
+            return
+
+        if name.endswith(".PARTIAL"):
+            return  # in-progress upload; up2k indexes those itself
+
+        self._mark(ptop, ap, False)
+        if not mask & IN_ISDIR:
+            return
+
+        sap = os.path.join(ap, name)
+        if mask & (IN_CREATE | IN_MOVED_TO):
+            self._mark(ptop, sap, True)
+            self.gone.get(ptop, set()).discard(sap)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.gone.setdefault(ptop, set()).add(sap)
+            self.dirty[ptop].pop(sap, None)
+            if mask & IN_DELETE:
+                return  # watches are dropped by the kernel (IN_IGNORED)
+
+            # moved away; forget the whole subtree
+            pfx = sap + os.sep
+            for zs in [x for x in self.aps if x == sap or x.startswith(pfx)]:
+                # keep wds[wd] until IN_IGNORED so late events still map
+                self._rm_watch(self.fd, self.aps.pop(zs))
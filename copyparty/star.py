@@ -1,44 +1,40 @@
 # coding: utf-8
 from __future__ import print_function, unicode_literals
 
+import os
 import stat
 import tarfile
 
-from queue import Queue
-
 from .bos import bos
 from .sutil import StreamArc, errdesc
-from .util import Daemon, fsenc, min_ex
+from .util import min_ex
 
 if True:  # pylint: disable=using-constant-test
-    from typing import Any, Generator, Optional
+    from typing import Any, Generator, Union
 
     from .util import NamedLogger
 
 
-class QFile(object):  # inherit io.StringIO for painful typing
-    """file-like object which buffers writes into a queue"""
-
-    def __init__(self) -> None:
-        self.q: Queue[Optional[bytes]] = Queue(64)
-        self.bq: list[bytes] = []
-        self.nq = 0
-
-    def write(self, buf: Optional[bytes]) -> None:
-        if buf is None or self.nq >= 240 * 1024:
-            self.q.put(b"".join(self.bq))
-            self.bq = []
-            self.nq = 0
-
-        if buf is None:
-            self.q.put(None)
-        else:
-            self.bq.append(buf)
-            self.nq += len(buf)
+def gen_hdr(name: str, fsi: os.stat_result) -> bytes:
+    """
+    header block(s) for one file; gnu format, since python 3.8 changed
+    tarfile to PAX_FORMAT by default which is a waste of space for this,
+    and gnu handles long names and huge files just fine
+    """
+    inf = tarfile.TarInfo(name=name)
+    inf.mode = fsi.st_mode
+    inf.size = fsi.st_size
+    inf.mtime = int(fsi.st_mtime)
+    inf.uid = 0
+    inf.gid = 0
+    return inf.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
 
 
 class StreamTar(StreamArc):
-    """construct in-memory tar file from the given path"""
+    """
+    construct tar file from the given paths; headers and padding are
+    generated here, file contents are passed to the caller to sendfile
+    """
 
     def __init__(
         self,
@@ -48,34 +44,16 @@ class StreamTar(StreamArc):
     ):
         super(StreamTar, self).__init__(log, fgen)
 
-        self.ci = 0
-        self.co = 0
-        self.qfile = QFile()
+        self.pos = 0
         self.errf: dict[str, Any] = {}
 
-        # python 3.8 changed to PAX_FORMAT as default,
-        # waste of space and don't care about the new features
-        fmt = tarfile.GNU_FORMAT
-        self.tar = tarfile.open(fileobj=self.qfile, mode="w|", format=fmt)  # type: ignore
-
-        Daemon(self._gen, "star-gen")
+    def _ct(self, buf: bytes) -> bytes:
+        self.pos += len(buf)
+        return buf
 
-    def gen(self) -> Generator[Optional[bytes], None, None]:
-        try:
-            while True:
-                buf = self.qfile.q.get()
-                if not buf:
-                    break
-
-                self.co += len(buf)
-                yield buf
-
-            yield None
-        finally:
-            if self.errf:
-                bos.unlink(self.errf["ap"])
-
-    def ser(self, f: dict[str, Any]) -> None:
+    def ser(
+        self, f: dict[str, Any]
+    ) -> Generator[Union[bytes, tuple[str, int]], None, None]:
         name = f["vp"]
         src = f["ap"]
         fsi = f["st"]
@@ -83,34 +61,50 @@ class StreamTar(StreamArc):
         if stat.S_ISDIR(fsi.st_mode):
             return
 
-        inf = tarfile.TarInfo(name=name)
-        inf.mode = fsi.st_mode
-        inf.size = fsi.st_size
-        inf.mtime = fsi.st_mtime
-        inf.uid = 0
-        inf.gid = 0
+        sz = fsi.st_size
+        pbuf = f.pop("buf", None)  # from Prefetch
+        yield self._ct(gen_hdr(name, fsi))
 
-        self.ci += inf.size
-        with open(fsenc(src), "rb", 512 * 1024) as fo:
-            self.tar.addfile(inf, fo)
+        if pbuf is not None:
+            if pbuf:
+                yield self._ct(pbuf)
+        elif sz:
+            self.pos += sz
+            yield (src, sz)
 
-    def _gen(self) -> None:
+        # pad to the next block
+        zi = sz % tarfile.BLOCKSIZE
+        if zi:
+            yield self._ct(b"\0" * (tarfile.BLOCKSIZE - zi))
+
+    def gen(self) -> Generator[Union[None, bytes, tuple[str, int]], None, None]:
         errors = []
-        for f in self.fgen:
-            if "err" in f:
-                errors.append((f["vp"], f["err"]))
-                continue
-
-            try:
-                self.ser(f)
-            except:
-                ex = min_ex(5, True).replace("\n", "\n-- ")
-                errors.append((f["vp"], ex))
-
-        if errors:
-            self.errf, txt = errdesc(errors)
-            self.log("\n".join(([repr(self.errf)] + txt[1:])))
-            self.ser(self.errf)
-
-        self.tar.close()
-        self.qfile.write(None)
+        try:
+            for f in self.fgen:
+                if "err" in f:
+                    errors.append((f["vp"], f["err"]))
+                    continue
+
+                try:
+                    for x in self.ser(f):
+                        yield x
+                except GeneratorExit:
+                    raise
+                except:
+                    ex = min_ex(5, True).replace("\n", "\n-- ")
+                    errors.append((f["vp"], ex))
+
+            if errors:
+                self.errf, txt = errdesc(errors)
+                self.log("\n".join(([repr(self.errf)] + txt[1:])))
+                for x in self.ser(self.errf):
+                    yield x
+
+            # two empty blocks, then pad to a full record like tarfile does
+            zi = self.pos + tarfile.BLOCKSIZE * 2
+            zi += -zi % tarfile.RECORDSIZE
+            yield self._ct(b"\0" * (zi - self.pos))
+            yield None
+        finally:
+            if self.errf:
+                bos.unlink(self.errf["ap"])
@@ -1,13 +1,18 @@
 # coding: utf-8
 from __future__ import print_function, unicode_literals
 
+import os
+import stat
 import tempfile
+import threading
 from datetime import datetime
+from queue import Queue
 
 from .bos import bos
+from .util import HAVE_FADVISE, Daemon, fsenc
 
 if True:  # pylint: disable=using-constant-test
-    from typing import Any, Generator, Optional
+    from typing import Any, Generator, Optional, Union
 
     from .util import NamedLogger
 
@@ -22,10 +27,92 @@ class StreamArc(object):
         self.log = log
         self.fgen = fgen
 
-    def gen(self) -> Generator[Optional[bytes], None, None]:
+    def gen(self) -> Generator[Union[None, bytes, tuple[str, int]], None, None]:
+        """
+        yields the archive as bytes, or (abspath, size) for file contents
+        which can be sent as-is (sendfile); None at the end (optional)
+        """
         raise Exception("override me")
 
 
+class Prefetch(object):
+    """
+    reads the next few files of an archive while the current one is
+    being sent; small files are read into f["buf"], larger ones
+    just get a readahead hint so the kernel starts fetching them
+    """
+
+    def __init__(
+        self,
+        log: "NamedLogger",
+        fgen: Generator[dict[str, Any], None, None],
+        nfiles: int,
+    ) -> None:
+        self.log = log
+        self.fgen = fgen
+        self.nfiles = nfiles
+        self.nthr = min(4, nfiles)
+        self.buf_max = 512 * 1024
+        self.stop = False
+        self.q: Queue[Optional[tuple[dict[str, Any], threading.Event]]] = Queue()
+
+    def gen(self) -> Generator[dict[str, Any], None, None]:
+        for _ in range(self.nthr):
+            Daemon(self._worker, "zip-pf")
+
+        pend: list[tuple[dict[str, Any], threading.Event]] = []
+        try:
+            for f in self.fgen:
+                ev = threading.Event()
+                pend.append((f, ev))
+                self.q.put((f, ev))
+                if len(pend) < self.nfiles:
+                    continue
+
+                f, ev = pend.pop(0)
+                ev.wait()
+                yield f
+
+            for f, ev in pend:
+                ev.wait()
+                yield f
+        finally:
+            self.stop = True
+            for _ in range(self.nthr):
+                self.q.put(None)
+
+    def _worker(self) -> None:
+        while True:
+            job = self.q.get()
+            if not job:
+                return
+
+            f, ev = job
+            try:
+                if not self.stop and "err" not in f:
+                    self._read(f)
+            except:
+                pass  # the packer will hit the same error and report it
+
+            ev.set()
+
+    def _read(self, f: dict[str, Any]) -> None:
+        st = f["st"]
+        if not stat.S_ISREG(st.st_mode):
+            return
+
+        with open(fsenc(f["ap"]), "rb", 0) as fo:
+            if st.st_size <= self.buf_max:
+                # if the file changed since the stat, leave it to the
+                # packer so the archive matches the header it writes
+                buf = fo.read(st.st_size + 1)
+                if len(buf) == st.st_size:
+                    f["buf"] = buf
+            elif HAVE_FADVISE:
+                zi = os.POSIX_FADV_WILLNEED
+                os.posix_fadvise(fo.fileno(), 0, 4 * 1024 * 1024, zi)
+
+
 def errdesc(errors: list[tuple[str, str]]) -> tuple[dict[str, Any], list[str]]:
     report = ["copyparty failed to add the following files to the archive:", ""]
 
@@ -36,6 +36,7 @@ from .th_srv import HAVE_PIL, HAVE_VIPS, HAVE_WEBP, ThumbSrv
 from .up2k import Up2k
 from .util import (
     FFMPEG_URL,
+    HAVE_SQLITE3,
     VERSIONS,
     Daemon,
     Garda,
@@ -203,6 +204,11 @@ class SvcHub(object):
                 msg = "disabling webp thumbnails because either libwebp is not available or your Pillow is too old"
                 self.log("thumb", msg, c=3)
 
+            if args.th_pack and not HAVE_SQLITE3:
+                msg = "disabling --th-pack because python was built without sqlite3"
+                self.log("thumb", msg, c=3)
+                args.th_pack = False
+
             if self.args.th_dec:
                 self.thumbsrv = ThumbSrv(self)
             else:
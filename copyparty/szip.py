@@ -11,7 +11,7 @@ from .sutil import StreamArc, errdesc
 from .util import min_ex, sanitize_fn, spack, sunpack, yieldfile
 
 if True:  # pylint: disable=using-constant-test
-    from typing import Any, Generator, Optional
+    from typing import Any, Generator, Optional, Union
 
     from .util import NamedLogger
 
@@ -234,7 +234,9 @@ class StreamZip(StreamArc):
         self.pos += len(buf)
         return buf
 
-    def ser(self, f: dict[str, Any]) -> Generator[bytes, None, None]:
+    def ser(
+        self, f: dict[str, Any]
+    ) -> Generator[Union[bytes, tuple[str, int]], None, None]:
         name = f["vp"]
         src = f["ap"]
         st = f["st"]
@@ -244,23 +246,37 @@ class StreamZip(StreamArc):
 
         sz = st.st_size
         ts = st.st_mtime
+        pbuf = f.pop("buf", None)  # from Prefetch
 
         crc = 0
         if self.pre_crc:
-            for buf in yieldfile(src):
-                crc = zlib.crc32(buf, crc)
+            if "crc" in f:
+                crc = f["crc"]
+            else:
+                for buf in [pbuf] if pbuf is not None else yieldfile(src):
+                    crc = zlib.crc32(buf, crc)
 
-            crc &= 0xFFFFFFFF
+                crc &= 0xFFFFFFFF
+                f["crc"] = crc  # for the caller to cache
 
         h_pos = self.pos
         buf = gen_hdr(None, name, sz, ts, self.utf8, crc, self.pre_crc)
         yield self._ct(buf)
 
-        for buf in yieldfile(src):
+        if pbuf is not None:
             if not self.pre_crc:
+                crc = zlib.crc32(pbuf, crc)
+
+            if pbuf:  # empty would look like eof to the caller
+                yield self._ct(pbuf)
+        elif self.pre_crc:
+            # stored as-is and crc known; let the caller sendfile it
+            self.pos += sz
+            yield (src, sz)
+        else:
+            for buf in yieldfile(src):
                 crc = zlib.crc32(buf, crc)
-
-            yield self._ct(buf)
+                yield self._ct(buf)
 
         crc &= 0xFFFFFFFF
 
@@ -272,7 +288,7 @@ class StreamZip(StreamArc):
             buf = gen_fdesc(sz, crc, z64)
             yield self._ct(buf)
 
-    def gen(self) -> Generator[bytes, None, None]:
+    def gen(self) -> Generator[Union[bytes, tuple[str, int]], None, None]:
         errf: dict[str, Any] = {}
         errors = []
         try:
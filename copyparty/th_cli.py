@@ -6,15 +6,21 @@ import os
 from .__init__ import TYPE_CHECKING
 from .authsrv import VFS
 from .bos import bos
-from .th_srv import HAVE_WEBP, thumb_path
-from .util import Cooldown
+from .th_pack import ThPack
+from .th_srv import TH_WAIT, thumb_fmt, thumb_path
+from .util import Cooldown, sck_gone
 
 if True:  # pylint: disable=using-constant-test
     from typing import Optional, Union
 
 if TYPE_CHECKING:
+    import socket
+
     from .httpsrv import HttpSrv
 
+    # path of a thumbnail file, or (segment, offset, size, tpath) if --th-pack
+    ThumbRef = Union[str, tuple[str, int, int, str]]
+
 
 class ThumbCli(object):
     def __init__(self, hsrv: "HttpSrv") -> None:
@@ -40,14 +46,22 @@ class ThumbCli(object):
         self.fmt_ffv = c["ffv"]
         self.fmt_ffa = c["ffa"]
 
-        # defer args.th_ff_jpg, can change at runtime
-        d = next((x for x in self.args.th_dec if x in ("vips", "pil")), None)
-        self.can_webp = HAVE_WEBP or d == "vips"
+        # histpath -> thumbnail store, if --th-pack
+        self.packs: dict[str, ThPack] = {}
 
     def log(self, msg: str, c: Union[int, str] = 0) -> None:
         self.log_func("thumbcli", msg, c)
 
-    def get(self, dbv: VFS, rem: str, mtime: float, fmt: str) -> Optional[str]:
+    def get(
+        self,
+        dbv: VFS,
+        rem: str,
+        mtime: float,
+        fmt: str,
+        ip: str = "",
+        sck: Optional["socket.socket"] = None,
+        gen: bool = True,
+    ) -> Optional["ThumbRef"]:
         ptop = dbv.realpath
         ext = rem.rsplit(".")[-1].lower()
         if ext not in self.thumbable or "dthumb" in dbv.flags:
@@ -73,21 +87,11 @@ class ThumbCli(object):
         if is_img and "dithumb" in dbv.flags:
             return None
 
-        preferred = self.args.th_dec[0] if self.args.th_dec else ""
-
         if rem.startswith(".hist/th/") and rem.split(".")[-1] in ["webp", "jpg", "png"]:
             return os.path.join(ptop, rem)
 
-        if fmt == "j" and self.args.th_no_jpg:
-            fmt = "w"
-
-        if fmt == "w":
-            if (
-                self.args.th_no_webp
-                or (is_img and not self.can_webp)
-                or (self.args.th_ff_jpg and (not is_img or preferred == "ff"))
-            ):
-                fmt = "j"
+        if fmt in ("w", "j"):
+            fmt = thumb_fmt(self.args, fmt, is_img)
 
         histpath = self.asrv.vfs.histtab.get(ptop)
         if not histpath:
@@ -100,9 +104,26 @@ class ThumbCli(object):
             # also check for jpg (maybe webp is unavailable)
             tpaths.append(tpath.rsplit(".", 1)[0] + ".jpg")
 
+        zp = None
+        if self.args.th_pack and not want_opus:
+            zp = self.packs.get(histpath)
+            if not zp:
+                zp = ThPack(self.log_func, histpath, True)
+                self.packs[histpath] = zp
+
         ret = None
         abort = False
         for tp in tpaths:
+            if zp:
+                zt = zp.find(tp)
+                if zt and zt[2]:
+                    ret = (zt[0], zt[1], zt[2], tp)
+                    tpath = tp
+                elif zt:
+                    abort = True
+
+                continue
+
             try:
                 st = bos.stat(tp)
                 if st.st_size:
@@ -125,11 +146,34 @@ class ThumbCli(object):
 
             return ret
 
-        if abort:
+        if abort or not gen:
             return None
 
         if not bos.path.getsize(os.path.join(ptop, rem)):
             return None
 
-        x = self.broker.ask("thumbsrv.get", ptop, rem, mtime, fmt)
-        return x.get()  # type: ignore
+        if not sck:
+            x = self.broker.ask("thumbsrv.get", ptop, rem, mtime, fmt)
+            return self._ref(zp, x.get())
+
+        # keep asking while the client is still around, so thumbsrv
+        # knows which queued jobs are still wanted
+        while True:
+            x = self.broker.ask("thumbsrv.get", ptop, rem, mtime, fmt, ip, TH_WAIT)
+            ret = x.get()
+            if ret != "":
+                return self._ref(zp, ret)
+
+            if sck_gone(sck):
+                self.broker.say("thumbsrv.cancel", ptop, rem, mtime, fmt)
+                return None
+
+    def _ref(self, zp: Optional[ThPack], tpath: Optional[str]) -> Optional["ThumbRef"]:
+        if not zp or not tpath:
+            return tpath
+
+        zt = zp.find(tpath)
+        if not zt or not zt[2]:
+            return None
+
+        return (zt[0], zt[1], zt[2], tpath)
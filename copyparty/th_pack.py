@@ -0,0 +1,263 @@
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import threading
+import time
+
+from .__init__ import TYPE_CHECKING
+from .bos import bos
+from .util import HAVE_SQLITE3, fsenc, min_ex
+
+if HAVE_SQLITE3:
+    import sqlite3
+
+if True:  # pylint: disable=using-constant-test
+    import typing
+    from typing import Optional, Union
+
+if TYPE_CHECKING:
+    from .util import RootLogger
+
+
+# start a new segment when the current one would grow beyond this
+SEG_SZ = 64 * 1024 * 1024
+
+CREATE = [
+    "create table if not exists th (d text, f text, fmt text, ts int, seg int, ofs int, sz int, at int, primary key (d, f, fmt))",
+    "create index if not exists th_at on th(at)",
+    "create index if not exists th_seg on th(seg)",
+    "create table if not exists seg (n int primary key, sz int, dead int)",
+]
+
+# seg.dead of a compacted segment; the file is deleted on the next clean,
+# since clients may still be reading from it
+SEG_GONE = -1
+
+
+class ThPack(object):
+    """
+    thumbnail store for one volume (--th-pack); thumbnails are appended
+    to a few large segment files in histpath/thp/ with a sqlite index,
+    instead of one file each under histpath/th/
+
+    thumbnails are still identified by their thumb_path, so ThumbSrv and
+    ThumbCli keep their logic; expired and replaced thumbnails are only
+    counted as dead bytes in their segment, and segments which are
+    mostly dead get compacted, so cleanup cost follows the garbage
+    rather than the number of thumbnails
+
+    ThumbSrv has the only writer; ThumbCli opens the index read-only
+    """
+
+    def __init__(self, log_func: "RootLogger", histpath: str, ro: bool) -> None:
+        self.log_func = log_func
+        self.thdir = histpath + "/th/"
+        self.dir = os.path.join(histpath, "thp")
+        self.db_path = os.path.join(self.dir, "idx.db")
+        self.ro = ro
+        self.mutex = threading.Lock()
+        self.cur: Optional["sqlite3.Cursor"] = None
+
+        # writer; current segment and its size
+        self.seg = 0
+        self.ofs = 0
+        self.wf: Optional[typing.BinaryIO] = None
+
+    def log(self, msg: str, c: Union[int, str] = 0) -> None:
+        self.log_func("thpack", msg, c)
+
+    def segpath(self, n: int) -> str:
+        return os.path.join(self.dir, "{}.seg".format(n))
+
+    def tmp(self, tpath: str) -> str:
+        """where the current thread should write the thumbnail for tpath"""
+        with self.mutex:
+            self._cur()  # creates the folder
+
+        zs = threading.current_thread().name + "." + tpath.rsplit(".", 1)[1]
+        return os.path.join(self.dir, "w", zs)
+
+    def key(self, tpath: str) -> tuple[str, str, str, int]:
+        d, fn = tpath[len(self.thdir) :].rsplit("/", 1)
+        f, ts, fmt = fn.split(".")
+        return d, f, fmt, int(ts, 16)
+
+    def _cur(self) -> Optional["sqlite3.Cursor"]:
+        if self.cur:
+            return self.cur
+
+        if self.ro:
+            if not HAVE_SQLITE3 or not bos.path.exists(self.db_path):
+                return None
+
+            db = sqlite3.connect(self.db_path, 2, check_same_thread=False)
+            self.cur = db.cursor()
+            return self.cur
+
+        bos.makedirs(os.path.join(self.dir, "w"))
+        cur = sqlite3.connect(self.db_path, 10, check_same_thread=False).cursor()
+        cur.execute("pragma journal_mode=wal")
+        cur.execute("pragma synchronous=normal")
+        for zs in CREATE:
+            cur.execute(zs)
+
+        zt = cur.execute("select n, sz from seg order by n desc limit 1").fetchone()
+        if zt:
+            self.seg, sz = zt
+        else:
+            self.seg, sz = 1, 0
+            cur.execute("insert into seg values (1, 0, 0)")
+
+        self.wf = open(fsenc(self.segpath(self.seg)), "ab")
+        self.ofs = self.wf.tell()
+        if self.ofs != sz:
+            # appended but not indexed before a crash
+            t = "update seg set sz=?, dead=dead+? where n=?"
+            cur.execute(t, (self.ofs, self.ofs - sz, self.seg))
+
+        cur.connection.commit()
+        self.cur = cur
+        return cur
+
+    def _next(self, cur: "sqlite3.Cursor") -> None:
+        assert self.wf
+        self.wf.close()
+        cur.execute("update seg set sz=? where n=?", (self.ofs, self.seg))
+        self.seg += 1
+        self.ofs = 0
+        cur.execute("insert into seg values (?, 0, 0)", (self.seg,))
+        self.wf = open(fsenc(self.segpath(self.seg)), "wb")
+
+    def _append(self, cur: "sqlite3.Cursor", buf: bytes) -> int:
+        assert self.wf
+        if self.ofs and self.ofs + len(buf) > SEG_SZ:
+            self._next(cur)
+
+        ofs = self.ofs
+        self.wf.write(buf)
+        self.ofs += len(buf)
+        return ofs
+
+    def find(self, tpath: str) -> Optional[tuple[str, int, int]]:
+        """segment, offset and size of a thumbnail (size 0 = failed)"""
+        d, f, fmt, ts = self.key(tpath)
+        q = "select seg, ofs, sz from th where d=? and f=? and fmt=? and ts=?"
+        with self.mutex:
+            cur = self._cur()
+            if not cur:
+                return None
+
+            zt = cur.execute(q, (d, f, fmt, ts)).fetchone()
+
+        if not zt:
+            return None
+
+        return self.segpath(zt[0]), zt[1], zt[2]
+
+    def put(self, tpath: str, src: str) -> None:
+        """move the thumbnail at src into the store"""
+        try:
+            with open(fsenc(src), "rb") as f:
+                buf = f.read()
+
+            os.unlink(fsenc(src))
+        except:
+            return  # conversion did not produce anything
+
+        d, f, fmt, ts = self.key(tpath)
+        with self.mutex:
+            cur = self._cur()
+            assert cur and self.wf
+            ofs = self._append(cur, buf)
+            self.wf.flush()
+
+            q = "select seg, sz from th where d=? and f=? and fmt=?"
+            zt = cur.execute(q, (d, f, fmt)).fetchone()
+            if zt:
+                # older version of the same file
+                cur.execute("update seg set dead=dead+? where n=?", (zt[1], zt[0]))
+
+            q = "insert or replace into th values (?,?,?,?,?,?,?,?)"
+            zt = (d, f, fmt, ts, self.seg, ofs, len(buf), int(time.time()))
+            cur.execute(q, zt)
+            cur.execute("update seg set sz=? where n=?", (self.ofs, self.seg))
+            cur.connection.commit()
+
+    def touch(self, tdir: str) -> None:
+        """a client looked at this folder; keep its thumbnails"""
+        with self.mutex:
+            cur = self._cur()
+            assert cur
+            q = "update th set at=? where d=?"
+            cur.execute(q, (int(time.time()), tdir[len(self.thdir) :]))
+            cur.connection.commit()
+
+    def clean(self, maxage: int) -> tuple[int, int]:
+        """
+        forgets thumbnails of folders which were not poked in maxage
+        seconds, then compacts segments which are at least half dead;
+        returns number of thumbnails forgotten, and bytes moved
+        """
+        with self.mutex:
+            cur = self._cur()
+            assert cur
+            q = "select n from seg where dead = ?"
+            for (n,) in cur.execute(q, (SEG_GONE,)).fetchall():
+                try:
+                    os.unlink(fsenc(self.segpath(n)))
+                except:
+                    pass
+
+                cur.execute("delete from seg where n=?", (n,))
+
+            lim = int(time.time()) - maxage
+            q = "select seg, sum(sz), count(*) from th where at < ? group by seg"
+            nrm = 0
+            for n, sz, nf in cur.execute(q, (lim,)).fetchall():
+                cur.execute("update seg set dead=dead+? where n=?", (sz, n))
+                nrm += nf
+
+            cur.execute("delete from th where at < ?", (lim,))
+            cur.connection.commit()
+
+            q = "select n from seg where n != ? and dead >= 0 and dead * 2 >= sz"
+            segs = [x[0] for x in cur.execute(q, (self.seg,))]
+
+        nmv = 0
+        for n in segs:
+            # one at a time so new thumbnails are not stuck waiting
+            with self.mutex:
+                nmv += self._compact(cur, n)
+
+        return nrm, nmv
+
+    def _compact(self, cur: "sqlite3.Cursor", n: int) -> int:
+        ap = self.segpath(n)
+        q = "select rowid, ofs, sz from th where seg=?"
+        rows = cur.execute(q, (n,)).fetchall()
+        ret = 0
+        try:
+            with open(fsenc(ap), "rb") as f:
+                for rowid, ofs, sz in rows:
+                    f.seek(ofs)
+                    buf = f.read(sz)
+                    if len(buf) != sz:
+                        raise Exception("segment {} is truncated".format(ap))
+
+                    zi = self._append(cur, buf)
+                    q = "update th set seg=?, ofs=? where rowid=?"
+                    cur.execute(q, (self.seg, zi, rowid))
+                    ret += sz
+
+            assert self.wf
+            self.wf.flush()
+            cur.execute("update seg set sz=? where n=?", (self.ofs, self.seg))
+        except:
+            # keep what was moved; the rest is gone
+            self.log("compacting {} failed:\n{}".format(ap, min_ex()), 3)
+            cur.execute("delete from th where seg=?", (n,))
+
+        cur.execute("update seg set dead=? where n=?", (SEG_GONE, n))
+        cur.connection.commit()
+        return ret
@@ -10,11 +10,12 @@ import subprocess as sp
 import threading
 import time
 
-from queue import Queue
+from queue import Full, Queue
 
 from .__init__ import ANYWIN, TYPE_CHECKING
 from .bos import bos
 from .mtag import HAVE_FFMPEG, HAVE_FFPROBE, ffprobe
+from .th_pack import ThPack
 from .util import (
     FFMPEG_URL,
     BytesIO,
@@ -23,6 +24,7 @@ from .util import (
     Pebkac,
     afsenc,
     fsenc,
+    humansize,
     min_ex,
     runcmd,
     statdir,
@@ -30,7 +32,7 @@ from .util import (
 )
 
 if True:  # pylint: disable=using-constant-test
-    from typing import Optional, Union
+    from typing import Any, Optional, Union
 
 if TYPE_CHECKING:
     from .svchub import SvcHub
@@ -103,6 +105,32 @@ def thumb_path(histpath: str, rem: str, mtime: float, fmt: str) -> str:
     return "{}/{}/{}/{}.{:x}.{}".format(histpath, cat, rd, fn, int(mtime), fmt)
 
 
+# drop queued jobs which nobody asked for in this many seconds
+# (ThumbCli asks again every TH_WAIT seconds while its client is connected)
+TH_WAIT = 1
+TH_WANT = 5
+
+
+def thumb_fmt(args: Any, fmt: str, is_img: bool) -> str:
+    """which thumbnail format to make when a client asks for fmt (w/j)"""
+    if fmt == "j" and args.th_no_jpg:
+        fmt = "w"
+
+    if fmt == "w":
+        # defer args.th_ff_jpg, can change at runtime
+        d = next((x for x in args.th_dec if x in ("vips", "pil")), None)
+        can_webp = HAVE_WEBP or d == "vips"
+        preferred = args.th_dec[0] if args.th_dec else ""
+        if (
+            args.th_no_webp
+            or (is_img and not can_webp)
+            or (args.th_ff_jpg and (not is_img or preferred == "ff"))
+        ):
+            fmt = "j"
+
+    return fmt
+
+
 class ThumbSrv(object):
     def __init__(self, hub: "SvcHub") -> None:
         self.hub = hub
@@ -119,10 +147,28 @@ class ThumbSrv(object):
         self.stopping = False
         self.nthr = max(1, self.args.th_mt)
 
-        self.q: Queue[Optional[tuple[str, str]]] = Queue(self.nthr * 4)
+        # pending conversions for each client-ip, newest last; the workers
+        # take the newest job of one ip at a time, round-robin between ips
+        self.cq: dict[str, list[tuple[str, str]]] = {}
+        self.crr: list[str] = []
+        self.qcond = threading.Condition(self.mutex)
+
+        # tpath -> last time a client asked for it (inf = never drop)
+        self.want: dict[str, float] = {}
+
+        # histpath -> thumbnail store, if --th-pack
+        self.packs: dict[str, ThPack] = {}
+
         for n in range(self.nthr):
             Daemon(self.worker, "thumb-{}-{}".format(n, self.nthr))
 
+        # new files from up2k (volflag thpre); made in the background
+        # whenever there are no thumbnails being made for clients;
+        # bounded, since ?th makes any which were dropped
+        self.pq: Queue[Optional[tuple[str, str, float, str]]] = Queue(4096)
+        self.pq_drop = 0
+        Daemon(self.pre_worker, "thumb-pre")
+
         want_ff = not self.args.no_vthumb or not self.args.no_athumb
         if want_ff and (not HAVE_FFMPEG or not HAVE_FFPROBE):
             missing = []
@@ -177,14 +223,27 @@ class ThumbSrv(object):
 
     def shutdown(self) -> None:
         self.stopping = True
-        for _ in range(self.nthr):
-            self.q.put(None)
+        try:
+            self.pq.put_nowait(None)
+        except Full:
+            pass  # pre_worker is not waiting, so it sees stopping
+        with self.mutex:
+            self.qcond.notify_all()
 
     def stopped(self) -> bool:
         with self.mutex:
             return not self.nthr
 
-    def get(self, ptop: str, rem: str, mtime: float, fmt: str) -> Optional[str]:
+    def get(
+        self, ptop: str, rem: str, mtime: float, fmt: str, ip: str = "", wait: float = 0
+    ) -> Optional[str]:
+        """
+        returns the thumbnail path when ready, or None if it failed;
+        with wait, gives up after that many seconds and returns ""
+        so the caller can check that its client is still there and ask
+        again -- jobs which nobody asked for in the last TH_WANT seconds
+        are dropped (unless the volume has thpre)
+        """
         histpath = self.asrv.vfs.histtab.get(ptop)
         if not histpath:
             self.log("no histpath for [{}]".format(ptop))
@@ -194,24 +253,30 @@ class ThumbSrv(object):
         abspath = os.path.join(ptop, rem)
         cond = threading.Condition(self.mutex)
         do_conv = False
+        t0 = time.time()
+        if not wait or "thpre" in self._flags(ptop):
+            t_want = float("inf")
+        else:
+            t_want = t0
+
         with self.mutex:
+            self.want[tpath] = max(t_want, self.want.get(tpath, 0))
             try:
                 self.busy[tpath].append(cond)
-                self.log("wait {}".format(tpath))
+                if not wait:
+                    self.log("wait {}".format(tpath))
             except:
-                thdir = os.path.dirname(tpath)
-                bos.makedirs(os.path.join(thdir, "w"))
-
-                inf_path = os.path.join(thdir, "dir.txt")
-                if not bos.path.exists(inf_path):
-                    with open(inf_path, "wb") as f:
-                        f.write(afsenc(os.path.dirname(abspath)))
-
+                self._mkdir(tpath, abspath)
                 self.busy[tpath] = [cond]
                 do_conv = True
+                if ip not in self.cq:
+                    self.cq[ip] = []
+                    self.crr.append(ip)
+
+                self.cq[ip].append((abspath, tpath))
+                self.qcond.notify()
 
         if do_conv:
-            self.q.put((abspath, tpath))
             self.log("conv {} \033[0m{}".format(tpath, abspath), c=6)
 
         while not self.stopping:
@@ -219,8 +284,20 @@ class ThumbSrv(object):
                 if tpath not in self.busy:
                     break
 
+                if wait and time.time() - t0 >= wait:
+                    zl = self.busy[tpath]
+                    if cond in zl:
+                        zl.remove(cond)
+
+                    return ""
+
             with cond:
-                cond.wait(3)
+                cond.wait(min(wait, 3) if wait else 3)
+
+        zp = self._pack(tpath)
+        if zp:
+            zt = zp.find(tpath)
+            return tpath if zt and zt[2] else None
 
         try:
             st = bos.stat(tpath)
@@ -232,6 +309,125 @@ class ThumbSrv(object):
 
         return None
 
+    def cancel(self, ptop: str, rem: str, mtime: float, fmt: str) -> None:
+        """a client left; drop the job unless someone else is waiting for it"""
+        histpath = self.asrv.vfs.histtab.get(ptop)
+        if not histpath:
+            return
+
+        tpath = thumb_path(histpath, rem, mtime, fmt)
+        with self.mutex:
+            t_want = self.want.get(tpath)
+            if t_want and t_want != float("inf") and not self.busy.get(tpath):
+                self.want[tpath] = 0
+
+    def _flags(self, ptop: str) -> dict[str, Any]:
+        for vol in self.asrv.vfs.all_vols.values():
+            if vol.realpath == ptop:
+                return vol.flags
+
+        return {}
+
+    def _pack(self, tpath: str) -> Optional[ThPack]:
+        """the --th-pack store which tpath belongs in, if any"""
+        if not self.args.th_pack:
+            return None
+
+        for histpath in self.asrv.vfs.histtab.values():
+            if tpath.startswith(histpath + "/th/"):
+                zp = ThPack(self.log_func, histpath, False)
+                return self.packs.setdefault(histpath, zp)
+
+        return None
+
+    def _exists(self, tpath: str) -> bool:
+        zp = self._pack(tpath)
+        if zp:
+            return zp.find(tpath) is not None
+
+        return bos.path.exists(tpath)
+
+    def _mkdir(self, tpath: str, abspath: str) -> None:
+        if self._pack(tpath):
+            return
+
+        thdir = os.path.dirname(tpath)
+        bos.makedirs(os.path.join(thdir, "w"))
+
+        inf_path = os.path.join(thdir, "dir.txt")
+        if not bos.path.exists(inf_path):
+            with open(inf_path, "wb") as f:
+                f.write(afsenc(os.path.dirname(abspath)))
+
+    def pre(self, ptop: str, rem: str, mtime: float, flags: dict[str, Any]) -> None:
+        """queue a thumbnail of a new file, in the format browsers ask for"""
+        ext = rem.rsplit(".")[-1].lower()
+        if ext not in self.thumbable or "dthumb" in flags:
+            return
+
+        is_vid = ext in self.fmt_ffv
+        is_au = ext in self.fmt_ffa
+        is_img = not is_vid and not is_au
+        if (
+            (is_vid and "dvthumb" in flags)
+            or (is_au and "dathumb" in flags)
+            or (is_img and "dithumb" in flags)
+        ):
+            return
+
+        try:
+            self.pq.put_nowait((ptop, rem, mtime, thumb_fmt(self.args, "w", is_img)))
+        except Full:
+            if not self.pq_drop % 1000:
+                t = "thumbnail pre-queue is full; dropped {} so far"
+                self.log(t.format(self.pq_drop + 1), 3)
+
+            self.pq_drop += 1
+
+    def pre_worker(self) -> None:
+        while not self.stopping:
+            task = self.pq.get()
+            if not task:
+                break
+
+            # clients first, then only if the server is not too busy
+            while not self.stopping:
+                try:
+                    load = os.getloadavg()[0]
+                except:
+                    load = 0
+
+                with self.mutex:
+                    idle = not self.busy
+
+                if idle and load <= self.args.th_pre_load:
+                    break
+
+                time.sleep(2)
+
+            ptop, rem, mtime, fmt = task
+            histpath = self.asrv.vfs.histtab.get(ptop)
+            if not histpath or self.stopping:
+                continue
+
+            abspath = os.path.join(ptop, rem)
+            tpath = thumb_path(histpath, rem, mtime, fmt)
+            try:
+                if self._exists(tpath) or not bos.path.getsize(abspath):
+                    continue
+
+                with self.mutex:
+                    if tpath in self.busy:
+                        continue
+
+                    self._mkdir(tpath, abspath)
+                    self.busy[tpath] = []
+
+                self.log("pre {} \033[0m{}".format(tpath, abspath), c="90")
+                self.conv(abspath, tpath)
+            except:
+                self.log("pre {} failed: {}".format(abspath, min_ex()), 3)
+
     def getcfg(self) -> dict[str, set[str]]:
         return {
             "thumbable": self.thumbable,
@@ -243,82 +439,113 @@ class ThumbSrv(object):
         }
 
     def worker(self) -> None:
-        while not self.stopping:
-            task = self.q.get()
-            if not task:
-                break
+        while True:
+            with self.mutex:
+                while not self.crr and not self.stopping:
+                    self.qcond.wait()
+
+                if self.stopping:
+                    self.nthr -= 1
+                    return
+
+                ip = self.crr.pop(0)
+                jobs = self.cq[ip]
+                abspath, tpath = jobs.pop()
+                if jobs:
+                    self.crr.append(ip)
+                else:
+                    del self.cq[ip]
 
-            abspath, tpath = task
-            ext = abspath.split(".")[-1].lower()
-            png_ok = False
-            funs = []
-            if not bos.path.exists(tpath):
-                for lib in self.args.th_dec:
-                    if lib == "pil" and ext in self.fmt_pil:
-                        funs.append(self.conv_pil)
-                    elif lib == "vips" and ext in self.fmt_vips:
-                        funs.append(self.conv_vips)
-                    elif lib == "ff" and ext in self.fmt_ffi or ext in self.fmt_ffv:
-                        funs.append(self.conv_ffmpeg)
-                    elif lib == "ff" and ext in self.fmt_ffa:
-                        if tpath.endswith(".opus") or tpath.endswith(".caf"):
-                            funs.append(self.conv_opus)
-                        elif tpath.endswith(".png"):
-                            funs.append(self.conv_waves)
-                            png_ok = True
-                        else:
-                            funs.append(self.conv_spec)
-
-            if not png_ok and tpath.endswith(".png"):
-                raise Pebkac(400, "png only allowed for waveforms")
+                subs = None
+                if time.time() - self.want.get(tpath, 0) > TH_WANT:
+                    subs = self.busy.pop(tpath)
+                    del self.want[tpath]
+
+            if subs is None:
+                self.conv(abspath, tpath)
+                continue
 
+            self.log("drop {}; client is gone".format(tpath), "90")
+            for x in subs:
+                with x:
+                    x.notify_all()
+
+    def conv(self, abspath: str, tpath: str) -> None:
+        """makes the thumbnail, then wakes up everyone waiting for it"""
+        ext = abspath.split(".")[-1].lower()
+        png_ok = False
+        funs = []
+        if not self._exists(tpath):
+            for lib in self.args.th_dec:
+                if lib == "pil" and ext in self.fmt_pil:
+                    funs.append(self.conv_pil)
+                elif lib == "vips" and ext in self.fmt_vips:
+                    funs.append(self.conv_vips)
+                elif lib == "ff" and ext in self.fmt_ffi or ext in self.fmt_ffv:
+                    funs.append(self.conv_ffmpeg)
+                elif lib == "ff" and ext in self.fmt_ffa:
+                    if tpath.endswith(".opus") or tpath.endswith(".caf"):
+                        funs.append(self.conv_opus)
+                    elif tpath.endswith(".png"):
+                        funs.append(self.conv_waves)
+                        png_ok = True
+                    else:
+                        funs.append(self.conv_spec)
+
+        if not png_ok and tpath.endswith(".png"):
+            raise Pebkac(400, "png only allowed for waveforms")
+
+        zp = self._pack(tpath)
+        if zp:
+            ttpath = zp.tmp(tpath)
+        else:
             tdir, tfn = os.path.split(tpath)
             ttpath = os.path.join(tdir, "w", tfn)
-            try:
-                bos.unlink(ttpath)
-            except:
-                pass
 
-            for fun in funs:
-                try:
-                    fun(abspath, ttpath)
-                    break
-                except Exception as ex:
-                    msg = "{} could not create thumbnail of {}\n{}"
-                    msg = msg.format(fun.__name__, abspath, min_ex())
-                    c: Union[str, int] = 1 if "<Signals.SIG" in msg else "90"
-                    self.log(msg, c)
-                    if getattr(ex, "returncode", 0) != 321:
-                        if fun == funs[-1]:
-                            with open(ttpath, "wb") as _:
-                                pass
-                    else:
-                        # ffmpeg may spawn empty files on windows
-                        try:
-                            os.unlink(ttpath)
-                        except:
-                            pass
+        try:
+            bos.unlink(ttpath)
+        except:
+            pass
 
+        for fun in funs:
             try:
-                bos.rename(ttpath, tpath)
-            except:
-                pass
-
-            with self.mutex:
-                subs = self.busy[tpath]
-                del self.busy[tpath]
+                fun(abspath, ttpath)
+                break
+            except Exception as ex:
+                msg = "{} could not create thumbnail of {}\n{}"
+                msg = msg.format(fun.__name__, abspath, min_ex())
+                c: Union[str, int] = 1 if "<Signals.SIG" in msg else "90"
+                self.log(msg, c)
+                if getattr(ex, "returncode", 0) != 321:
+                    if fun == funs[-1]:
+                        with open(ttpath, "wb") as _:
+                            pass
+                else:
+                    # ffmpeg may spawn empty files on windows
+                    try:
+                        os.unlink(ttpath)
+                    except:
+                        pass
 
-            for x in subs:
-                with x:
-                    x.notify_all()
+        try:
+            if zp:
+                zp.put(tpath, ttpath)
+            else:
+                bos.rename(ttpath, tpath)
+        except:
+            if zp:
+                self.log("could not store {}:\n{}".format(tpath, min_ex()), 1)
 
         with self.mutex:
-            self.nthr -= 1
+            subs = self.busy.pop(tpath)
+            self.want.pop(tpath, None)
+
+        for x in subs:
+            with x:
+                x.notify_all()
 
     def fancy_pillow(self, im: "Image.Image") -> "Image.Image":
         # exif_transpose is expensive (loads full image + unconditional copy)
-        r = max(*self.res) * 2
-        im.thumbnail((r, r), resample=Image.LANCZOS)
         try:
             k = next(k for k, v in ExifTags.TAGS.items() if v == "Orientation")
             exif = im.getexif()
@@ -327,6 +554,15 @@ class ThumbSrv(object):
         except:
             rot = 1
 
+        # jpeg: have libjpeg decode at 1/2, 1/4 or 1/8 of the full size
+        # (DCT scaling) while staying larger than the thumbnail, which is
+        # sideways until rotated; does nothing for other formats
+        dw, dh = self.res
+        im.draft(im.mode, (dh, dw) if rot in (5, 6, 7, 8) else (dw, dh))
+
+        r = max(*self.res) * 2
+        im.thumbnail((r, r), resample=Image.LANCZOS)
+
         rots = {8: Image.ROTATE_90, 3: Image.ROTATE_180, 6: Image.ROTATE_270}
         if rot in rots:
             im = im.transpose(rots[rot])
@@ -335,7 +571,6 @@ class ThumbSrv(object):
             im.thumbnail(self.res, resample=Image.LANCZOS)
         else:
             iw, ih = im.size
-            dw, dh = self.res
             res = (min(iw, dw), min(ih, dh))
             im = ImageOps.fit(im, res, method=Image.LANCZOS)
 
@@ -651,6 +886,11 @@ class ThumbSrv(object):
         if not self.poke_cd.poke(tdir):
             return
 
+        zp = self._pack(tdir)
+        if zp:
+            zp.touch(tdir)
+            return
+
         ts = int(time.time())
         try:
             for _ in range(4):
@@ -663,7 +903,7 @@ class ThumbSrv(object):
         interval = self.args.th_clean
         while True:
             time.sleep(interval)
-            ndirs = 0
+            ndirs = nrm = nmv = 0
             for vol, histpath in self.asrv.vfs.histtab.items():
                 if histpath.startswith(vol):
                     self.log("\033[Jcln {}/\033[A".format(histpath))
@@ -672,7 +912,17 @@ class ThumbSrv(object):
 
                 ndirs += self.clean(histpath)
 
-            self.log("\033[Jcln ok; rm {} dirs".format(ndirs))
+                zp = self._pack(histpath + "/th/")
+                if zp:
+                    zi1, zi2 = zp.clean(self.args.th_maxage)
+                    nrm += zi1
+                    nmv += zi2
+
+            t = "\033[Jcln ok; rm {} dirs".format(ndirs)
+            if self.args.th_pack:
+                t += ", forgot {} packed thumbs, moved {}".format(nrm, humansize(nmv))
+
+            self.log(t)
 
     def clean(self, histpath: str) -> int:
         ret = 0
@@ -2,13 +2,16 @@
 from __future__ import print_function, unicode_literals
 
 import calendar
+import heapq
 import os
 import re
 import threading
 import time
 from operator import itemgetter
 
-from .__init__ import ANYWIN, TYPE_CHECKING, unicode
+from queue import Empty, Queue
+
+from .__init__ import ANYWIN, CORES, TYPE_CHECKING, unicode
 from .bos import bos
 from .up2k import up2k_wark_from_hashlist
 from .util import (
@@ -49,7 +52,7 @@ class U2idx(object):
             return
 
         self.active_id = ""
-        self.active_cur: Optional["sqlite3.Cursor"] = None
+        self.active_curs: list["sqlite3.Cursor"] = []
         self.cur: dict[str, "sqlite3.Cursor"] = {}
         self.mem_cur = sqlite3.connect(":memory:", check_same_thread=False).cursor()
         self.mem_cur.execute(r"create table a (b text)")
@@ -263,11 +266,46 @@ class U2idx(object):
             else:
                 q += " lower({}) {} ? ) ".format(field, oper)
 
+        fts = self._fts_q(q, va)
+
         try:
-            return self.run_query(vols, q, va, have_up, have_mt, lim)
+            return self.run_query(vols, q, va, have_up, have_mt, lim, fts)
         except Exception as ex:
             raise Pebkac(500, repr(ex))
 
+    def _fts_q(
+        self, q: str, va: list[Union[str, int]]
+    ) -> Optional[tuple[str, list[Union[str, int]]]]:
+        """
+        variant of the query for volumes with a filename trigram index;
+        each name-like gets an indexed subquery, the like itself is kept
+        """
+        ptn = re.compile(r"up\.fn like +((?:'%'\|\|)?\?(?:\|\|'%')?) ")
+        ret = ""
+        rva = list(va)
+        ofs = 0
+        for m in ptn.finditer(q):
+            expr = m.group(1)
+            nparam = q[: m.start(1)].count("?")
+            zv = va[nparam]
+            rva.insert(nparam + 1 + len(rva) - len(va), zv)
+            ret += q[ofs : m.start()]
+            zs = "(up.fn like {0} and up.fn in (select fn from upf where fn like {0})) "
+            ret += zs.format(expr)
+            ofs = m.end()
+
+        if not ofs:
+            return None
+
+        return ret + q[ofs:], rva
+
+    def _have_fts(self, cur: "sqlite3.Cursor") -> bool:
+        q = "select 1 from sqlite_master where type = 'table' and name = 'upf'"
+        try:
+            return bool(cur.execute(q).fetchone())
+        except:
+            return False
+
     def run_query(
         self,
         vols: list[tuple[str, str, dict[str, Any]]],
@@ -276,6 +314,7 @@ class U2idx(object):
         have_up: bool,
         have_mt: bool,
         lim: int,
+        fts: Optional[tuple[str, list[Union[str, int]]]] = None,
     ) -> tuple[list[dict[str, Any]], list[str], bool]:
         done_flag: list[bool] = []
         self.active_id = "{:.6f}_{}".format(
@@ -286,91 +325,176 @@ class U2idx(object):
         if not uq or not uv:
             uq = "select * from up"
             uv = []
-        elif have_mt:
-            uq = "select up.*, substr(up.w,1,16) mtw from up where " + uq
+            fts = None
         else:
-            uq = "select up.* from up where " + uq
+            if have_mt:
+                zs = "select up.*, substr(up.w,1,16) mtw from up where "
+            else:
+                zs = "select up.* from up where "
+
+            uq = zs + uq
+            if fts:
+                fts = (zs + fts[0], fts[1])
 
         self.log("qs: {!r} {!r}".format(uq, uv))
 
-        ret = []
-        seen_rps: set[str] = set()
         lim = min(lim, int(self.args.srch_hits))
+        ctl = SrchCtl(lim)
+        self.active_curs = ctl.curs
+
+        # each volume has its own db, so query them all at once
+        nthr = min(len(vols), max(CORES, 4))
+        if nthr < 2:
+            rets = [self._run_vol(ctl, vol, uq, uv, fts) for vol in vols]
+        else:
+            jobs: Queue[tuple[int, tuple[str, str, dict[str, Any]]]] = Queue()
+            rq: Queue[Any] = Queue()
+            for n, vol in enumerate(vols):
+                jobs.put((n, vol))
+
+            for n in range(nthr):
+                zt = (ctl, jobs, rq, uq, uv, fts)
+                Daemon(self._vol_worker, "u2idx-q-{}".format(n), zt)
+
+            rets = [None] * len(vols)
+            for _ in vols:
+                n, zr = rq.get()
+                rets[n] = zr
+
+        done_flag.append(True)
+        self.active_id = ""
+
+        # each volume stopped at lim hits on its own, so the result
+        # is the same no matter which volume finished first
+        hits: dict[str, dict[str, Any]] = {}
+        trunc = False
+        for zr in rets:
+            if isinstance(zr, Exception):
+                raise zr
+
+            sret, vtrunc = zr
+            trunc = trunc or vtrunc
+            for hit in sret:
+                hits.setdefault(hit["rp"].split("?")[0], hit)
+
+        trunc = trunc or len(hits) > lim
+        ret = heapq.nsmallest(lim, hits.values(), key=itemgetter("rp"))
+
         taglist = {}
-        for (vtop, ptop, flags) in vols:
-            cur = self.get_cur(ptop)
-            if not cur:
-                continue
+        for hit in ret:
+            taglist.update(hit["tags"])
+
+        return ret, list(taglist.keys()), trunc
+
+    def _vol_worker(
+        self,
+        ctl: "SrchCtl",
+        jobs: Queue[tuple[int, tuple[str, str, dict[str, Any]]]],
+        rq: Queue[Any],
+        uq: str,
+        uv: list[Union[str, int]],
+        fts: Optional[tuple[str, list[Union[str, int]]]],
+    ) -> None:
+        while True:
+            try:
+                n, vol = jobs.get_nowait()
+            except Empty:
+                return
 
-            self.active_cur = cur
+            try:
+                rq.put((n, self._run_vol(ctl, vol, uq, uv, fts)))
+            except Exception as ex:
+                rq.put((n, ex))
 
-            vuv = []
-            for v in uv:
-                if v == "\nrd":
-                    v = vtop + "/"
+    def _run_vol(
+        self,
+        ctl: "SrchCtl",
+        vol: tuple[str, str, dict[str, Any]],
+        uq: str,
+        uv: list[Union[str, int]],
+        fts: Optional[tuple[str, list[Union[str, int]]]],
+    ) -> tuple[list[dict[str, Any]], bool]:
+        """up to ctl.lim hits in one volume, and whether there were more"""
+        vtop, ptop, flags = vol
+        cur = self.get_cur(ptop)
+        if not cur:
+            return [], False
 
-                vuv.append(v)
+        with ctl.mutex:
+            ctl.curs.append(cur)
 
-            sret = []
-            fk = flags.get("fk")
-            dots = flags.get("dotsrch")
-            c = cur.execute(uq, tuple(vuv))
-            for hit in c:
-                w, ts, sz, rd, fn, ip, at = hit[:7]
+        vuq = uq
+        vuv = []
+        zl = uv
+        if fts and self._have_fts(cur):
+            vuq, zl = fts
 
-                if rd.startswith("//") or fn.startswith("//"):
-                    rd, fn = s3dec(rd, fn)
+        for v in zl:
+            if v == "\nrd":
+                v = vtop + "/"
 
-                rp = quotep("/".join([x for x in [vtop, rd, fn] if x]))
-                if not dots and "/." in ("/" + rp):
-                    continue
+            vuv.append(v)
 
-                if rp in seen_rps:
-                    continue
+        sret = []
+        trunc = False
+        fk = flags.get("fk")
+        dots = flags.get("dotsrch")
+        seen_rps: set[str] = set()
+        c = cur.execute(vuq, tuple(vuv))
+        for hit in c:
+            w, ts, sz, rd, fn, ip, at = hit[:7]
 
-                if not fk:
-                    suf = ""
-                else:
-                    try:
-                        ap = absreal(os.path.join(ptop, rd, fn))
-                        inf = bos.stat(ap)
-                    except:
-                        continue
+            if rd.startswith("//") or fn.startswith("//"):
+                rd, fn = s3dec(rd, fn)
 
-                    suf = (
-                        "?k="
-                        + gen_filekey(
-                            self.args.fk_salt, ap, sz, 0 if ANYWIN else inf.st_ino
-                        )[:fk]
-                    )
+            rp = quotep("/".join([x for x in [vtop, rd, fn] if x]))
+            if not dots and "/." in ("/" + rp):
+                continue
 
-                lim -= 1
-                if lim < 0:
-                    break
+            if rp in seen_rps:
+                continue
 
-                seen_rps.add(rp)
-                sret.append({"ts": int(ts), "sz": sz, "rp": rp + suf, "w": w[:16]})
+            if not fk:
+                suf = ""
+            else:
+                try:
+                    ap = absreal(os.path.join(ptop, rd, fn))
+                    inf = bos.stat(ap)
+                except:
+                    continue
 
-            for hit in sret:
-                w = hit["w"]
-                del hit["w"]
-                tags = {}
-                q2 = "select k, v from mt where w = ? and +k != 'x'"
-                for k, v2 in cur.execute(q2, (w,)):
-                    taglist[k] = True
-                    tags[k] = v2
+                suf = (
+                    "?k="
+                    + gen_filekey(
+                        self.args.fk_salt, ap, sz, 0 if ANYWIN else inf.st_ino
+                    )[:fk]
+                )
 
-                hit["tags"] = tags
+            if len(sret) >= ctl.lim:
+                trunc = True
+                break
 
-            ret.extend(sret)
-            # print("[{}] {}".format(ptop, sret))
+            seen_rps.add(rp)
+            sret.append({"ts": int(ts), "sz": sz, "rp": rp + suf, "w": w[:16]})
 
-        done_flag.append(True)
-        self.active_id = ""
+        # fetch tags for all the hits in batches, keyed by wark
+        wtags: dict[str, dict[str, Any]] = {}
+        for hit in sret:
+            wtags[hit["w"]] = {}
+
+        ws = list(wtags.keys())
+        for n in range(0, len(ws), 256):
+            zl = ws[n : n + 256]
+            q2 = "select w, k, v from mt where w in ({}) and +k != 'x'"
+            q2 = q2.format(",".join(["?"] * len(zl)))
+            for w, k, v2 in cur.execute(q2, zl):
+                wtags[w][k] = v2
 
-        ret.sort(key=itemgetter("rp"))
+        for hit in sret:
+            hit["tags"] = wtags[hit.pop("w")]
 
-        return ret, list(taglist.keys()), lim < 0
+        # print("[{}] {}".format(ptop, sret))
+        return sret, trunc
 
     def terminator(self, identifier: str, done_flag: list[bool]) -> None:
         for _ in range(self.timeout):
@@ -379,5 +503,14 @@ class U2idx(object):
                 return
 
         if identifier == self.active_id:
-            assert self.active_cur
-            self.active_cur.connection.interrupt()
+            for cur in list(self.active_curs):
+                cur.connection.interrupt()
+
+
+class SrchCtl(object):
+    """state shared between the volumes of a search in progress"""
+
+    def __init__(self, lim: int) -> None:
+        self.lim = lim
+        self.mutex = threading.Lock()
+        self.curs: list["sqlite3.Cursor"] = []
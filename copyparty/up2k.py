@@ -17,6 +17,7 @@ import tempfile
 import threading
 import time
 import traceback
+import zlib
 from copy import deepcopy
 
 from queue import Queue
@@ -25,16 +26,20 @@ from .__init__ import ANYWIN, PY2, TYPE_CHECKING, WINDOWS
 from .authsrv import LEELOO_DALLAS, VFS, AuthSrv
 from .bos import bos
 from .fsutil import Fstab
+from .inotify import Inotify
 from .mtag import MParser, MTag
 from .util import (
     HAVE_SQLITE3,
     SYMTIME,
     Daemon,
+    MPHash,
     MTHash,
     Pebkac,
     ProgressPrinter,
+    StatdirPf,
     absreal,
     atomic_move,
+    crc32_combine,
     db_ex_chk,
     djoin,
     fsenc,
@@ -42,6 +47,7 @@ from .util import (
     gen_filekey_dbg,
     hidedir,
     min_ex,
+    mp,
     quotep,
     rand_name,
     ren_open,
@@ -60,6 +66,7 @@ from .util import (
     vsplit,
     w8b64dec,
     w8b64enc,
+    yieldfile,
 )
 
 if HAVE_SQLITE3:
@@ -116,6 +123,9 @@ class Up2k(object):
         self.gid = 0
         self.stop = False
         self.mutex = threading.Lock()
+        # chunk receivers only take the wlock of their upload; registry
+        # membership, the databases and everything else stay under mutex
+        self.wlocks = [threading.Lock() for _ in range(64)]
         self.blocked: Optional[str] = None
         self.pp: Optional[ProgressPrinter] = None
         self.rescan_cond = threading.Condition()
@@ -129,16 +139,24 @@ class Up2k(object):
         self.vol_act: dict[str, float] = {}
         self.busy_aps: set[str] = set()
         self.dupesched: dict[str, list[tuple[str, str, float]]] = {}
-        self.snap_persist_interval = 300  # persist unfinished index every 5 min
+        self.snap_persist_interval = 300  # sweep unfinished index every 5 min
         self.snap_discard_interval = 21600  # drop unfinished after 6 hours inactivity
-        self.snap_prev: dict[str, Optional[tuple[int, float]]] = {}
-
+        self.snap_jnl_interval = 5  # flush registry changes to journal
+        self.snap_mutex = threading.Lock()  # snapshot file io
+        self.snap_jnl_mutex = threading.Lock()
+        self.snap_jnl: dict[str, list[tuple[str, str, Any]]] = {}
+        self.snap_gen: dict[str, Optional[str]] = {}
+        self.snap_jsz: dict[str, int] = {}
+        self.snap_lim: dict[str, int] = {}
+
+        self.ino: Optional[Inotify] = None
         self.mtag: Optional[MTag] = None
         self.entags: dict[str, set[str]] = {}
         self.mtp_parsers: dict[str, dict[str, MParser]] = {}
         self.pending_tags: list[tuple[set[str], str, str, dict[str, Any]]] = []
         self.hashq: Queue[tuple[str, str, str, str, str, float, str, bool]] = Queue()
         self.tagq: Queue[tuple[str, str, str, str, str, float]] = Queue()
+        self.crcq: Queue[tuple[str, str, str, int]] = Queue()
         self.tag_event = threading.Condition()
         self.n_hashq = 0
         self.n_tagq = 0
@@ -173,6 +191,10 @@ class Up2k(object):
         else:
             self.mth = MTHash(self.args.hash_mt)
 
+        self.mph: Optional[MPHash] = None
+        if self.args.hash_mp > 0 and mp:
+            self.mph = MPHash(self.args.hash_mp)
+
         if self.args.no_fastboot:
             self.deferred_init()
 
@@ -209,6 +231,7 @@ class Up2k(object):
         Daemon(self._snapshot, "up2k-snapshot")
         if have_e2d:
             Daemon(self._hasher, "up2k-hasher")
+            Daemon(self._crcer, "up2k-crc")
             Daemon(self._sched_rescan, "up2k-rescan")
             if self.mtag:
                 for n in range(max(1, self.args.mtag_mt)):
@@ -311,7 +334,7 @@ class Up2k(object):
             with self.mutex:
                 for vp, vol in sorted(self.asrv.vfs.all_vols.items()):
                     maxage = vol.flags.get("scan")
-                    if not maxage:
+                    if not maxage or self._ino_ok(vol):
                         continue
 
                     if vp not in volage:
@@ -323,10 +346,11 @@ class Up2k(object):
 
                     timeout = min(timeout, deadline)
 
-            if self.db_act > now - self.args.db_act and self.need_rescan:
+            ino_busy = bool(self.ino and self.ino.busy())
+            if self.db_act > now - self.args.db_act and (self.need_rescan or ino_busy):
                 # recent db activity; defer volume rescan
                 act_timeout = self.db_act + self.args.db_act
-                if self.need_rescan:
+                if self.need_rescan or ino_busy:
                     timeout = now
 
                 if timeout < act_timeout:
@@ -336,6 +360,9 @@ class Up2k(object):
 
                 continue
 
+            if ino_busy:
+                self._ino_scan()
+
             with self.mutex:
                 vols = list(sorted(self.need_rescan))
                 self.need_rescan.clear()
@@ -352,6 +379,150 @@ class Up2k(object):
                 for v in vols:
                     volage[v] = now
 
+    def _ino_ok(self, vol: VFS) -> bool:
+        """true if inotify is keeping track of changes in vol"""
+        ino = self.ino
+        return bool(ino and ino.ok and not ino.full and "inotify" in vol.flags)
+
+    def _ino_scan(self) -> None:
+        assert self.ino
+        dirty, gone, lost = self.ino.pop()
+        all_vols = list(self.asrv.vfs.all_vols.values())
+        done: set[str] = set()
+        for vol in all_vols:
+            ptop = vol.realpath
+            if ptop in done or "e2d" not in vol.flags:
+                continue
+
+            done.add(ptop)
+            if ptop in lost:
+                with self.mutex:
+                    self.need_rescan.add(vol.vpath)
+                continue
+
+            vdirty = dirty.get(ptop)
+            vgone = gone.get(ptop)
+            if vdirty or vgone:
+                self._ino_vol(vol, all_vols, vdirty or {}, vgone or set())
+
+    def _ino_vol(
+        self,
+        vol: VFS,
+        all_vols: list[VFS],
+        dirty: dict[str, bool],
+        gone: set[str],
+    ) -> None:
+        """rescan just the folders which inotify says have changed"""
+        top = vol.realpath
+        rei = vol.flags.get("noidx")
+        reh = vol.flags.get("nohash")
+        n4g = bool(vol.flags.get("noforget"))
+        xvol = bool(vol.flags.get("xvol"))
+        dev = 0
+        if vol.flags.get("xdev"):
+            dev = bos.stat(top).st_dev
+
+        excl = set(self._vol_excl(vol, all_vols))
+        tagq = "e2t" in vol.flags and self.mtag
+
+        n_add = n_rm = 0
+        t0 = time.time()
+        self.pp = ProgressPrinter()
+        try:
+            with self.mutex:
+                reg = self.register_vpath(top, vol.flags)
+                assert reg
+                cur, _ = reg
+                db = Dbw(cur, 0, time.time())
+
+                for ap in sorted(gone):
+                    if n4g or not ap.startswith(top + "/") or bos.path.isdir(ap):
+                        continue
+
+                    n_rm += self._ino_forget(cur, ap[len(top) + 1 :])
+
+                for ap, rec in sorted(dirty.items()):
+                    if self.stop:
+                        break
+
+                    if ap != top and not ap.startswith(top + "/"):
+                        continue
+
+                    try:
+                        cst = bos.stat(ap)
+                        if not stat.S_ISDIR(cst.st_mode):
+                            continue
+                    except:
+                        continue
+
+                    rd = ap[len(top) :].strip("/")
+                    ws0 = self._ino_warks(cur, rd, rec) if tagq else set()
+                    n_add += self._build_dir(
+                        db,
+                        top,
+                        excl,
+                        ap,
+                        absreal(ap),
+                        rei,
+                        reh,
+                        n4g,
+                        [],
+                        cst,
+                        dev,
+                        xvol,
+                        None,
+                        not rec,
+                    )
+                    if tagq:
+                        for w, drd, dfn in self._ino_warks(cur, rd, rec) - ws0:
+                            self.tagq.put((top, w, drd, dfn, "", 0))
+                            self.n_tagq += 1
+
+                cur.connection.commit()
+        finally:
+            self.pp.end = True
+            self.pp = None
+
+        if n_add or n_rm:
+            t = "inotify: {} folders in {:.2f} sec, {} new/changed, {} forgotten; {}"
+            self.log(t.format(len(dirty), time.time() - t0, n_add, n_rm, top))
+
+    def _ino_warks(
+        self, cur: "sqlite3.Cursor", rd: str, rec: bool
+    ) -> set[tuple[str, str, str]]:
+        q = "select w, rd, fn from up where rd = ?"
+        qa: tuple[str, ...] = (rd,)
+        if rec and not rd:
+            q = "select w, rd, fn from up"
+            qa = ()
+        elif rec:
+            q += " or (rd > ? and rd < ?)"
+            qa = (rd, rd + "/", rd + "0")  # "0" sorts after "/"
+
+        try:
+            return set(cur.execute(q, qa).fetchall())
+        except:
+            return set()
+
+    def _ino_forget(self, cur: "sqlite3.Cursor", rd: str) -> int:
+        """forget a deleted folder and everything below it"""
+        n = 0
+        for erd in [rd, "//" + w8b64enc(rd)]:
+            qa = (erd, erd + "/", erd + "0")
+            try:
+                q = "select count(w) from up where (rd = ? or (rd > ? and rd < ?))"
+                n = cur.execute(q, qa).fetchone()[0]
+            except:
+                continue
+
+            q = "delete from up where (rd = ? or (rd > ? and rd < ?))"
+            cur.execute(q, qa)
+            q = "delete from dh where (d = ? or (d > ? and d < ?))"
+            cur.execute(q, qa)
+            break
+
+        return n
+
     def _check_lifetimes(self) -> float:
         now = time.time()
         timeout = now + 9001
@@ -659,7 +830,7 @@ class Up2k(object):
             cur, _ = reg
             with self.mutex:
                 cur.connection.commit()
-                cur.execute("vacuum")
+                self._vacuum(cur)
 
         if self.stop:
             return False
@@ -774,9 +945,12 @@ class Up2k(object):
             reg2 = json.loads(j)
             try:
                 drp = reg2["droppable"]
+                gen = reg2.get("gen")
                 reg2 = reg2["registry"]
             except:
-                pass
+                gen = None
+
+            njnl = self._jnl_replay(path + ".jnl", gen, reg2, drp)
 
             for k, job in reg2.items():
                 path = djoin(job["ptop"], job["prel"], job["name"])
@@ -792,7 +966,8 @@ class Up2k(object):
             else:
                 drp = [x for x in drp if x in reg]
 
-            t = "loaded snap {} |{}| ({})".format(path, len(reg.keys()), len(drp or []))
+            t = "loaded snap {} |{}| ({}) +{} jnl"
+            t = t.format(path, len(reg.keys()), len(drp or []), max(0, njnl))
             ta = [t] + self._vis_reg_progress(reg)
             self.log("\n".join(ta))
 
@@ -800,6 +975,12 @@ class Up2k(object):
         self.vol_act[ptop] = 0.0
         self.registry[ptop] = reg
         self.droppable[ptop] = drp or []
+        if not self.args.nw and not self.args.no_snap:
+            # compact (or remove) whatever was loaded on the first flush
+            self.snap_jnl[ptop] = []
+            self.snap_gen[ptop] = None
+            self.snap_jsz[ptop] = 0
+            self.snap_lim[ptop] = 0
         self.regdrop(ptop, "")
         if not HAVE_SQLITE3 or "e2d" not in flags or "d2d" in flags:
             return None
@@ -810,6 +991,8 @@ class Up2k(object):
         try:
             cur = self._open_db(db_path)
             self.cur[ptop] = cur
+            if "idxcrc" in flags:
+                self._add_cr_tab(cur)
 
             # speeds measured uploading 520 small files on a WD20SPZX (SMR 2.5" 5400rpm 4kb)
             dbd = flags["dbd"]
@@ -867,18 +1050,15 @@ class Up2k(object):
             db = Dbw(cur, 0, time.time())
             self.pp.n = next(db.c.execute("select count(w) from up"))[0]
 
-            excl = [
-                vol.realpath + "/" + d.vpath[len(vol.vpath) :].lstrip("/")
-                for d in all_vols
-                if d != vol and (d.vpath.startswith(vol.vpath + "/") or not vol.vpath)
-            ]
-            excl += [absreal(x) for x in excl]
-            excl += list(self.asrv.vfs.histtab.values())
-            if WINDOWS:
-                excl = [x.replace("/", "\\") for x in excl]
-            else:
-                # ~/.wine/dosdevices/z:/ and such
-                excl += ["/dev", "/proc", "/run", "/sys"]
+            excl = self._vol_excl(vol, all_vols)
+            if "inotify" in vol.flags and not self.ino:
+                self.ino = Inotify(self.log_func, self.rescan_cond)
+
+            spf = None
+            if self.args.scan_mt > 0:
+                scandir = not self.args.no_scandir
+                nthr = self.args.scan_mt
+                spf = StatdirPf(self.log_func, scandir, nthr, nthr * 16)
 
             rtop = absreal(top)
             n_add = n_rm = 0
@@ -896,15 +1076,22 @@ class Up2k(object):
                     cst,
                     dev,
                     bool(vol.flags.get("xvol")),
+                    spf,
                 )
                 if not n4g:
                     n_rm = self._drop_lost(db.c, top, excl)
+                if n_rm and "idxcrc" in vol.flags and not self.no_expr_idx:
+                    q = "delete from cr where not exists (select 1 from up where substr(up.w,1,16) = cr.w)"
+                    db.c.execute(q)
             except Exception as ex:
                 t = "failed to index volume [{}]:\n{}"
                 self.log(t.format(top, min_ex()), c=1)
                 if db_ex_chk(self.log, ex, db_path):
                     self.hub.log_stacks()
 
+            if spf:
+                spf.shutdown()
+
             if db.n:
                 self.log("commit {} new files".format(db.n))
 
@@ -919,6 +1106,23 @@ class Up2k(object):
 
             return True, bool(n_add or n_rm or do_vac)
 
+    def _vol_excl(self, vol: VFS, all_vols: list[VFS]) -> list[str]:
+        """paths which _build_dir should not descend into"""
+        excl = [
+            vol.realpath + "/" + d.vpath[len(vol.vpath) :].lstrip("/")
+            for d in all_vols
+            if d != vol and (d.vpath.startswith(vol.vpath + "/") or not vol.vpath)
+        ]
+        excl += [absreal(x) for x in excl]
+        excl += list(self.asrv.vfs.histtab.values())
+        if WINDOWS:
+            excl = [x.replace("/", "\\") for x in excl]
+        else:
+            # ~/.wine/dosdevices/z:/ and such
+            excl += ["/dev", "/proc", "/run", "/sys"]
+
+        return excl
+
     def _build_dir(
         self,
         db: Dbw,
@@ -933,6 +1137,8 @@ class Up2k(object):
         cst: os.stat_result,
         dev: int,
         xvol: bool,
+        spf: Optional[StatdirPf] = None,
+        norec: bool = False,
     ) -> int:
         if xvol and not rcdir.startswith(top):
             self.log("skip xvol: [{}] -> [{}]".format(cdir, rcdir), 6)
@@ -943,6 +1149,9 @@ class Up2k(object):
             self.log(t.format(seen[-1], rcdir, cdir), 3)
             return 0
 
+        if self.ino and "inotify" in self.flags.get(top, {}):
+            self.ino.watch(top, cdir)
+
         ret = 0
         seen = seen + [rcdir]
         unreg: list[str] = []
@@ -957,8 +1166,22 @@ class Up2k(object):
         if WINDOWS:
             rd = rd.replace("\\", "/").strip("/")
 
-        g = statdir(self.log_func, not self.args.no_scandir, False, cdir)
-        gl = sorted(g)
+        if spf:
+            gl = sorted(spf.get(cdir))
+            zl = []
+            for iname, inf in gl:
+                if not stat.S_ISDIR(inf.st_mode) or (dev and inf.st_dev != dev):
+                    continue
+
+                abspath = os.path.join(cdir, iname)
+                if abspath not in excl and not (rei and rei.search(abspath)):
+                    zl.append(abspath)
+
+            spf.want(zl)
+        else:
+            g = statdir(self.log_func, not self.args.no_scandir, False, cdir)
+            gl = sorted(g)
+
         partials = set([x[0] for x in gl if "PARTIAL" in x[0]])
         for iname, inf in gl:
             if self.stop:
@@ -987,10 +1210,24 @@ class Up2k(object):
                 if iname == ".th" and bos.path.isdir(os.path.join(abspath, "top")):
                     # abandoned or foreign, skip
                     continue
+                if norec:
+                    continue
                 # self.log(" dir: {}".format(abspath))
                 try:
                     ret += self._build_dir(
-                        db, top, excl, abspath, rap, rei, reh, n4g, seen, inf, dev, xvol
+                        db,
+                        top,
+                        excl,
+                        abspath,
+                        rap,
+                        rei,
+                        reh,
+                        n4g,
+                        seen,
+                        inf,
+                        dev,
+                        xvol,
+                        spf,
                     )
                 except:
                     t = "failed to index subdir [{}]:\n{}"
@@ -1022,6 +1259,10 @@ class Up2k(object):
         # free up stuff we're done with before dhashing
         gl = []
         partials.clear()
+        if spf:
+            # subfolders which were prefetched but skipped (xvol, loops, ...)
+            spf.forget(zl)
+
         if not self.args.no_dhash:
             if len(files) < 9000:
                 zh = hashlib.sha1(str(files).encode("utf-8", "replace"))
@@ -1107,9 +1348,10 @@ class Up2k(object):
                     if sz > 1024 * 1024:
                         self.log("file: {}".format(abspath))
 
+                    crcs = [] if "idxcrc" in self.flags[top] else None
                     try:
                         hashes = self._hashlist_from_file(
-                            abspath, "a{}, ".format(self.pp.n)
+                            abspath, "a{}, ".format(self.pp.n), crcs
                         )
                     except Exception as ex:
                         self.log("hash: {} @ [{}]".format(repr(ex), abspath))
@@ -1119,9 +1361,12 @@ class Up2k(object):
                         return -1
 
                     wark = up2k_wark_from_hashlist(self.salt, sz, hashes)
+                    if crcs:
+                        self.db_crc(db.c, wark, crcs[0])
 
                 # skip upload hooks by not providing vflags
                 self.db_add(db.c, {}, rd, fn, lmod, sz, "", "", wark, "", "", "", at)
+                self._th_pre(top, rd, fn, lmod)
                 db.n += 1
                 ret += 1
                 td = time.time() - db.t
@@ -1789,7 +2034,7 @@ class Up2k(object):
             cur.connection.commit()
             if n_done:
                 self.log("mtp: scanned {} files in {}".format(n_done, ptop), c=6)
-                cur.execute("vacuum")
+                self._vacuum(cur)
 
             wcur.close()
             cur.close()
@@ -2006,6 +2251,8 @@ class Up2k(object):
             except:
                 pass
 
+            self._add_fts_tab(cur)
+
             try:
                 nfiles = next(cur.execute("select count(w) from up"))[0]
                 self.log("OK: {} |{}|".format(db_path, nfiles))
@@ -2097,6 +2344,7 @@ class Up2k(object):
         self._add_dhash_tab(cur)
         self._add_xiu_tab(cur)
         self._add_cv_tab(cur)
+        self._add_fts_tab(cur)
         self.log("created DB at {}".format(db_path))
         return cur
 
@@ -2145,6 +2393,71 @@ class Up2k(object):
 
         cur.connection.commit()
 
+    def _add_fts_tab(self, cur: "sqlite3.Cursor") -> None:
+        # optional; filename trigram index for u2idx, kept in sync by triggers
+        try:
+            cur.execute("select fn from upf limit 1").fetchone()
+            have = True
+        except:
+            have = False
+
+        if have == bool(self.args.srch_fts):
+            return
+
+        if have:
+            for cmd in [
+                r"drop trigger if exists upf_i",
+                r"drop trigger if exists upf_d",
+                r"drop trigger if exists upf_u",
+                r"drop table upf",
+            ]:
+                cur.execute(cmd)
+
+            cur.connection.commit()
+            self.log("dropped filename search index")
+            return
+
+        if self.sqlite_ver and self.sqlite_ver < (3, 34):
+            t = "cannot enable --srch-fts; need sqlite 3.34 or newer, have {}"
+            self.log(t.format(sqlite3.sqlite_version), 3)
+            return
+
+        try:
+            for cmd in [
+                r"create virtual table upf using fts5(fn, tokenize='trigram')",
+                r"insert into upf (rowid, fn) select rowid, fn from up",
+                r"create trigger upf_i after insert on up begin insert into upf (rowid, fn) values (new.rowid, new.fn); end",
+                r"create trigger upf_d after delete on up begin delete from upf where rowid = old.rowid; end",
+                r"create trigger upf_u after update of fn on up begin update upf set fn = new.fn where rowid = old.rowid; end",
+            ]:
+                cur.execute(cmd)
+
+            cur.connection.commit()
+            self.log("created filename search index")
+        except:
+            cur.connection.rollback()
+            t = "cannot enable --srch-fts; sqlite3 lacks fts5?\n{}"
+            self.log(t.format(min_ex()), 3)
+
+    def _vacuum(self, cur: "sqlite3.Cursor") -> None:
+        cur.execute("vacuum")
+        if not self.args.srch_fts:
+            return
+
+        try:
+            cur.execute("select fn from upf limit 1").fetchone()
+        except:
+            return  # sqlite too old
+
+        # vacuum may renumber the rowids of up, which the upf triggers use
+        try:
+            cur.execute("delete from upf")
+            cur.execute("insert into upf (rowid, fn) select rowid, fn from up")
+            cur.connection.commit()
+        except:
+            cur.connection.rollback()
+            self.log("failed to rebuild filename search index:\n" + min_ex(), 3)
+
     def _add_cv_tab(self, cur: "sqlite3.Cursor") -> None:
         # v5b -> v5c
         try:
@@ -2166,6 +2479,24 @@ class Up2k(object):
 
         cur.connection.commit()
 
+    def _add_cr_tab(self, cur: "sqlite3.Cursor") -> None:
+        # optional; only for volumes with idxcrc, so not part of the schema
+        # version. crc32 of file contents by wark, for ?zip=crc; the rows
+        # stay valid if idxcrc is disabled and enabled again later
+        try:
+            cur.execute("select w, c from cr limit 1").fetchone()
+            return
+        except:
+            pass
+
+        for cmd in [
+            r"create table cr (w text, c int)",
+            r"create index cr_w on cr(w)",
+        ]:
+            cur.execute(cmd)
+
+        cur.connection.commit()
+
     def _job_volchk(self, cj: dict[str, Any]) -> None:
         if not self.register_vpath(cj["ptop"], cj["vcfg"]):
             if cj["ptop"] not in self.registry:
@@ -2280,6 +2611,7 @@ class Up2k(object):
             if job and wark in reg:
                 # self.log("pop " + wark + "  " + job["name"] + " handle_json db", 4)
                 del reg[wark]
+                self._jnl(cj["ptop"], "d", wark)
 
             if lost:
                 c2 = None
@@ -2464,6 +2796,7 @@ class Up2k(object):
                     self._new_upload(job)
                 except:
                     self.registry[job["ptop"]].pop(job["wark"], None)
+                    self._jnl(job["ptop"], "d", job["wark"])
                     raise
 
             purl = "{}/{}".format(job["vtop"], job["prel"]).strip("/")
@@ -2585,14 +2918,14 @@ class Up2k(object):
     def handle_chunk(
         self, ptop: str, wark: str, chash: str
     ) -> tuple[int, list[int], str, float, bool]:
-        with self.mutex:
-            self.db_act = self.vol_act[ptop] = time.time()
-            job = self.registry[ptop].get(wark)
-            if not job:
-                known = " ".join([x for x in self.registry[ptop].keys()])
-                self.log("unknown wark [{}], known: {}".format(wark, known))
-                raise Pebkac(400, "unknown wark")
+        self.db_act = self.vol_act[ptop] = time.time()
+        job = self.registry[ptop].get(wark)
+        if not job:
+            known = " ".join(list(self.registry[ptop]))
+            self.log("unknown wark [{}], known: {}".format(wark, known))
+            raise Pebkac(400, "unknown wark")
 
+        with self._wlock(wark):
             if chash not in job["need"]:
                 msg = "chash = {} , need:\n".format(chash)
                 msg += "\n".join(job["need"])
@@ -2628,24 +2961,24 @@ class Up2k(object):
         return chunksize, ofs, path, job["lmod"], job["sprs"]
 
     def release_chunk(self, ptop: str, wark: str, chash: str) -> bool:
-        with self.mutex:
-            job = self.registry[ptop].get(wark)
-            if job:
+        job = self.registry[ptop].get(wark)
+        if job:
+            with self._wlock(wark):
                 job["busy"].pop(chash, None)
 
         return True
 
     def confirm_chunk(self, ptop: str, wark: str, chash: str) -> tuple[int, str]:
-        with self.mutex:
-            self.db_act = self.vol_act[ptop] = time.time()
-            try:
-                job = self.registry[ptop][wark]
-                pdir = djoin(job["ptop"], job["prel"])
-                src = djoin(pdir, job["tnam"])
-                dst = djoin(pdir, job["name"])
-            except Exception as ex:
-                return "confirm_chunk, wark, " + repr(ex)  # type: ignore
+        self.db_act = self.vol_act[ptop] = time.time()
+        try:
+            job = self.registry[ptop][wark]
+            pdir = djoin(job["ptop"], job["prel"])
+            src = djoin(pdir, job["tnam"])
+            dst = djoin(pdir, job["name"])
+        except Exception as ex:
+            return "confirm_chunk, wark, " + repr(ex)  # type: ignore
 
+        with self._wlock(wark):
             job["busy"].pop(chash, None)
 
             try:
@@ -2653,16 +2986,23 @@ class Up2k(object):
             except Exception as ex:
                 return "confirm_chunk, chash, " + repr(ex)  # type: ignore
 
+            self._jnl(ptop, "c", wark, [chash, job["poke"]])
+
             ret = len(job["need"])
-            if ret > 0:
-                return ret, src
 
-            if self.args.nw:
+        if ret > 0:
+            return ret, src
+
+        if self.args.nw:
+            with self.mutex:
                 self.regdrop(ptop, wark)
-                return ret, dst
 
         return ret, dst
 
+    def _wlock(self, wark: str) -> threading.Lock:
+        """lock for the chunk bookkeeping (need/busy) of one upload"""
+        return self.wlocks[hash(wark) % len(self.wlocks)]
+
     def finish_upload(self, ptop: str, wark: str, busy_aps: set[str]) -> None:
         self.busy_aps = busy_aps
         with self.mutex:
@@ -2716,8 +3056,10 @@ class Up2k(object):
         z2 += [upt]
         if self.idx_wark(vflags, *z2):
             del self.registry[ptop][wark]
+            self._jnl(ptop, "d", wark)
         else:
             self.registry[ptop][wark]["done"] = 1
+            self._jnl(ptop, "f", wark)
             self.regdrop(ptop, wark)
 
         if wake_sr:
@@ -2755,6 +3097,7 @@ class Up2k(object):
         self.log(t.format(ptop, len(olds), n))
         for k in olds[:n]:
             self.registry[ptop].pop(k, None)
+            self._jnl(ptop, "d", k)
         self.droppable[ptop] = olds[n:]
 
     def idx_wark(
@@ -2807,8 +3150,29 @@ class Up2k(object):
             self.tagq.put((ptop, wark, rd, fn, ip, at))
             self.n_tagq += 1
 
+        if "idxcrc" in self.flags[ptop] and sz:
+            q = "select c from cr where w = ?"
+            if not cur.execute(q, (wark[:16],)).fetchone():
+                self.crcq.put((ptop, wark, djoin(ptop, rd, fn), sz))
+
         return True
 
+    def db_crc(self, db: "sqlite3.Cursor", wark: str, crc: int) -> None:
+        db.execute("delete from cr where w = ?", (wark[:16],))
+        db.execute("insert into cr values (?,?)", (wark[:16], crc))
+
+    def add_crcs(self, ptop: str, crcs: list[tuple[str, int]]) -> None:
+        """crc32s which were calculated elsewhere (zip downloads)"""
+        with self.mutex:
+            cur = self.cur.get(ptop)
+            if not cur or "idxcrc" not in self.flags.get(ptop, {}):
+                return
+
+            for wark, crc in crcs:
+                self.db_crc(cur, wark, crc)
+
+            cur.connection.commit()
+
     def db_rm(self, db: "sqlite3.Cursor", rd: str, fn: str) -> None:
         sql = "delete from up where rd = ? and fn = ?"
         try:
@@ -2834,6 +3198,10 @@ class Up2k(object):
         at: float,
         skip_xau: bool = False,
     ) -> None:
+        if ptop:
+            self._lsc_drop([djoin(ptop, rd)])
+            self._th_pre(ptop, rd, fn, ts)
+
         sql = "insert into up values (?,?,?,?,?,?,?)"
         v = (wark, int(ts), sz, rd, fn, ip or "", int(at or 0))
         try:
@@ -2863,6 +3231,7 @@ class Up2k(object):
             self.log(t, 1)
             bos.unlink(dst)
             self.registry[ptop].pop(wark, None)
+            self._jnl(ptop, "d", wark)
             raise Pebkac(403, t)
 
         xiu = vflags.get("xiu")
@@ -2897,6 +3266,18 @@ class Up2k(object):
             except:
                 pass
 
+    def _lsc_drop(self, aps: list[str]) -> None:
+        """make httpsrv forget its cached listings of these folders"""
+        if self.args.ls_cache:
+            self.hub.broker.say("lsc_drop", aps)
+
+    def _th_pre(self, ptop: str, rd: str, fn: str, lmod: float) -> None:
+        """queue a thumbnail of a new file, if the volume wants that"""
+        vf = self.flags.get(ptop) or {}
+        thsrv = getattr(self.hub, "thumbsrv", None)  # not yet during init
+        if thsrv and "thpre" in vf:
+            thsrv.pre(ptop, vjoin(rd, fn), lmod, vf)
+
     def handle_rm(
         self, uname: str, ip: str, vpaths: list[str], lim: list[int], rm_up: bool
     ) -> str:
@@ -2982,6 +3363,7 @@ class Up2k(object):
         xbd = vn.flags.get("xbd")
         xad = vn.flags.get("xad")
         n_files = 0
+        adirs = set([os.path.dirname(atop)])
         for dbv, vrem, _, adir, files, rd, vd in g:
             for fn in [x[0] for x in files]:
                 if lim:
@@ -3026,6 +3408,7 @@ class Up2k(object):
                             cur.connection.commit()
 
                 bos.unlink(abspath)
+                adirs.add(adir)
                 if xad:
                     runhook(self.log, xad, abspath, vpath, "", uname, 0, 0, ip, 0, "")
 
@@ -3034,6 +3417,8 @@ class Up2k(object):
         else:
             ok = ng = []
 
+        self._lsc_drop(list(adirs))
+
         if rm_up:
             ok2, ng2 = rmdirs_up(os.path.dirname(atop), ptop)
         else:
@@ -3159,6 +3544,7 @@ class Up2k(object):
             mt = bos.path.getmtime(sabs, False)
             bos.unlink(sabs)
             self._symlink(dlabs, dabs, dvn.flags, False, lmod=mt)
+            self._lsc_drop([os.path.dirname(sabs), os.path.dirname(dabs)])
 
             # folders are too scary, schedule rescan of both vols
             self.need_rescan.add(svn.vpath)
@@ -3198,6 +3584,7 @@ class Up2k(object):
 
             os.unlink(b1)
 
+        self._lsc_drop([os.path.dirname(sabs), os.path.dirname(dabs)])
         if w:
             assert c1
             if c2 and c2 != c1:
@@ -3313,6 +3700,7 @@ class Up2k(object):
                 self.log(t.format(wark, p))
                 assert wark
                 del reg[wark]
+                self._jnl(ptop, "d", wark)
 
     def _relink(self, wark: str, sptop: str, srem: str, dabs: str) -> int:
         """
@@ -3410,15 +3798,24 @@ class Up2k(object):
 
         return wark
 
-    def _hashlist_from_file(self, path: str, prefix: str = "") -> list[str]:
+    def _hashlist_from_file(
+        self, path: str, prefix: str = "", crcs: Optional[list[int]] = None
+    ) -> list[str]:
+        """if crcs is a list, the crc32 of the file is appended to it"""
         fsz = bos.path.getsize(path)
         csz = up2k_chunksize(fsz)
         ret = []
+        crc = 0
+        want_crc = crcs is not None
         suffix = " MB, {}".format(path)
         with open(fsenc(path), "rb", 512 * 1024) as f:
-            if self.mth and fsz >= 1024 * 512:
-                tlt = self.mth.hash(f, fsz, csz, self.pp, prefix, suffix)
+            mth = self.mph or self.mth
+            if mth and fsz >= 1024 * 512:
+                tlt = mth.hash(f, fsz, csz, self.pp, prefix, suffix, want_crc)
                 ret = [x[0] for x in tlt]
+                if want_crc:
+                    for _, _, zi, zc in tlt:
+                        crc = crc32_combine(crc, zc, zi)
                 fsz = 0
 
             while fsz > 0:
@@ -3439,12 +3836,17 @@ class Up2k(object):
                         raise Exception("EOF at " + str(f.tell()))
 
                     hashobj.update(buf)
+                    if want_crc:
+                        crc = zlib.crc32(buf, crc)
                     rem -= len(buf)
 
                 digest = hashobj.digest()[:33]
                 digest = base64.urlsafe_b64encode(digest)
                 ret.append(digest.decode("utf-8"))
 
+        if crcs is not None and ret:
+            crcs.append(crc & 0xFFFFFFFF)
+
         return ret
 
     def _new_upload(self, job: dict[str, Any]) -> None:
@@ -3452,7 +3854,8 @@ class Up2k(object):
         if not job["size"] and bos.path.isfile(djoin(pdir, job["name"])):
             return
 
-        self.registry[job["ptop"]][job["wark"]] = job
+        # not published in the registry until it has a tnam;
+        # handle_chunk does not take the mutex
         job["name"] = self._untaken(pdir, job, job["t0"])
         # if len(job["name"].split(".")) > 8:
         #    raise Exception("aaa")
@@ -3483,8 +3886,8 @@ class Up2k(object):
 
         if self.args.nw:
             job["tnam"] = tnam
-            if not job["hash"]:
-                del self.registry[job["ptop"]][job["wark"]]
+            if job["hash"]:
+                self.registry[job["ptop"]][job["wark"]] = job
             return
 
         if self.args.plain_ip:
@@ -3536,30 +3939,159 @@ class Up2k(object):
                 f.seek(sz - 1)
                 f.write(b"e")
 
+        self.registry[job["ptop"]][job["wark"]] = job
+        self._jnl(job["ptop"], "j", job["wark"], job)
+
         if not job["hash"]:
             self._finish_upload(job["ptop"], job["wark"])
 
     def _snapshot(self) -> None:
-        slp = self.snap_persist_interval
+        nsweep = time.time() + self.snap_persist_interval
         while True:
-            time.sleep(slp)
+            time.sleep(self.snap_jnl_interval)
             if self.pp:
-                slp = 5
-            else:
-                slp = self.snap_persist_interval
-                self.do_snapshot()
+                continue
 
-    def do_snapshot(self) -> None:
-        with self.mutex:
-            for k, reg in self.registry.items():
-                self._snap_reg(k, reg)
+            now = time.time()
+            sweep = now >= nsweep
+            if sweep:
+                nsweep = now + self.snap_persist_interval
+
+            self.do_snapshot(sweep)
+
+    def do_snapshot(self, sweep: bool = False) -> None:
+        with self.snap_mutex:
+            for ptop in list(self.registry):
+                self._snap_reg(ptop, sweep)
+
+    def _jnl(self, ptop: str, op: str, wark: str, arg: Any = None) -> None:
+        """queue a registry change for the next journal flush"""
+        with self.snap_jnl_mutex:
+            zl = self.snap_jnl.get(ptop)
+            if zl is not None:
+                zl.append((op, wark, arg))
+
+    def _snap_job(self, job: dict[str, Any]) -> dict[str, Any]:
+        """copy of a job which is safe to serialize while chunks are confirmed"""
+        ret = {k: v for k, v in job.items() if k != "busy"}
+        ret["need"] = list(job["need"])
+        return ret
+
+    def _jnl_replay(
+        self,
+        path: str,
+        gen: Optional[str],
+        reg: dict[str, dict[str, Any]],
+        drp: Optional[list[str]],
+    ) -> int:
+        """
+        applies the journal onto the registry loaded from up2k.snap;
+        ignores it entirely if it belongs to another snapshot,
+        and stops at the first torn record (crash during append)
+        """
+        if not gen or drp is None or not bos.path.exists(path):
+            return -1
+
+        n = -1
+        try:
+            with open(fsenc(path), "rb") as f:
+                for ln in f:
+                    op, wark, arg = json.loads(ln.decode("utf-8"))
+                    if n < 0:
+                        if op != "g" or wark != gen:
+                            return -1
+                    elif op == "j":
+                        reg[wark] = arg
+                    elif op == "c":
+                        job = reg.get(wark)
+                        chash, poke = arg
+                        if job and chash in job["need"]:
+                            job["need"].remove(chash)
+                            job["poke"] = poke
+                    elif op == "f":
+                        if wark in reg:
+                            reg[wark]["done"] = 1
+                            drp.append(wark)
+                    elif op == "d":
+                        reg.pop(wark, None)
+                    n += 1
+        except:
+            self.log("journal [{}] ends after {} records".format(path, n), 3)
+
+        return n
 
-    def _snap_reg(self, ptop: str, reg: dict[str, dict[str, Any]]) -> None:
+    def _snap_reg(self, ptop: str, sweep: bool) -> None:
         now = time.time()
         histpath = self.asrv.vfs.histtab.get(ptop)
         if not histpath:
             return
 
+        path = os.path.join(histpath, "up2k.snap")
+        jpath = path + ".jnl"
+        body = b""
+        with self.mutex:
+            reg = self.registry[ptop]
+            if sweep:
+                self._snap_sweep(ptop, reg, now)
+
+            with self.snap_jnl_mutex:
+                zl = self.snap_jnl.get(ptop)
+                gen = self.snap_gen.get(ptop)
+                if zl is None or (not zl and gen is not None):
+                    return
+
+                self.snap_jnl[ptop] = []
+
+            if not reg:
+                self.snap_gen[ptop] = ""
+            elif not gen or self.snap_jsz[ptop] > self.snap_lim[ptop]:
+                # compact; full rewrite, starting a new journal
+                gen = "{:x}-{:.6f}".format(os.getpid(), now)
+                reg2 = {k: self._snap_job(v) for k, v in reg.items()}
+                zd = {"droppable": self.droppable[ptop], "registry": reg2, "gen": gen}
+                body = json.dumps(zd, indent=2, sort_keys=True).encode("utf-8")
+                zl = [("g", gen, None)]
+                self.snap_gen[ptop] = gen
+                self.snap_jsz[ptop] = 0
+                self.snap_lim[ptop] = max(1024 * 1024, len(body))
+
+            zl = [(a, b, self._snap_job(c) if a == "j" else c) for a, b, c in zl]
+            zb = "".join([json.dumps(x) + "\n" for x in zl]).encode("utf-8")
+            self.snap_jsz[ptop] += len(zb)
+
+        # file io without the mutex; snap_mutex keeps the order
+        if not reg:
+            if gen != "":
+                for zs in (path, jpath):
+                    if bos.path.exists(zs):
+                        bos.unlink(zs)
+            return
+
+        if bos.makedirs(histpath):
+            hidedir(histpath)
+
+        if not body:
+            with open(fsenc(jpath), "ab") as f:
+                f.write(zb)
+            return
+
+        path2 = "{}.{}".format(path, os.getpid())
+        with gzip.GzipFile(path2, "wb") as f:
+            f.write(body)
+
+        jpath2 = "{}.{}".format(jpath, os.getpid())
+        with open(fsenc(jpath2), "wb") as f:
+            f.write(zb)
+
+        # new snap with old journal is safe (gen mismatch), so snap first
+        atomic_move(path2, path)
+        atomic_move(jpath2, jpath)
+
+        self.log("snap: {} |{}|".format(path, len(reg.keys())))
+
+    def _snap_sweep(
+        self, ptop: str, reg: dict[str, dict[str, Any]], now: float
+    ) -> None:
         rm = [
             x
             for x in reg.values()
@@ -3584,6 +4116,7 @@ class Up2k(object):
             self.log("\n".join([t] + vis))
             for job in rm:
                 del reg[job["wark"]]
+                self._jnl(ptop, "d", job["wark"])
                 try:
                     # remove the filename reservation
                     path = djoin(job["ptop"], job["prel"], job["name"])
@@ -3600,36 +4133,6 @@ class Up2k(object):
                 except:
                     pass
 
-        if self.args.nw or self.args.no_snap:
-            return
-
-        path = os.path.join(histpath, "up2k.snap")
-        if not reg:
-            if ptop not in self.snap_prev or self.snap_prev[ptop] is not None:
-                self.snap_prev[ptop] = None
-                if bos.path.exists(path):
-                    bos.unlink(path)
-            return
-
-        newest = float(max(x["poke"] for _, x in reg.items()) if reg else 0)
-        etag = (len(reg), newest)
-        if etag == self.snap_prev.get(ptop):
-            return
-
-        if bos.makedirs(histpath):
-            hidedir(histpath)
-
-        path2 = "{}.{}".format(path, os.getpid())
-        body = {"droppable": self.droppable[ptop], "registry": reg}
-        j = json.dumps(body, indent=2, sort_keys=True).encode("utf-8")
-        with gzip.GzipFile(path2, "wb") as f:
-            f.write(j)
-
-        atomic_move(path2, path)
-
-        self.log("snap: {} |{}|".format(path, len(reg.keys())))
-        self.snap_prev[ptop] = etag
-
     def _tagger(self) -> None:
         with self.mutex:
             self.n_tagq += 1
@@ -3702,11 +4205,17 @@ class Up2k(object):
                     self.salt, inf.st_size, int(inf.st_mtime), rd, fn
                 )
             else:
-                hashes = self._hashlist_from_file(abspath)
+                crcs = [] if "idxcrc" in self.flags[ptop] else None
+                hashes = self._hashlist_from_file(abspath, "", crcs)
                 if not hashes:
                     return
 
                 wark = up2k_wark_from_hashlist(self.salt, inf.st_size, hashes)
+                if crcs:
+                    with self.mutex:
+                        cur = self.cur.get(ptop)
+                        if cur:
+                            self.db_crc(cur, wark, crcs[0])
 
             with self.mutex:
                 self.idx_wark(
@@ -3729,6 +4238,24 @@ class Up2k(object):
                 with self.rescan_cond:
                     self.rescan_cond.notify_all()
 
+    def _crcer(self) -> None:
+        """crc32 of finished up2k uploads, which arrive without one"""
+        while True:
+            ptop, wark, abspath, sz = self.crcq.get()
+            crc = 0
+            try:
+                for buf in yieldfile(abspath):
+                    crc = zlib.crc32(buf, crc)
+                    sz -= len(buf)
+            except Exception as ex:
+                self.log("crc: {} @ [{}]".format(repr(ex), abspath), 3)
+                continue
+
+            if sz:
+                continue  # modified since upload; let the next rescan deal
+
+            self.add_crcs(ptop, [(wark, crc & 0xFFFFFFFF)])
+
     def hash_file(
         self,
         ptop: str,
@@ -3753,6 +4280,9 @@ class Up2k(object):
         if self.mth:
             self.mth.stop = True
 
+        if self.mph:
+            self.mph.shutdown()
+
         # in case we're killed early
         for x in list(self.spools):
             self._unspool(x)
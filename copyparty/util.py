@@ -24,6 +24,7 @@ import sys
 import threading
 import time
 import traceback
+import zlib
 from collections import Counter
 from datetime import datetime
 from email.utils import formatdate
@@ -76,6 +77,9 @@ try:
 except:
     HAVE_PSUTIL = False
 
+HAVE_PREAD = hasattr(os, "pread") and not ANYWIN
+HAVE_FADVISE = hasattr(os, "posix_fadvise")
+
 if True:  # pylint: disable=using-constant-test
     import types
     from collections.abc import Callable, Iterable
@@ -562,6 +566,33 @@ class _Unrecv(object):
 
         return ret
 
+    def recv_into(self, mv: memoryview, spins: int = 1) -> int:
+        """recv into a caller-provided buffer; returns number of bytes"""
+        if self.buf:
+            n = min(len(mv), len(self.buf))
+            mv[:n] = self.buf[:n]
+            self.buf = self.buf[n:]
+            return n
+
+        while True:
+            try:
+                n = self.s.recv_into(mv)
+                break
+            except socket.timeout:
+                spins -= 1
+                if spins <= 0:
+                    n = 0
+                    break
+                continue
+            except:
+                n = 0
+                break
+
+        if not n:
+            raise UnrecvEOF("client stopped sending data")
+
+        return n
+
     def recv_ex(self, nbytes: int, raise_on_trunc: bool = True) -> bytes:
         """read an exact number of bytes"""
         ret = b""
@@ -610,6 +641,11 @@ class _LUnrecv(object):
 
         return ret
 
+    def recv_into(self, mv: memoryview, spins: int = 1) -> int:
+        buf = self.recv(len(mv), spins)
+        mv[: len(buf)] = buf
+        return len(buf)
+
     def recv_ex(self, nbytes: int, raise_on_trunc: bool = True) -> bytes:
         """read an exact number of bytes"""
         try:
@@ -750,17 +786,62 @@ class ProgressPrinter(threading.Thread):
         sys.stdout.flush()  # necessary on win10 even w/ stderr btw
 
 
+def _gf2_times(mat: list[int], vec: int) -> int:
+    ret = 0
+    n = 0
+    while vec:
+        if vec & 1:
+            ret ^= mat[n]
+        vec >>= 1
+        n += 1
+    return ret
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """
+    crc32 of the concatenation of two buffers, given the crc32 of each
+    and the length of the second (zlib's crc32_combine, which python lacks)
+    """
+    if len2 <= 0:
+        return crc1
+
+    # operator for one zero bit, then two, then four
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = [_gf2_times(odd, x) for x in odd]
+    odd = [_gf2_times(even, x) for x in even]
+
+    # apply len2 zero bytes to crc1
+    while True:
+        even = [_gf2_times(odd, x) for x in odd]
+        if len2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+
+        odd = [_gf2_times(even, x) for x in even]
+        if len2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+
+    return crc1 ^ crc2
+
+
 class MTHash(object):
     def __init__(self, cores: int):
         self.pp: Optional[ProgressPrinter] = None
         self.f: Optional[typing.BinaryIO] = None
+        self.fd = -1
         self.sz = 0
         self.csz = 0
+        self.crc = False
         self.stop = False
         self.omutex = threading.Lock()
         self.imutex = threading.Lock()
         self.work_q: Queue[int] = Queue()
-        self.done_q: Queue[tuple[int, str, int, int]] = Queue()
+        self.done_q: Queue[tuple[int, str, int, int, int]] = Queue()
         self.thrs = []
         for n in range(cores):
             t = Daemon(self.worker, "mth-" + str(n))
@@ -774,13 +855,16 @@ class MTHash(object):
         pp: Optional[ProgressPrinter] = None,
         prefix: str = "",
         suffix: str = "",
-    ) -> list[tuple[str, int, int]]:
+        crc: bool = False,
+    ) -> list[tuple[str, int, int, int]]:
         with self.omutex:
             self.f = f
+            self.fd = f.fileno() if HAVE_PREAD else -1
             self.sz = fsz
             self.csz = chunksz
+            self.crc = crc
 
-            chunks: dict[int, tuple[str, int, int]] = {}
+            chunks: dict[int, tuple[str, int, int, int]] = {}
             nchunks = int(math.ceil(fsz / chunksz))
             for nch in range(nchunks):
                 self.work_q.put(nch)
@@ -789,8 +873,8 @@ class MTHash(object):
             for nch in range(nchunks):
                 qe = self.done_q.get()
                 try:
-                    nch, dig, ofs, csz = qe
-                    chunks[nch] = (dig, ofs, csz)
+                    nch, dig, ofs, csz, zc = qe
+                    chunks[nch] = (dig, ofs, csz, zc)
                 except:
                     ex = ex or str(qe)
 
@@ -806,6 +890,7 @@ class MTHash(object):
                 ret.append(chunks[n])
 
             self.f = None
+            self.fd = -1
             self.csz = 0
             self.sz = 0
             return ret
@@ -820,30 +905,138 @@ class MTHash(object):
 
             self.done_q.put(v)
 
-    def hash_at(self, nch: int) -> tuple[int, str, int, int]:
+    def hash_at(self, nch: int) -> tuple[int, str, int, int, int]:
         f = self.f
         ofs = ofs0 = nch * self.csz
         chunk_sz = chunk_rem = min(self.csz, self.sz - ofs)
         if self.stop:
-            return nch, "", ofs0, chunk_sz
+            return nch, "", ofs0, chunk_sz, 0
 
         assert f
+        fd = self.fd
+        if fd >= 0 and HAVE_FADVISE:
+            try:
+                os.posix_fadvise(fd, ofs, chunk_sz, os.POSIX_FADV_WILLNEED)
+            except:
+                pass
+
+        want_crc = self.crc
+        crc = 0
         hashobj = hashlib.sha512()
         while chunk_rem > 0:
-            with self.imutex:
-                f.seek(ofs)
-                buf = f.read(min(chunk_rem, 1024 * 1024 * 12))
+            if fd >= 0:
+                # positional reads; no shared file offset so no lock
+                buf = os.pread(fd, min(chunk_rem, 1024 * 1024 * 12), ofs)
+            else:
+                with self.imutex:
+                    f.seek(ofs)
+                    buf = f.read(min(chunk_rem, 1024 * 1024 * 12))
 
             if not buf:
                 raise Exception("EOF at " + str(ofs))
 
             hashobj.update(buf)
+            if want_crc:
+                crc = zlib.crc32(buf, crc)
             chunk_rem -= len(buf)
             ofs += len(buf)
 
         bdig = hashobj.digest()[:33]
         udig = base64.urlsafe_b64encode(bdig).decode("utf-8")
-        return nch, udig, ofs0, chunk_sz
+        return nch, udig, ofs0, chunk_sz, crc & 0xFFFFFFFF
+
+
+def _mph_chunk(
+    job: tuple[Union[bytes, str], int, int, int, bool]
+) -> tuple[int, str, int]:
+    ap, nch, ofs, rem, want_crc = job
+    crc = 0
+    hashobj = hashlib.sha512()
+    with open(ap, "rb", 0) as f:
+        f.seek(ofs)
+        while rem > 0:
+            buf = f.read(min(rem, 1024 * 1024 * 12))
+            if not buf:
+                raise Exception("EOF at " + str(ofs))
+
+            hashobj.update(buf)
+            if want_crc:
+                crc = zlib.crc32(buf, crc)
+            rem -= len(buf)
+            ofs += len(buf)
+
+    bdig = hashobj.digest()[:33]
+    udig = base64.urlsafe_b64encode(bdig).decode("utf-8")
+    return nch, udig, crc & 0xFFFFFFFF
+
+
+class MPHash(object):
+    """
+    same as MTHash but with a pool of processes, sidestepping the GIL;
+    each worker opens the file by path and hashes a range of chunks;
+    the pool is started when the first file is hashed
+    """
+
+    def __init__(self, nproc: int):
+        self.nproc = nproc
+        self.stop = False
+        self.mutex = threading.Lock()
+        self.pool: Optional[Any] = None
+
+    def _pool(self) -> Optional[Any]:
+        with self.mutex:
+            if self.pool or self.stop:
+                return self.pool
+
+            try:
+                ctx = mp.get_context("spawn")
+            except:
+                ctx = mp
+
+            self.pool = ctx.Pool(self.nproc)
+            return self.pool
+
+    def shutdown(self) -> None:
+        with self.mutex:
+            self.stop = True
+            if self.pool:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+
+    def hash(
+        self,
+        f: typing.BinaryIO,
+        fsz: int,
+        chunksz: int,
+        pp: Optional[ProgressPrinter] = None,
+        prefix: str = "",
+        suffix: str = "",
+        crc: bool = False,
+    ) -> list[tuple[str, int, int, int]]:
+        ap = f.name
+        nchunks = int(math.ceil(fsz / chunksz))
+        jobs = []
+        for nch in range(nchunks):
+            ofs = nch * chunksz
+            jobs.append((ap, nch, ofs, min(chunksz, fsz - ofs), crc))
+
+        pool = self._pool()
+        if not pool:
+            return []
+
+        ret = []
+        for nch, dig, zc in pool.imap(_mph_chunk, jobs):
+            if self.stop:
+                return []
+
+            ofs, csz = jobs[nch][2:4]
+            ret.append((dig, ofs, csz, zc))
+            if pp:
+                mb = int((fsz - ofs) / 1024 / 1024)
+                pp.msg = prefix + str(mb) + suffix
+
+        return ret
 
 
 class HMaccas(object):
@@ -1996,6 +2189,16 @@ else:
         return 1
 
 
+def sck_gone(sck: socket.socket) -> bool:
+    """true if the peer has hung up; linux only, false if unknown"""
+    try:
+        p = select.poll()
+        p.register(sck.fileno(), select.POLLRDHUP)  # type: ignore
+        return bool(p.poll(0))
+    except:
+        return False
+
+
 def shut_socket(log: "NamedLogger", sck: socket.socket, timeout: int = 3) -> None:
     t0 = time.time()
     fd = sck.fileno()
@@ -2046,6 +2249,30 @@ def read_socket(sr: Unrecv, total_size: int) -> Generator[bytes, None, None]:
         yield buf
 
 
+def read_socket_into(sr: Unrecv, total_size: int) -> Generator[memoryview, None, None]:
+    """
+    like read_socket, but recv_into one reusable buffer which grows
+    while the client keeps it full (32 KiB to 1 MiB);
+    each view is only valid until the next one is requested
+    """
+    bufsz = 32 * 1024
+    mv = memoryview(bytearray(bufsz))
+    remains = total_size
+    while remains > 0:
+        try:
+            n = sr.recv_into(mv[:remains] if remains < bufsz else mv)
+        except OSError:
+            t = "client d/c during binary post after {} bytes, {} bytes remaining"
+            raise Pebkac(400, t.format(total_size - remains, remains))
+
+        remains -= n
+        yield mv[:n]
+
+        if n == bufsz and bufsz < 1024 * 1024 and remains > bufsz:
+            bufsz *= 2
+            mv = memoryview(bytearray(bufsz))
+
+
 def read_socket_unbounded(sr: Unrecv) -> Generator[bytes, None, None]:
     try:
         while True:
@@ -2055,22 +2282,25 @@ def read_socket_unbounded(sr: Unrecv) -> Generator[bytes, None, None]:
 
 
 def read_socket_chunked(
-    sr: Unrecv, log: Optional["NamedLogger"] = None
-) -> Generator[bytes, None, None]:
+    sr: Unrecv, log: Optional["NamedLogger"] = None, reuse: bool = False
+) -> Generator[Union[bytes, memoryview], None, None]:
     err = "upload aborted: expected chunk length, got [{}] |{}| instead"
+    reader: Any = read_socket_into if reuse else read_socket
     while True:
         buf = b""
-        while b"\r" not in buf:
+        while b"\n" not in buf:
             try:
-                buf += sr.recv(2)
-                if len(buf) > 16:
+                buf += sr.recv(32)
+                if len(buf) > 48 and b"\n" not in buf:
                     raise Exception()
             except:
                 err = err.format(buf.decode("utf-8", "replace"), len(buf))
                 raise Pebkac(400, err)
 
-        if not buf.endswith(b"\n"):
-            sr.recv(1)
+        # got the length and whatever followed; give back the latter
+        buf, zb = buf.split(b"\n", 1)
+        if zb:
+            sr.unrecv(zb)
 
         try:
             chunklen = int(buf.rstrip(b"\r\n"), 16)
@@ -2089,7 +2319,7 @@ def read_socket_chunked(
         if log:
             log("receiving {} byte chunk".format(chunklen))
 
-        for chunk in read_socket(sr, chunklen):
+        for chunk in reader(sr, chunklen):
             yield chunk
 
         x = sr.recv_ex(2, False)
@@ -2123,7 +2353,7 @@ def yieldfile(fn: str) -> Generator[bytes, None, None]:
 
 
 def hashcopy(
-    fin: Generator[bytes, None, None],
+    fin: Generator[Union[bytes, memoryview], None, None],
     fout: Union[typing.BinaryIO, typing.IO[Any]],
     slp: int = 0,
     max_sz: int = 0,
@@ -2259,6 +2489,95 @@ def statdir(
             print(t)
 
 
+class StatdirPf(object):
+    """
+    runs statdir on a few threads ahead of a single-threaded walker;
+    most recently wanted folders are read first (depth-first order)
+    """
+
+    def __init__(
+        self, logger: Optional["RootLogger"], scandir: bool, nthr: int, cap: int
+    ) -> None:
+        self.logger = logger
+        self.scandir = scandir
+        self.cap = cap
+        self.stop = False
+        self.cond = threading.Condition()
+        self.todo: list[str] = []
+        self.busy: set[str] = set()
+        self.skip: set[str] = set()
+        self.done: dict[str, list[tuple[str, os.stat_result]]] = {}
+        for n in range(nthr):
+            Daemon(self.worker, "statdir-pf-" + str(n))
+
+    def want(self, tops: list[str]) -> None:
+        with self.cond:
+            nfree = self.cap - len(self.todo) - len(self.busy) - len(self.done)
+            if nfree <= 0:
+                return
+
+            self.todo.extend(reversed(tops[:nfree]))
+            self.cond.notify_all()
+
+    def get(self, top: str) -> list[tuple[str, os.stat_result]]:
+        with self.cond:
+            while top in self.busy:
+                self.cond.wait(5)
+
+            ret = self.done.pop(top, None)
+            if ret is not None:
+                return ret
+
+            try:
+                self.todo.remove(top)
+            except:
+                pass
+
+        return list(statdir(self.logger, self.scandir, False, top))
+
+    def forget(self, tops: list[str]) -> None:
+        """
+        the walker is done with the parent of these; drop any it did not
+        get, so they do not take up space in cap until the scan is over
+        """
+        with self.cond:
+            zs = set(tops)
+            self.todo = [x for x in self.todo if x not in zs]
+            self.skip.update(zs & self.busy)
+            for top in zs:
+                self.done.pop(top, None)
+
+    def shutdown(self) -> None:
+        with self.cond:
+            self.stop = True
+            self.todo = []
+            self.done = {}
+            self.cond.notify_all()
+
+    def worker(self) -> None:
+        while True:
+            with self.cond:
+                while not self.todo and not self.stop:
+                    self.cond.wait()
+
+                if self.stop:
+                    return
+
+                top = self.todo.pop()
+                self.busy.add(top)
+
+            ret = list(statdir(self.logger, self.scandir, False, top))
+
+            with self.cond:
+                self.busy.discard(top)
+                if top in self.skip:
+                    self.skip.discard(top)
+                elif not self.stop:
+                    self.done[top] = ret
+
+                self.cond.notify_all()
+
+
 def rmdirs(
     logger: "RootLogger", scandir: bool, lstat: bool, top: str, depth: int
 ) -> tuple[list[str], list[str]]:
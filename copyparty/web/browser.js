@@ -4423,6 +4423,8 @@ var thegrid = (function () {
 			return r.loadsel();
 
 		var html = [],
+			bnames = [],
+			evp = get_evpath(),
 			svgs = new Set(),
 			max_svgs = CHROME ? 500 : 5000,
 			files = QSA('#files>tbody>tr>td:nth-child(2) a[id]');
@@ -4435,6 +4437,9 @@ var thegrid = (function () {
 				ref = ao.getAttribute('id'),
 				isdir = href.endsWith('/'),
 				ac = isdir ? ' class="dir"' : '',
+				base = vsplit(href)[0],
+				bth = r.thumbs && !isdir && window.DataView && (!base || base == evp) &&
+					bth_ext.has(name.split('.').pop().toLowerCase()),
 				ihref = href;
 
 			if (r.thumbs) {
@@ -4474,10 +4479,15 @@ var thegrid = (function () {
 
 			html.push('<a href="' + ohref + '" ref="' + ref +
 				'"' + ac + ' ttt="' + esc(name) + '"><img style="height:' +
-				(r.sz / 1.25) + 'em" onload="th_onload(this)" src="' +
+				(r.sz / 1.25) + 'em" onload="th_onload(this)" ' +
+				(bth ? 'data-th="' : 'src="') +
 				ihref + '" /><span' + ac + '>' + ao.innerHTML + '</span></a>');
+
+			if (bth)
+				bnames.push(uricom_dec(vsplit(ao.getAttribute('href').split('?')[0])[1]));
 		}
 		ebi('ggrid').innerHTML = html.join('\n');
+		loadths(bnames);
 
 		var srch = ebi('unsearch'),
 			gsel = ebi('gridsel');
@@ -4498,6 +4508,64 @@ var thegrid = (function () {
 		setTimeout(r.tippen, 20);
 	}
 
+	// fetch all the thumbnails which are ready in one request;
+	// any that are missing get their own ?th= to make them;
+	// files which cannot have one get their icon right away
+	var bth_gen = 0,
+		bth_urls = [],
+		bth_ext = new Set(th_ext.split(' '));
+
+	function loadths(names) {
+		var me = ++bth_gen;
+		for (var a = 0; a < bth_urls.length; a++)
+			URL.revokeObjectURL(bth_urls[a]);
+
+		bth_urls = [];
+		if (!names.length)
+			return;
+
+		var imgs = QSA('#ggrid img[data-th]'),
+			xhr = new XHR();
+
+		xhr.open('POST', get_evpath() + '?ths=' + (have_webp ? 'w' : 'j'), true);
+		xhr.responseType = 'arraybuffer';
+		xhr.setRequestHeader('Content-Type', 'text/plain');
+		xhr.onload = xhr.onerror = function () {
+			if (me != bth_gen)
+				return;
+
+			var buf = this.status == 200 && this.response,
+				mimes = ['image/jpeg', 'image/webp', 'image/png'];
+
+			try {
+				var dv = new DataView(buf),
+					ofs = 0;
+
+				while (ofs + 12 <= buf.byteLength) {
+					var img = imgs[dv.getUint32(ofs)],
+						sz = dv.getUint32(ofs + 4),
+						mime = mimes[dv.getUint32(ofs + 8)];
+
+					ofs += 12;
+					if (img && mime) {
+						var url = URL.createObjectURL(new Blob(
+							[new Uint8Array(buf, ofs, sz)], { type: mime }));
+
+						bth_urls.push(url);
+						img.src = url;
+					}
+					ofs += sz;
+				}
+			}
+			catch (ex) { }
+
+			for (var a = 0; a < imgs.length; a++)
+				if (!imgs[a].getAttribute('src'))
+					imgs[a].src = imgs[a].getAttribute('data-th');
+		};
+		xhr.send(JSON.stringify(names));
+	}
+
 	r.bagit = function (isrc) {
 		if (!window.baguetteBox)
 			return;
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import util as tu
+from tests.util import Cfg
+
+from copyparty.authsrv import AuthSrv
+from copyparty.httpcli import HttpCli
+
+
+class TestEtag(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        os.chdir(self.td)
+        os.mkdir("d")
+        with open("d/f", "wb") as f:
+            f.write(b"hello")
+
+        self.args = Cfg(v=[".::r"])
+        self.asrv = AuthSrv(self.args, self.log)
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def get(self, url, etag=""):
+        h = "GET {} HTTP/1.1\r\nConnection: close\r\n".format(url)
+        if etag:
+            h += "If-None-Match: {}\r\n".format(etag)
+
+        conn = tu.VHttpConn(self.args, self.asrv, self.log, (h + "\r\n").encode())
+        HttpCli(conn).run()
+        h, b = conn.s._reply.split(b"\r\n\r\n", 1)
+        hs = h.decode("utf-8").split("\r\n")
+        hd = dict(x.split(": ", 1) for x in hs[1:])
+        return int(hs[0].split(" ")[1]), hd.get("ETag"), b
+
+    def test(self):
+        st, tag, b = self.get("/d/?ls")
+        self.assertEqual(st, 200)
+        self.assertIn(b'"f"', b)
+
+        st, tag2, b = self.get("/d/?ls", tag)
+        self.assertEqual(st, 304)
+        self.assertEqual(tag2, tag)
+        self.assertEqual(b, b"")
+
+        # other query, other listing
+        st, zs, _ = self.get("/d/?ls=t", tag)
+        self.assertEqual(st, 200)
+        self.assertNotEqual(zs, tag)
+
+        # in-place edit; same size, folder mtime unchanged, not rescanned
+        # yet (no dhash change), so the folder is not listed to find out
+        dt = os.stat("d").st_mtime
+        with open("d/f", "r+b") as f:
+            f.write(b"HELLO")
+
+        os.utime("d/f", (dt + 5, dt + 5))
+        os.utime("d", (dt, dt))
+        self.assertEqual(self.get("/d/?ls", tag)[0], 304)
+
+        # new file
+        with open("d/g", "wb") as f:
+            f.write(b"x")
+
+        st, tag2, b = self.get("/d/?ls", tag)
+        self.assertEqual(st, 200)
+        self.assertNotEqual(tag2, tag)
+        self.assertIn(b'"g"', b)
+        self.assertEqual(self.get("/d/?ls", tag2)[0], 304)
+
+    def log(self, src, msg, c=0):
+        pass
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from tests import util as tu
+
+from copyparty.inotify import Inotify
+
+
+class TestInotify(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        self.top = os.path.join(self.td, "v")
+        os.mkdir(self.top)
+        os.mkdir(self.ap("a"))
+        os.mkdir(self.ap("a/s"))
+        self.cond = threading.Condition()
+        self.ino = Inotify(self.log, self.cond)
+        if not self.ino.ok:
+            raise unittest.SkipTest("inotify unavailable")
+
+        for zs in ["", "a", "a/s"]:
+            self.assertTrue(self.ino.watch(self.top, self.ap(zs)))
+
+    def tearDown(self):
+        if self.ino.fd >= 0:
+            os.close(self.ino.fd)
+
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def ap(self, rp):
+        return os.path.join(self.top, rp) if rp else self.top
+
+    def pop(self, want_gone=False):
+        # events arrive on the reader thread; wait for them to settle
+        t0 = time.time()
+        while time.time() - t0 < 5:
+            with self.cond:
+                self.cond.wait(0.1)
+
+            if self.ino.busy() and (self.ino.gone or not want_gone):
+                break
+
+        time.sleep(0.2)
+        dirty, gone, lost = self.ino.pop()
+        self.assertEqual(lost, set())
+        ap = len(self.top) + 1
+        dirty = {k[ap:]: v for k, v in dirty.get(self.top, {}).items()}
+        gone = set(x[ap:] for x in gone.get(self.top, set()))
+        return dirty, gone
+
+    def test(self):
+        # new file; only its folder is rescanned
+        with open(self.ap("a/s/f"), "wb") as f:
+            f.write(b"a")
+
+        self.assertEqual(self.pop(), ({"a/s": False}, set()))
+
+        # in-progress uploads are ignored
+        with open(self.ap("a/f.PARTIAL"), "wb") as f:
+            f.write(b"a")
+
+        with open(self.ap("a/g"), "wb") as f:
+            f.write(b"a")
+
+        self.assertEqual(self.pop(), ({"a": False}, set()))
+
+        # new folder; scanned recursively (not watched yet)
+        os.makedirs(self.ap("b/c"))
+        self.assertEqual(self.pop(), ({"": False, "b": True}, set()))
+
+        # folder moved within the volume; old path is gone,
+        # new path is rescanned and its old watches dropped
+        os.rename(self.ap("a"), self.ap("d"))
+        dirty, gone = self.pop(True)
+        self.assertEqual(gone, set(["a"]))
+        self.assertEqual(dirty.get("d"), True)
+        self.assertNotIn(self.ap("a/s"), self.ino.aps)
+
+        # deleted folder (watched by the rescan of b)
+        self.assertTrue(self.ino.watch(self.top, self.ap("b")))
+        os.rmdir(self.ap("b/c"))
+        dirty, gone = self.pop(True)
+        self.assertEqual(gone, set(["b/c"]))
+        self.assertNotIn("b/c", dirty)
+
+    def log(self, src, msg, c=0):
+        pass
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import util as tu
+from tests.util import Cfg
+
+from copyparty.authsrv import AuthSrv
+from copyparty.httpcli import HttpCli
+
+
+class TestLsCache(unittest.TestCase):
+    """large folder listings are kept in memory (--ls-cache)"""
+
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        os.chdir(self.td)
+        os.mkdir("d")
+        for n in range(70):
+            with open("d/f{}".format(n), "wb") as f:
+                f.write(b"a")
+
+        self.args = Cfg(v=[".::r"])
+        self.args.ls_cache = 65536
+        self.asrv = AuthSrv(self.args, self.log)
+        self.hsrv = tu.VHttpSrv(self.args)
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def get(self, url, etag=""):
+        h = "GET {} HTTP/1.1\r\nConnection: close\r\n".format(url)
+        if etag:
+            h += "If-None-Match: {}\r\n".format(etag)
+
+        conn = tu.VHttpConn(self.args, self.asrv, self.log, (h + "\r\n").encode())
+        conn.hsrv = self.hsrv
+        HttpCli(conn).run()
+        h, b = conn.s._reply.split(b"\r\n\r\n", 1)
+        hs = h.decode("utf-8").split("\r\n")
+        hd = dict(x.split(": ", 1) for x in hs[1:])
+        return int(hs[0].split(" ")[1]), hd.get("ETag"), b
+
+    def sz(self, b):
+        return {x["href"]: x["sz"] for x in json.loads(b)["files"]}["f0"]
+
+    def test(self):
+        st, tag, b = self.get("/d/?ls")
+        self.assertEqual(st, 200)
+        self.assertEqual(self.sz(b), 1)
+        self.assertEqual(len(self.hsrv.lsc), 1)
+
+        # resized in-place, folder mtime unchanged; second ?ls is
+        # served from the cache, so the change is not visible yet
+        dt = os.stat("d").st_mtime
+        with open("d/f0", "ab") as f:
+            f.write(b"bc")
+
+        os.utime("d", (dt, dt))
+        st, _, b = self.get("/d/?ls")
+        self.assertEqual(st, 200)
+        self.assertEqual(self.sz(b), 1)
+
+        # and the etag is the one of the cached listing
+        self.assertEqual(self.get("/d/?ls", tag)[0], 304)
+
+        # until up2k drops it (or it expires)
+        self.hsrv.lsc_drop([os.path.join(self.td, "d")])
+        st, tag2, b = self.get("/d/?ls", tag)
+        self.assertEqual(st, 200)
+        self.assertEqual(self.sz(b), 3)
+        self.assertNotEqual(tag2, tag)
+
+    def log(self, src, msg, c=0):
+        pass
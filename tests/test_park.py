@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import socket
+import subprocess as sp
+import sys
+import tempfile
+import time
+import unittest
+
+from tests import util as tu
+
+
+class TestPark(unittest.TestCase):
+    """idle keepalive connections are parked in a selector (--park)"""
+
+    def setUp(self):
+        if tu.ANYWIN or not os.path.exists("/proc/self/status"):
+            raise unittest.SkipTest("parking is linux/macos; test needs /proc")
+
+        self.td = tu.get_ramdisk()
+        with open(os.path.join(self.td, "f"), "wb") as f:
+            f.write(b"hello")
+
+        zs = socket.socket()
+        zs.bind(("127.0.0.1", 0))
+        self.port = zs.getsockname()[1]
+        zs.close()
+
+        top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=top)
+        argv = [sys.executable, "-m", "copyparty", "-q", "-i", "127.0.0.1"]
+        argv += ["-p", str(self.port), "-v", self.td + "::r"]
+        argv += ["--park", "0.1", "--s-thead", "5", "--no-fastboot"]
+        self.srv = sp.Popen(argv, env=env, cwd=self.td, stdout=sp.DEVNULL)
+
+        t0 = time.time()
+        while time.time() - t0 < 30:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 1).close()
+                return
+            except:
+                time.sleep(0.1)
+
+        raise Exception("server did not start")
+
+    def tearDown(self):
+        self.srv.kill()
+        self.srv.wait()
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def conn(self):
+        return socket.create_connection(("127.0.0.1", self.port), 5)
+
+    def get(self, sck):
+        sck.sendall(b"GET /f HTTP/1.1\r\nHost: a\r\n\r\n")
+        buf = b""
+        while not buf.endswith(b"\r\n\r\nhello"):
+            zb = sck.recv(4096)
+            if not zb:
+                break
+
+            buf += zb
+
+        return buf
+
+    def nthreads(self):
+        with open("/proc/{}/status".format(self.srv.pid), "rb") as f:
+            for ln in f.read().decode("utf-8").split("\n"):
+                if ln.startswith("Threads:"):
+                    return int(ln.split()[1])
+
+    def test(self):
+        # next request on a parked connection
+        sck = self.conn()
+        self.assertIn(b" 200 OK", self.get(sck))
+        time.sleep(0.5)
+        self.assertIn(b" 200 OK", self.get(sck))
+
+        # idle connections do not keep a thread each
+        # (without parking this would be base + 16)
+        base = self.nthreads()
+        scks = []
+        for _ in range(16):
+            zs = self.conn()
+            self.assertIn(b" 200 OK", self.get(zs))
+            scks.append(zs)
+            time.sleep(0.15)
+
+        self.assertLess(self.nthreads(), base + 8)
+
+        for zs in scks:
+            self.assertIn(b" 200 OK", self.get(zs))
+
+        # parked longer than --s-thead; closed by the server
+        sck.settimeout(15)
+        self.assertEqual(sck.recv(4096), b"")
+        for zs in [sck] + scks:
+            zs.close()
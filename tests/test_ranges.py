@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from tests import util as tu
+from tests.util import Cfg
+
+from copyparty.authsrv import AuthSrv
+from copyparty.httpcli import HttpCli
+
+
+class TestRanges(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        os.chdir(self.td)
+        self.body = bytes(bytearray(range(256))) * 4
+        with open("f", "wb") as f:
+            f.write(self.body)
+
+        self.args = Cfg(v=[".::r"])
+        self.asrv = AuthSrv(self.args, self.log)
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def get(self, hrange):
+        h = "GET /f HTTP/1.1\r\nRange: bytes={}\r\nConnection: close\r\n\r\n"
+        buf = h.format(hrange).encode("utf-8")
+        conn = tu.VHttpConn(self.args, self.asrv, self.log, buf)
+        HttpCli(conn).run()
+        h, b = conn.s._reply.split(b"\r\n\r\n", 1)
+        h = h.decode("utf-8")
+        return int(h.split(" ")[1]), h, b
+
+    def parts(self, h, b):
+        bnd = re.search(r"boundary=([0-9a-f]+)", h).group(1).encode("ascii")
+        ret = []
+        for zb in b.split(b"\r\n--" + bnd)[1:-1]:
+            ph, pb = zb.split(b"\r\n\r\n", 1)
+            zs = re.search(r"bytes ([0-9]+)-([0-9]+)/", ph.decode("utf-8"))
+            ret.append((int(zs.group(1)), int(zs.group(2)), pb))
+
+        return ret
+
+    def test_single(self):
+        st, h, b = self.get("10-19")
+        self.assertEqual(st, 206)
+        self.assertIn("Content-Range: bytes 10-19/1024", h)
+        self.assertEqual(b, self.body[10:20])
+
+        st, h, b = self.get("-24")
+        self.assertEqual(st, 206)
+        self.assertEqual(b, self.body[-24:])
+
+    def test_multi(self):
+        st, h, b = self.get("0-9, 100-109,1000-")
+        self.assertEqual(st, 206)
+        self.assertIn("multipart/byteranges", h)
+        parts = self.parts(h, b)
+        self.assertEqual([x[:2] for x in parts], [(0, 9), (100, 109), (1000, 1023)])
+        for lo, hi, zb in parts:
+            self.assertEqual(zb, self.body[lo : hi + 1])
+
+    def test_overlap(self):
+        # merged into one range
+        st, h, b = self.get("0-99,50-149")
+        self.assertEqual(st, 206)
+        self.assertIn("Content-Range: bytes 0-149/1024", h)
+        self.assertEqual(b, self.body[:150])
+
+        # adjacent ranges too
+        st, h, b = self.get("0-9,10-19,30-39")
+        self.assertEqual([x[:2] for x in self.parts(h, b)], [(0, 19), (30, 39)])
+
+    def test_repeated(self):
+        # more than the whole file; just send it once
+        st, h, b = self.get(",".join(["0-"] * 64))
+        self.assertEqual(st, 200)
+        self.assertEqual(b, self.body)
+
+        st, h, b = self.get("0-599,500-1023")
+        self.assertEqual(st, 200)
+        self.assertEqual(b, self.body)
+
+    def test_unordered(self):
+        st, h, b = self.get("500-599,0-99")
+        self.assertEqual(st, 200)
+        self.assertEqual(b, self.body)
+
+    def test_invalid(self):
+        # last before first; the whole header is ignored
+        st, h, b = self.get("500-100")
+        self.assertEqual(st, 200)
+        self.assertEqual(b, self.body)
+
+        st, h, b = self.get("0-9,500-100")
+        self.assertEqual(st, 200)
+        self.assertEqual(b, self.body)
+
+    def test_unsatisfiable(self):
+        st, h, b = self.get("2000-2999")
+        self.assertEqual(st, 416)
+        self.assertIn("Content-Range: bytes */1024", h)
+
+        # the satisfiable ones are still sent
+        st, h, b = self.get("0-9,2000-2999")
+        self.assertEqual(st, 206)
+        self.assertEqual(b, self.body[:10])
+
+    def log(self, src, msg, c=0):
+        pass
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from argparse import Namespace
+
+from tests import util as tu
+
+from copyparty.up2k import Up2k
+
+
+class TestSnap(unittest.TestCase):
+    """up2k.snap + up2k.snap.jnl; registry survives a crash mid-append"""
+
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        self.hp = os.path.join(self.td, "h")
+        self.ptop = os.path.join(self.td, "v")
+        os.mkdir(self.ptop)
+        self.up2k = self.mk()
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def mk(self):
+        # just the parts of Up2k which the snapshot code uses
+        u = Up2k.__new__(Up2k)
+        u.log_func = self.log
+        u.pp = None
+        u.args = Namespace(nw=False)
+        u.asrv = Namespace(vfs=Namespace(histtab={self.ptop: self.hp}))
+        u.mutex = threading.Lock()
+        u.snap_mutex = threading.Lock()
+        u.snap_jnl_mutex = threading.Lock()
+        u.registry = {self.ptop: {}}
+        u.droppable = {self.ptop: []}
+        u.snap_jnl = {self.ptop: []}
+        u.snap_gen = {self.ptop: None}
+        u.snap_jsz = {self.ptop: 0}
+        u.snap_lim = {self.ptop: 0}
+        return u
+
+    def job(self, wark, nchunks):
+        hashes = ["{}-c{}".format(wark, n) for n in range(nchunks)]
+        zd = {"wark": wark, "ptop": self.ptop, "prel": "", "name": wark}
+        zd.update({"hash": hashes, "need": list(hashes), "poke": 1, "busy": {}})
+        return zd
+
+    def add(self, job):
+        self.up2k.registry[self.ptop][job["wark"]] = job
+        self.up2k._jnl(self.ptop, "j", job["wark"], job)
+
+    def confirm(self, wark, chash, poke=1):
+        job = self.up2k.registry[self.ptop][wark]
+        job["need"].remove(chash)
+        job["poke"] = poke
+        self.up2k._jnl(self.ptop, "c", wark, [chash, poke])
+
+    def load(self):
+        # what register_vpath does on startup
+        path = os.path.join(self.hp, "up2k.snap")
+        with gzip.GzipFile(path, "rb") as f:
+            zd = json.loads(f.read().decode("utf-8"))
+
+        reg, drp = zd["registry"], zd["droppable"]
+        n = self.up2k._jnl_replay(path + ".jnl", zd.get("gen"), reg, drp)
+        return reg, drp, n
+
+    def need(self, reg):
+        return {k: v["need"] for k, v in reg.items()}
+
+    def test(self):
+        u = self.up2k
+        self.add(self.job("a", 3))
+        u.do_snapshot()
+
+        # first flush after startup writes a full snapshot
+        reg, _, n = self.load()
+        self.assertEqual(n, 0)
+        self.assertEqual(self.need(reg), {"a": ["a-c0", "a-c1", "a-c2"]})
+
+        # then changes are only appended to the journal
+        snap_st = os.stat(os.path.join(self.hp, "up2k.snap"))
+        self.confirm("a", "a-c1")
+        self.add(self.job("b", 2))
+        self.confirm("b", "b-c0")
+        u.do_snapshot()
+        self.assertEqual(snap_st.st_mtime, os.stat(self.hp + "/up2k.snap").st_mtime)
+
+        reg, _, n = self.load()
+        self.assertEqual(n, 3)
+        want = {"a": ["a-c0", "a-c2"], "b": ["b-c1"]}
+        self.assertEqual(self.need(reg), want)
+
+        # and the last activity of each upload, same as a full snapshot
+        self.confirm("b", "b-c1", 1234)
+        u.do_snapshot()
+        reg, _, n = self.load()
+        self.assertEqual(n, 4)
+        self.assertEqual(reg["b"]["poke"], 1234)
+        self.assertEqual(reg["a"]["poke"], 1)
+
+        # killed halfway through an append; replay stops before it
+        self.confirm("a", "a-c0")
+        del u.registry[self.ptop]["b"]
+        u._jnl(self.ptop, "d", "b")
+        u.do_snapshot()
+        with open(self.hp + "/up2k.snap.jnl", "ab") as f:
+            f.write(b'["c", "a", "a-')
+
+        reg, _, n = self.load()
+        self.assertEqual(n, 6)
+        self.assertEqual(self.need(reg), {"a": ["a-c2"]})
+
+        # after a restart, the first flush compacts into a new snapshot
+        u = self.up2k = self.mk()
+        u.registry[self.ptop] = reg
+        u.do_snapshot()
+        reg, _, n = self.load()
+        self.assertEqual(n, 0)
+        self.assertEqual(self.need(reg), {"a": ["a-c2"]})
+
+    def test_stale_journal(self):
+        u = self.up2k
+        self.add(self.job("a", 2))
+        u.do_snapshot()
+        self.confirm("a", "a-c0")
+        u.do_snapshot()
+
+        # journal of an older snapshot (crash between the two renames)
+        jnl = self.hp + "/up2k.snap.jnl"
+        with open(jnl, "rb") as f:
+            old = f.read()
+
+        u.snap_gen[self.ptop] = None
+        u._jnl(self.ptop, "d", "a")
+        del u.registry[self.ptop]["a"]
+        self.add(self.job("b", 1))
+        u.do_snapshot()
+        with open(jnl, "wb") as f:
+            f.write(old)
+
+        reg, _, n = self.load()
+        self.assertEqual(n, -1)
+        self.assertEqual(self.need(reg), {"b": ["b-c0"]})
+
+    def log(self, src, msg, c=0):
+        pass
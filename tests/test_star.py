@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from tests import util as tu
+
+from copyparty.star import StreamTar
+from copyparty.sutil import Prefetch
+
+
+class TestStreamTar(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        os.chdir(self.td)
+        os.mkdir("d")
+        self.files = []
+        for n, sz in enumerate([0, 1, 511, 512, 513, 70000, 600 * 1024]):
+            fn = "d/f{}-{}".format(n, sz)
+            with open(fn, "wb") as f:
+                f.write(os.urandom(sz))
+
+            self.files.append(fn)
+
+        fn = "d/" + "ロング名前" * 12
+        with open(fn, "wb") as f:
+            f.write(b"long name")
+
+        self.files.append(fn)
+
+    def tearDown(self):
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def fgen(self):
+        for fn in ["d"] + self.files:
+            yield {"vp": fn, "ap": os.path.abspath(fn), "st": os.stat(fn)}
+
+    def stream(self, fgen):
+        ret = []
+        for buf in StreamTar(self.log, fgen).gen():
+            if buf is None:
+                break
+
+            if isinstance(buf, tuple):
+                ap, sz = buf
+                with open(ap, "rb") as f:
+                    buf = f.read(sz)
+
+            ret.append(buf)
+
+        return b"".join(ret)
+
+    def reference(self):
+        bio = io.BytesIO()
+        with tarfile.open(fileobj=bio, mode="w", format=tarfile.GNU_FORMAT) as tar:
+            for fn in self.files:
+                st = os.stat(fn)
+                inf = tarfile.TarInfo(name=fn)
+                inf.mode = st.st_mode
+                inf.size = st.st_size
+                inf.mtime = int(st.st_mtime)
+                with open(fn, "rb") as f:
+                    tar.addfile(inf, f)
+
+        return bio.getvalue()
+
+    def test_tarfile(self):
+        ref = self.reference()
+        self.assertEqual(self.stream(self.fgen()), ref)
+
+        fgen = Prefetch(self.log, self.fgen(), 4).gen()
+        self.assertEqual(self.stream(fgen), ref)
+
+        with tarfile.open(fileobj=io.BytesIO(ref)) as tar:
+            self.assertEqual(tar.getnames(), self.files)
+
+    def test_prefetch_changed(self):
+        # file grows between stat and prefetch; must not be buffered
+        fn = self.files[2]
+        f = {"vp": fn, "ap": os.path.abspath(fn), "st": os.stat(fn)}
+        with open(fn, "ab") as fo:
+            fo.write(b"more")
+
+        ret = list(Prefetch(self.log, iter([f]), 4).gen())
+        self.assertNotIn("buf", ret[0])
+
+        # unchanged file is
+        fn = self.files[3]
+        f = {"vp": fn, "ap": os.path.abspath(fn), "st": os.stat(fn)}
+        ret = list(Prefetch(self.log, iter([f]), 4).gen())
+        self.assertEqual(len(ret[0]["buf"]), 512)
+
+    def log(self, msg, c=0):
+        pass
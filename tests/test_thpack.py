@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import util as tu
+
+from copyparty import th_pack
+from copyparty.th_pack import ThPack
+
+
+class TestThPack(unittest.TestCase):
+    def setUp(self):
+        self.td = tu.get_ramdisk()
+        self.hp = os.path.join(self.td, "h")
+        os.mkdir(self.hp)
+        self.seg_sz = th_pack.SEG_SZ
+        th_pack.SEG_SZ = 3000
+
+    def tearDown(self):
+        th_pack.SEG_SZ = self.seg_sz
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(self.td)
+
+    def tp(self, d, f, ts):
+        return "{}/th/{}/{}.{:x}.jpg".format(self.hp, d, f, ts)
+
+    def put(self, zp, tpath, buf):
+        src = zp.tmp(tpath)
+        with open(src, "wb") as f:
+            f.write(buf)
+
+        zp.put(tpath, src)
+        self.assertFalse(os.path.exists(src))
+
+    def read(self, zp, tpath):
+        ap, ofs, sz = zp.find(tpath)
+        with open(ap, "rb") as f:
+            f.seek(ofs)
+            return f.read(sz)
+
+    def segs(self):
+        return sorted(x for x in os.listdir(self.hp + "/thp") if x.endswith(".seg"))
+
+    def test(self):
+        zw = ThPack(self.log, self.hp, False)
+        zr = ThPack(self.log, self.hp, True)
+        self.assertIsNone(zr.find(self.tp("a/b", "x", 1)))
+
+        for n in range(10):
+            self.put(zw, self.tp("d%d" % (n % 2), "f%d" % n, 5), bytes([n]) * 1000)
+
+        self.assertEqual(self.segs(), ["1.seg", "2.seg", "3.seg", "4.seg"])
+        for n in range(10):
+            tpath = self.tp("d%d" % (n % 2), "f%d" % n, 5)
+            self.assertEqual(self.read(zr, tpath), bytes([n]) * 1000)
+
+        # failed conversion; empty
+        self.put(zw, self.tp("d1", "bad", 5), b"")
+        self.assertEqual(zr.find(self.tp("d1", "bad", 5))[2], 0)
+
+        # new version of a file replaces the old one
+        self.put(zw, self.tp("d1", "f3", 6), b"N" * 500)
+        self.assertIsNone(zr.find(self.tp("d1", "f3", 5)))
+        self.assertEqual(self.read(zr, self.tp("d1", "f3", 6)), b"N" * 500)
+
+        # d0 expires, d1 was poked
+        cur = zw._cur()
+        cur.execute("update th set at=at-1000")
+        cur.connection.commit()
+        zw.touch(self.hp + "/th/d1")
+        nrm, nmv = zw.clean(100)
+        self.assertEqual(nrm, 5)
+        self.assertEqual(nmv, 3000)
+        self.assertIsNone(zr.find(self.tp("d0", "f0", 5)))
+        for n in (1, 5, 7, 9):
+            tpath = self.tp("d1", "f%d" % n, 5)
+            self.assertEqual(self.read(zr, tpath), bytes([n]) * 1000)
+
+        # compacted segments stay until the next clean,
+        # even if the server restarts in between
+        self.assertIn("1.seg", self.segs())
+        zw.cur.connection.close()
+        zw.wf.close()
+        zw = ThPack(self.log, self.hp, False)
+        zw.clean(100)
+        self.assertEqual(self.segs(), ["4.seg", "5.seg"])
+        self.assertEqual(self.read(zr, self.tp("d1", "f3", 6)), b"N" * 500)
+
+        # and the writer continues where it left off
+        self.put(zw, self.tp("d2", "f", 1), b"z")
+        self.assertEqual(self.read(zr, self.tp("d2", "f", 1)), b"z")
+        self.assertEqual(zw.seg, 5)
+
+    def log(self, src, msg, c=0):
+        print(msg)
@@ -32,6 +32,7 @@ if MACOS:
 
 from copyparty.__init__ import E
 from copyparty.__main__ import init_E
+from copyparty.httpsrv import HttpSrv
 from copyparty.util import Unrecv, FHC
 
 init_E(E)
@@ -98,10 +99,10 @@ class Cfg(Namespace):
     def __init__(self, a=None, v=None, c=None):
         ka = {}
 
-        ex = "daw dav_auth dav_inf dav_mac dav_rt dotsrch e2d e2ds e2dsa e2t e2ts e2tsr e2v e2vu e2vp ed emp force_js getmod grid hardlink ih ihead magic never_symlink nid nih no_acode no_athumb no_dav no_dedup no_del no_dupe no_logues no_mv no_readme no_robots no_sb_md no_sb_lg no_scandir no_thumb no_vthumb no_zip nrand nw rand vc xdev xlink xvol"
+        ex = "daw dav_auth dav_inf dav_mac dav_rt dotsrch e2d e2ds e2dsa e2t e2ts e2tsr e2v e2vu e2vp ed emp force_js getmod grid hardlink idx_crc ih ihead inotify magic never_symlink nid nih no_acode no_athumb no_dav no_dedup no_del no_dupe no_logues no_mv no_readme no_robots no_sb_md no_sb_lg no_scandir no_thumb no_vthumb no_zip nrand nw rand srch_fts th_pack th_pre vc xdev xlink xvol"
         ka.update(**{k: False for k in ex.split()})
 
-        ex = "dotpart no_rescan no_sendfile no_voldump plain_ip"
+        ex = "dotpart no_cpr_cache no_rescan no_sendfile no_voldump plain_ip"
         ka.update(**{k: True for k in ex.split()})
 
         ex = "css_browser hist js_browser no_forget no_hash no_idx"
@@ -126,6 +127,11 @@ class Cfg(Namespace):
             E=E,
             dbd="wal",
             s_wr_sz=512 * 1024,
+            zip_pf=16,
+            zip_clen=0,
+            ls_cache=0,
+            ls_cache_ttl=30,
+            park=-1,
             unpost=600,
             u2sort="s",
             mtp=[],
@@ -167,11 +173,21 @@ class VSock(object):
 
 
 class VHttpSrv(object):
-    def __init__(self):
+    lsc_get = HttpSrv.lsc_get
+    lsc_put = HttpSrv.lsc_put
+    lsc_drop = HttpSrv.lsc_drop
+
+    def __init__(self, args=None):
+        self.args = args
         self.broker = NullBroker()
         self.prism = None
         self.bans = {}
 
+        self.lsc = {}
+        self.lsc_n = 0
+        self.lsc_gen = 0
+        self.lsc_mutex = threading.Lock()
+
         aliases = ["splash", "browser", "browser2", "msg", "md", "mde"]
         self.j2 = {x: J2_FILES for x in aliases}
 
@@ -190,7 +206,7 @@ class VHttpConn(object):
         self.log_func = log
         self.log_src = "a"
         self.lf_url = None
-        self.hsrv = VHttpSrv()
+        self.hsrv = VHttpSrv(args)
         self.bans = {}
         self.aclose = {}
         self.u2fh = FHC()